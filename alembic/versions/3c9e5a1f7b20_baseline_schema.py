@@ -0,0 +1,82 @@
+"""Baseline schema
+
+The tables the app created with ``create_all`` before it used Alembic.
+Databases created that way are stamped with this revision.
+
+Revision ID: 3c9e5a1f7b20
+Revises:
+Create Date: 2026-10-18 15:08:39.764880
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "3c9e5a1f7b20"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "magazines",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("base_price", sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_magazines_base_price", "magazines", ["base_price"])
+    op.create_index("ix_magazines_id", "magazines", ["id"])
+    op.create_index("ix_magazines_title", "magazines", ["title"])
+
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("username", sa.String(), nullable=True),
+        sa.Column("email", sa.String(), nullable=True),
+        sa.Column("password", sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_username", "users", ["username"])
+
+    op.create_table(
+        "plans",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("price", sa.Integer(), nullable=True),
+        sa.Column("magazine_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["magazine_id"], ["magazines.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_plans_id", "plans", ["id"])
+    op.create_index("ix_plans_name", "plans", ["name"])
+
+    op.create_table(
+        "subscriptions",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("plan_id", sa.Integer(), nullable=True),
+        sa.Column("price", sa.Float(), nullable=True),
+        sa.Column("next_renewal_date", sa.Date(), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(["plan_id"], ["plans.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_subscriptions_id", "subscriptions", ["id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("subscriptions")
+    op.drop_table("plans")
+    op.drop_table("users")
+    op.drop_table("magazines")
@@ -0,0 +1,179 @@
+"""Catalog prices, table versions, partial indexes and search
+
+Adds everything the models gained since the baseline, fills the new
+columns and ``plan_prices`` for existing rows and indexes the existing
+magazines for full-text search.
+
+Revision ID: b84d2e6a0f17
+Revises: 3c9e5a1f7b20
+Create Date: 2026-10-18 16:02:11.408215
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "b84d2e6a0f17"
+down_revision: Union[str, Sequence[str], None] = "3c9e5a1f7b20"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Copied from app/search.py as of this revision
+POSTGRES_SEARCH_DDL = [
+    "ALTER TABLE magazines ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX ix_magazines_search_vector ON magazines USING GIN (search_vector)",
+]
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE magazines_fts USING fts5("
+    "title, description, content='magazines', content_rowid='id', "
+    "tokenize='porter unicode61')",
+    "CREATE TRIGGER magazines_fts_insert AFTER INSERT ON magazines BEGIN "
+    "INSERT INTO magazines_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER magazines_fts_delete AFTER DELETE ON magazines BEGIN "
+    "INSERT INTO magazines_fts(magazines_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER magazines_fts_update AFTER UPDATE ON magazines BEGIN "
+    "INSERT INTO magazines_fts(magazines_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO magazines_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+    # The triggers only see later writes; index the magazines already there
+    "INSERT INTO magazines_fts(magazines_fts) VALUES ('rebuild')",
+]
+POSTGRES_DROP_SEARCH_DDL = [
+    "DROP INDEX ix_magazines_search_vector",
+    "ALTER TABLE magazines DROP COLUMN search_vector",
+]
+SQLITE_DROP_SEARCH_DDL = [
+    "DROP TRIGGER magazines_fts_insert",
+    "DROP TRIGGER magazines_fts_delete",
+    "DROP TRIGGER magazines_fts_update",
+    "DROP TABLE magazines_fts",
+]
+
+# Just the columns the data steps need, as of this revision
+magazines = sa.table(
+    "magazines", sa.column("id", sa.Integer()), sa.column("base_price", sa.Float())
+)
+plans = sa.table(
+    "plans",
+    sa.column("id", sa.Integer()),
+    sa.column("magazine_id", sa.Integer()),
+    sa.column("discount", sa.Float()),
+    sa.column("renewal_period", sa.Integer()),
+)
+plan_prices = sa.table(
+    "plan_prices",
+    sa.column("plan_id", sa.Integer()),
+    sa.column("magazine_id", sa.Integer()),
+    sa.column("price", sa.Float()),
+)
+users = sa.table("users", sa.column("is_active", sa.Boolean()))
+
+
+def is_active():
+    # Compiles to each dialect's boolean literal, like the models' indexes
+    return sa.column("is_active", sa.Boolean()).is_(True)
+
+
+def plan_price_source():
+    # Copied from crud._plan_price_source as of this revision
+    price = sa.func.round(
+        sa.cast(
+            magazines.c.base_price * (1 - sa.func.coalesce(plans.c.discount, 0)),
+            sa.Numeric,
+        ),
+        2,
+    )
+    return sa.select(plans.c.id, plans.c.magazine_id, price).join(
+        magazines, plans.c.magazine_id == magazines.c.id
+    )
+
+
+def run_search_ddl(statements: dict):
+    for statement in statements.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("users", sa.Column("is_active", sa.Boolean(), nullable=True))
+    op.add_column("plans", sa.Column("discount", sa.Float(), nullable=True))
+    op.add_column("plans", sa.Column("renewal_period", sa.Integer(), nullable=True))
+    # The models' defaults, for the rows written before the columns existed
+    op.execute(users.update().values(is_active=True))
+    op.execute(plans.update().values(discount=0.0, renewal_period=1))
+
+    op.create_table(
+        "table_versions",
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+
+    op.create_table(
+        "plan_prices",
+        sa.Column("plan_id", sa.Integer(), nullable=False),
+        sa.Column("magazine_id", sa.Integer(), nullable=True),
+        sa.Column("price", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["magazine_id"], ["magazines.id"]),
+        sa.ForeignKeyConstraint(["plan_id"], ["plans.id"]),
+        sa.PrimaryKeyConstraint("plan_id"),
+    )
+    op.create_index("ix_plan_prices_magazine_id", "plan_prices", ["magazine_id"])
+    op.execute(
+        plan_prices.insert().from_select(
+            ["plan_id", "magazine_id", "price"], plan_price_source()
+        )
+    )
+
+    op.create_index(
+        "ix_subscriptions_renewal_due",
+        "subscriptions",
+        ["next_renewal_date", "id"],
+        postgresql_where=is_active(),
+        sqlite_where=is_active(),
+    )
+    # Fails while a user has two active subscriptions to the same plan;
+    # deactivate the extra ones before upgrading
+    op.create_index(
+        "uq_subscriptions_active_user_plan",
+        "subscriptions",
+        ["user_id", "plan_id"],
+        unique=True,
+        postgresql_where=is_active(),
+        sqlite_where=is_active(),
+    )
+    op.create_index(
+        "ix_subscriptions_user_active",
+        "subscriptions",
+        ["user_id", "id"],
+        postgresql_where=is_active(),
+        sqlite_where=is_active(),
+    )
+
+    run_search_ddl({"postgresql": POSTGRES_SEARCH_DDL, "sqlite": SQLITE_SEARCH_DDL})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    run_search_ddl(
+        {"postgresql": POSTGRES_DROP_SEARCH_DDL, "sqlite": SQLITE_DROP_SEARCH_DDL}
+    )
+    op.drop_index("ix_subscriptions_user_active", table_name="subscriptions")
+    op.drop_index("uq_subscriptions_active_user_plan", table_name="subscriptions")
+    op.drop_index("ix_subscriptions_renewal_due", table_name="subscriptions")
+    op.drop_table("plan_prices")
+    op.drop_table("table_versions")
+    with op.batch_alter_table("plans") as batch_op:
+        batch_op.drop_column("renewal_period")
+        batch_op.drop_column("discount")
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("is_active")
@@ -0,0 +1,457 @@
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from . import models, schemas
+from .counts import (
+    cache_key,
+    count_cache,
+    estimate_statement,
+    exact_statement,
+    parse_estimate,
+)
+from .crud import (
+    active_subscription_insert,
+    magazine_plans_exist,
+    plan_subscriptions_exist,
+    still_referenced,
+    missing_plan_prices_statement,
+    plan_price_statements,
+    price_source_lock,
+    unpriced_plans,
+    subscription_values,
+    table_version_bump,
+    table_version_query,
+    table_versions,
+    EPOCH,
+    subscription_conflict,
+    subscription_integrity_error,
+    merge_bulk_errors,
+    plan_prices_query,
+    price_subscription_rows,
+    unpriced_plan,
+    unpriced_plan_ids,
+    subscription_export_query,
+    user_subscription_criteria,
+    user_subscriptions_query,
+    magazine_cache,
+    plan_cache,
+)
+from .models import User
+from .search import has_terms, search_statement
+from .passwords import hash_password_async, verify_password_async
+from .serialization import schema_columns
+
+
+async def _returning(db: AsyncSession, stmt, model, commit: bool = True):
+    result = await db.execute(stmt.returning(*model.__table__.columns))
+    row = result.first()
+    if commit:
+        await db.commit()
+    return row
+
+
+async def _update(
+    db: AsyncSession, model, row_id: int, values: dict, commit: bool = True
+):
+    if not values:
+        result = await db.execute(
+            select(*model.__table__.columns).where(model.id == row_id)
+        )
+        return result.first()
+    stmt = update(model).where(model.id == row_id).values(**values)
+    return await _returning(db, stmt, model, commit=commit)
+
+
+async def _lock_price_source(db: AsyncSession, plans):
+    lock = price_source_lock(db.get_bind().dialect.name, plans)
+    if lock is not None:
+        await db.execute(lock)
+
+
+async def refresh_plan_prices(
+    db: AsyncSession, plan_id: int = None, magazine_id: int = None
+):
+    if plan_id is not None:
+        await _lock_price_source(db, models.Plan.id == plan_id)
+    for stmt in plan_price_statements(plan_id, magazine_id):
+        await db.execute(stmt)
+
+
+async def backfill_plan_prices(db: AsyncSession):
+    await _lock_price_source(db, unpriced_plans())
+    await db.execute(missing_plan_prices_statement())
+    await db.commit()
+
+
+async def bump_table_version(db: AsyncSession, table: str):
+    await db.execute(table_version_bump(db.get_bind().dialect.name, table))
+    await db.commit()
+    table_versions.invalidate(table)
+
+
+async def get_table_version(db: AsyncSession, table: str):
+    if db.info.get("replica"):
+        row = (await db.execute(table_version_query(table))).first()
+        return tuple(row) if row else (0, EPOCH)
+    cached = table_versions.get(table)
+    if cached is None:
+        version = table_versions.version
+        row = (await db.execute(table_version_query(table))).first()
+        cached = tuple(row) if row else (0, EPOCH)
+        table_versions.set(table, cached, version=version)
+    return cached
+
+
+async def _paginate(
+    db: AsyncSession, model, skip: int, limit: int, after: int = None, stmt=None
+):
+    stmt = (select(model) if stmt is None else stmt).order_by(model.id)
+    if after is not None:
+        stmt = stmt.where(model.id > after)
+    result = await db.scalars(stmt.offset(skip).limit(limit))
+    return result.all()
+
+
+async def _paginate_rows(db: AsyncSession, model, schema, skip, limit, after=None):
+    stmt = select(*schema_columns(model, schema)).order_by(model.id)
+    if after is not None:
+        stmt = stmt.where(model.id > after)
+    result = await db.execute(stmt.offset(skip).limit(limit))
+    return result.all()
+
+
+async def count_rows(db: AsyncSession, model, mode: str, *criteria):
+    if mode == "estimated":
+        stmt = estimate_statement(db.get_bind().dialect.name, model, criteria)
+        estimate = parse_estimate(await db.scalar(stmt)) if stmt is not None else None
+        if estimate is not None:
+            return estimate
+    key = cache_key(model, criteria)
+    total = count_cache.get(key)
+    if total is None:
+        version = count_cache.version
+        total = await db.scalar(exact_statement(model, criteria))
+        count_cache.set(key, total, version=version)
+    return total
+
+
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.scalar(
+        select(models.User).where(models.User.id == user_id).limit(1)
+    )
+
+
+async def get_users(
+    db: AsyncSession, skip: int = 0, limit: int = 10, after: int = None
+):
+    return await _paginate(db, models.User, skip, limit, after)
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    stmt = insert(models.User).values(
+        username=user.username,
+        email=user.email,
+        password=await hash_password_async(user.password),
+        is_active=True,
+    )
+    return await _returning(db, stmt, models.User)
+
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(
+        select(models.User).where(models.User.username == username).limit(1)
+    )
+
+
+async def get_user_by_auth(db: AsyncSession, auth: schemas.AuthContext):
+    if auth.user_id is not None:
+        return await get_user(db, auth.user_id)
+    # Tokens issued before the uid claim was added only carry the username
+    return await get_user_by_username(db, auth.username)
+
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(
+        select(models.User).where(models.User.email == email).limit(1)
+    )
+
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_username(db, username)
+    if not user:
+        return False
+    # Hand the connection back to the pool while bcrypt runs
+    db.expunge(user)
+    await db.rollback()
+    valid, new_hash = await verify_password_async(password, user.password)
+    if not valid:
+        return False
+    if new_hash:
+        user.password = new_hash
+        await db.merge(user)
+        await db.commit()
+    return user
+
+
+async def get_magazine(db: AsyncSession, magazine_id: int):
+    return await db.scalar(
+        select(models.Magazine).where(models.Magazine.id == magazine_id).limit(1)
+    )
+
+
+async def get_magazine_cached(db: AsyncSession, magazine_id: int):
+    magazine = magazine_cache.get(magazine_id)
+    if magazine is None:
+        version = magazine_cache.version
+        db_magazine = await get_magazine(db, magazine_id)
+        if db_magazine is None:
+            return None
+        magazine = schemas.Magazine.model_validate(db_magazine, from_attributes=True)
+        magazine_cache.set(magazine_id, magazine, version=version)
+    return magazine
+
+
+async def get_magazines(
+    db: AsyncSession, skip: int = 0, limit: int = 10, after: int = None
+):
+    return await _paginate_rows(
+        db, models.Magazine, schemas.Magazine, skip, limit, after
+    )
+
+
+async def search_magazines(db: AsyncSession, q: str, limit: int = 10, after=None):
+    if not has_terms(q):
+        return []
+    stmt = search_statement(db.get_bind().dialect.name, q, limit, after)
+    result = await db.execute(stmt)
+    return result.all()
+
+
+async def get_catalog(db: AsyncSession, limit: int = 10, after: int = None):
+    stmt = select(models.Magazine).options(
+        selectinload(models.Magazine.plans).joinedload(models.Plan.price_entry)
+    )
+    return await _paginate(db, models.Magazine, 0, limit, after, stmt=stmt)
+
+
+async def create_magazine(db: AsyncSession, magazine: schemas.MagazineCreate):
+    stmt = insert(models.Magazine).values(**magazine.model_dump())
+    db_magazine = await _returning(db, stmt, models.Magazine, commit=False)
+    await bump_table_version(db, "magazines")
+    magazine_cache.invalidate(db_magazine.id)
+    return db_magazine
+
+
+async def update_magazine(
+    db: AsyncSession, magazine_id: int, magazine: schemas.MagazineCreate
+):
+    return await _write_magazine(db, magazine_id, magazine.model_dump())
+
+
+async def patch_magazine(
+    db: AsyncSession, magazine_id: int, magazine: schemas.MagazinePatch
+):
+    values = magazine.model_dump(exclude_unset=True)
+    return await _write_magazine(db, magazine_id, values)
+
+
+async def _write_magazine(db: AsyncSession, magazine_id: int, values: dict):
+    db_magazine = await _update(db, models.Magazine, magazine_id, values, commit=False)
+    if db_magazine is not None and values:
+        if "base_price" in values:
+            await refresh_plan_prices(db, magazine_id=magazine_id)
+        await bump_table_version(db, "magazines")
+    magazine_cache.invalidate(magazine_id)
+    return db_magazine
+
+
+async def delete_magazine(db: AsyncSession, magazine_id: int):
+    has_plans = magazine_plans_exist(magazine_id)
+    stmt = delete(models.Magazine).where(models.Magazine.id == magazine_id, ~has_plans)
+    db_magazine = await _returning(db, stmt, models.Magazine, commit=False)
+    if db_magazine is None:
+        await db.rollback()
+        if await db.scalar(select(has_plans)):
+            raise still_referenced("Magazine still has plans")
+        return None
+    await bump_table_version(db, "magazines")
+    magazine_cache.invalidate(magazine_id)
+    return db_magazine
+
+
+async def get_plan(db: AsyncSession, plan_id: int):
+    return await db.scalar(
+        select(models.Plan).where(models.Plan.id == plan_id).limit(1)
+    )
+
+
+async def get_plan_cached(db: AsyncSession, plan_id: int):
+    plan = plan_cache.get(plan_id)
+    if plan is None:
+        version = plan_cache.version
+        db_plan = await get_plan(db, plan_id)
+        if db_plan is None:
+            return None
+        plan = schemas.Plan.model_validate(db_plan, from_attributes=True)
+        plan_cache.set(plan_id, plan, version=version)
+    return plan
+
+
+async def get_plans(
+    db: AsyncSession, skip: int = 0, limit: int = 10, after: int = None
+):
+    return await _paginate_rows(db, models.Plan, schemas.Plan, skip, limit, after)
+
+
+async def create_plan(db: AsyncSession, plan: schemas.PlanCreate):
+    stmt = insert(models.Plan).values(**plan.model_dump())
+    db_plan = await _returning(db, stmt, models.Plan, commit=False)
+    await refresh_plan_prices(db, plan_id=db_plan.id)
+    await bump_table_version(db, "plans")
+    plan_cache.invalidate(db_plan.id)
+    return db_plan
+
+
+async def update_plan(db: AsyncSession, plan_id: int, plan: schemas.PlanCreate):
+    return await _write_plan(db, plan_id, plan.model_dump())
+
+
+async def patch_plan(db: AsyncSession, plan_id: int, plan: schemas.PlanPatch):
+    return await _write_plan(db, plan_id, plan.model_dump(exclude_unset=True))
+
+
+async def _write_plan(db: AsyncSession, plan_id: int, values: dict):
+    db_plan = await _update(db, models.Plan, plan_id, values, commit=False)
+    if db_plan is not None and values:
+        await refresh_plan_prices(db, plan_id=plan_id)
+        await bump_table_version(db, "plans")
+    plan_cache.invalidate(plan_id)
+    return db_plan
+
+
+async def delete_plan(db: AsyncSession, plan_id: int):
+    has_subscriptions = plan_subscriptions_exist(plan_id)
+    await db.execute(plan_price_statements(plan_id=plan_id)[0])
+    stmt = delete(models.Plan).where(models.Plan.id == plan_id, ~has_subscriptions)
+    db_plan = await _returning(db, stmt, models.Plan, commit=False)
+    if db_plan is None:
+        await db.rollback()
+        if await db.scalar(select(has_subscriptions)):
+            raise still_referenced("Plan still has subscriptions")
+        return None
+    await bump_table_version(db, "plans")
+    plan_cache.invalidate(plan_id)
+    return db_plan
+
+
+async def get_subscription(db: AsyncSession, subscription_id: int):
+    return await db.scalar(
+        select(models.Subscription)
+        .where(models.Subscription.id == subscription_id)
+        .limit(1)
+    )
+
+
+async def get_subscriptions(
+    db: AsyncSession, skip: int = 0, limit: int = 10, after: int = None
+):
+    return await _paginate_rows(
+        db, models.Subscription, schemas.Subscription, skip, limit, after
+    )
+
+
+async def get_user_subscriptions(
+    db: AsyncSession, user_id: int, limit: int = 10, after=None
+):
+    result = await db.scalars(user_subscriptions_query(user_id, limit, after))
+    return result.all()
+
+
+async def iter_subscriptions(
+    db: AsyncSession,
+    user_id=None,
+    plan_id=None,
+    is_active=None,
+    batch_size: int = 1000,
+):
+    stmt = subscription_export_query(user_id, plan_id, is_active)
+    result = await db.stream(stmt.execution_options(yield_per=batch_size))
+    async for partition in result.partitions():
+        yield partition
+
+
+async def create_subscription(
+    db: AsyncSession, subscription: schemas.SubscriptionCreate
+):
+    values = subscription_values(subscription)
+    stmt = active_subscription_insert(db.get_bind().dialect.name, values)
+    try:
+        db_subscription = await _returning(db, stmt, models.Subscription, commit=False)
+    except IntegrityError as exc:
+        await db.rollback()
+        raise subscription_integrity_error(exc)
+    if db_subscription is None:
+        raise subscription_conflict()
+    if db_subscription.price is None:
+        await db.rollback()
+        raise unpriced_plan(subscription.plan_id)
+    await db.commit()
+    return db_subscription
+
+
+async def _update_subscription(db: AsyncSession, subscription_id: int, values: dict):
+    try:
+        return await _update(db, models.Subscription, subscription_id, values)
+    except IntegrityError as exc:
+        await db.rollback()
+        raise subscription_integrity_error(exc)
+
+
+async def update_subscription(
+    db: AsyncSession, subscription_id: int, subscription: schemas.SubscriptionUpdate
+):
+    values = subscription.model_dump()
+    return await _update_subscription(db, subscription_id, values)
+
+
+async def patch_subscription(
+    db: AsyncSession, subscription_id: int, subscription: schemas.SubscriptionPatch
+):
+    values = subscription.model_dump(exclude_unset=True)
+    return await _update_subscription(db, subscription_id, values)
+
+
+async def delete_subscription(db: AsyncSession, subscription_id: int):
+    values = {"is_active": False}
+    return await _update(db, models.Subscription, subscription_id, values)
+
+
+async def bulk_create_subscriptions(db: AsyncSession, rows: list):
+    plan_ids = unpriced_plan_ids(rows)
+    prices = {}
+    if plan_ids:
+        prices = dict((await db.execute(plan_prices_query(plan_ids))).all())
+    rows, price_errors = price_subscription_rows(rows, prices)
+    inserted, errors = await bulk_create(db, models.Subscription, rows)
+    return inserted, merge_bulk_errors(price_errors, errors)
+
+
+async def bulk_create(db: AsyncSession, model, rows: list):
+    try:
+        await db.execute(insert(model), [values for _, values in rows])
+        await db.commit()
+        return len(rows), []
+    except DBAPIError:
+        await db.rollback()
+    inserted = 0
+    errors = []
+    for index, values in rows:
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(model), [values])
+            inserted += 1
+        except DBAPIError as exc:
+            errors.append({"index": index, "error": str(exc.orig)})
+    await db.commit()
+    return inserted, errors
@@ -0,0 +1,453 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordBearer
+from . import bulk, export, models, schemas, async_crud as crud
+from .db import get_async_db as get_db, get_async_read_db as get_read_db
+from .querylog import QueryBudget, QueryBudgetRoute
+from .counts import CountMode, set_total_count
+from .etags import catalog_headers, catalog_row
+from .serialization import page_response, rows_response
+from .pagination import (
+    MAX_LIMIT,
+    MAX_SKIP,
+    decode_cursor,
+    decode_rank_cursor,
+    set_next_cursor,
+    set_next_rank_cursor,
+)
+from .jwt import (
+    create_access_token,
+    create_refresh_token,
+    token_expiry,
+    user_claims,
+    verify_auth_context,
+)
+
+router = APIRouter(route_class=QueryBudgetRoute)
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+def get_auth_context(token: str = Depends(oauth2_scheme)):
+    return verify_auth_context(token)
+
+
+async def get_current_user(
+    auth: schemas.AuthContext = Depends(get_auth_context),
+    db: AsyncSession = Depends(get_db),
+):
+    user = await crud.get_user_by_auth(db, auth)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+def catalog_validators(table: str, row: bool = False):
+    # Answers 304 before the route body runs, so no rows are read or encoded.
+    # A by-id route (row=True) reads the version on the primary, like its
+    # row cache, and answers "If-None-Match: *" itself after the lookup
+    async def dependency(
+        request: Request, db: AsyncSession = Depends(get_db if row else get_read_db)
+    ):
+        version = await crud.get_table_version(db, table)
+        return catalog_headers(request, table, *version, row=row)
+
+    return dependency
+
+
+async def bulk_insert(request: Request, db: AsyncSession, schema, model):
+    async def insert_chunk(chunk):
+        return await crud.bulk_create(db, model, chunk)
+
+    return await bulk.load(request, schema, insert_chunk)
+
+
+@router.post("/users/register", response_model=schemas.User)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    return await crud.create_user(db=db, user=user)
+
+
+@router.post("/users/login", response_model=schemas.Token)
+async def login_user(user: schemas.UserLogin, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.authenticate_user(db, user.username, user.password)
+    if not db_user:
+        raise HTTPException(status_code=400, detail="Incorrect username or password")
+    claims = user_claims(db_user)
+    access_token = create_access_token(data=claims)
+    new_refresh_token = create_refresh_token(data=claims)
+    return {
+        "access_token": access_token,
+        "refresh_token": new_refresh_token,
+        "token_type": "bearer",
+    }
+
+
+@router.post("/users/reset-password")
+async def reset_password(email: str, db: AsyncSession = Depends(get_db)):
+    user = await crud.get_user_by_email(db, email)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    # Implement your password reset logic here
+    return {"msg": "Password reset link sent"}
+
+
+@router.delete("/users/deactivate/{username}")
+async def deactivate_user(username: str, db: AsyncSession = Depends(get_db)):
+    user = await crud.get_user_by_username(db, username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user.is_active = False
+    await db.commit()
+    return {"msg": "User deactivated"}
+
+
+@router.get("/users/", response_model=list[schemas.User])
+async def read_users(
+    response: Response,
+    skip: int = Query(0, ge=0, le=MAX_SKIP),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    count: CountMode | None = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    users = await crud.get_users(db, skip=skip, limit=limit, after=decode_cursor(after))
+    set_next_cursor(response, users, limit)
+    if count:
+        total = await crud.count_rows(db, models.User, count)
+        set_total_count(response, total)
+    return users
+
+
+@router.post("/magazines/", response_model=schemas.Magazine)
+async def create_magazine(
+    magazine: schemas.MagazineCreate, db: AsyncSession = Depends(get_db)
+):
+    return await crud.create_magazine(db=db, magazine=magazine)
+
+
+@router.post("/magazines/bulk", response_model=schemas.BulkResult)
+async def bulk_create_magazines(request: Request, db: AsyncSession = Depends(get_db)):
+    try:
+        return await bulk_insert(request, db, schemas.MagazineCreate, models.Magazine)
+    finally:
+        # Chunks commit as they go, so a failed or cut-off load still has to
+        # move the ETag past the rows it already wrote
+        await db.rollback()
+        await crud.bump_table_version(db, "magazines")
+        crud.magazine_cache.clear()
+
+
+@router.post("/users/token/refresh", response_model=schemas.Token)
+async def refresh_token(refresh_token: str, db: AsyncSession = Depends(get_db)):
+    auth = verify_auth_context(refresh_token)
+    db_user = await crud.get_user_by_auth(db, auth)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if db_user.is_active is False:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    claims = user_claims(db_user)
+    access_token = create_access_token(data=claims)
+    refresh_token = create_refresh_token(data=claims)
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+    }
+
+
+@router.get("/magazines/", response_model=list[schemas.Magazine])
+async def read_magazines(
+    skip: int = Query(0, ge=0, le=MAX_SKIP),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    count: CountMode | None = None,
+    db: AsyncSession = Depends(get_read_db),
+    catalog: dict = Depends(catalog_validators("magazines")),
+):
+    magazines = await crud.get_magazines(
+        db, skip=skip, limit=limit, after=decode_cursor(after)
+    )
+    response = page_response(magazines, limit, catalog)
+    if count:
+        total = await crud.count_rows(db, models.Magazine, count)
+        set_total_count(response, total)
+    return response
+
+
+@router.get("/catalog/", response_model=list[schemas.CatalogMagazine])
+# Magazines, then every page's plans with their prices in one more query
+@QueryBudget(2)
+async def read_catalog(
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    magazines = await crud.get_catalog(db, limit=limit, after=decode_cursor(after))
+    set_next_cursor(response, magazines, limit)
+    return magazines
+
+
+@router.get("/magazines/search", response_model=list[schemas.MagazineSearchResult])
+async def search_magazines(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    magazines = await crud.search_magazines(
+        db, q, limit=limit, after=decode_rank_cursor(after)
+    )
+    response = rows_response(magazines)
+    set_next_rank_cursor(response, magazines, limit)
+    return response
+
+
+@router.get("/magazines/{magazine_id}", response_model=schemas.Magazine)
+async def get_magazine_by_id(
+    magazine_id: int,
+    request: Request,
+    response: Response,
+    # The primary: the row cache must never be filled from a lagging replica
+    db: AsyncSession = Depends(get_db),
+    catalog: dict = Depends(catalog_validators("magazines", row=True)),
+):
+    db_magazine = await crud.get_magazine_cached(db, magazine_id)
+    return catalog_row(request, response, db_magazine, catalog, "Magazine not found")
+
+
+@router.put("/magazines/{magazine_id}", response_model=schemas.Magazine)
+async def update_magazine(
+    magazine_id: int,
+    magazine: schemas.MagazineCreate,
+    db: AsyncSession = Depends(get_db),
+):
+    db_magazine = await crud.update_magazine(db, magazine_id, magazine)
+    if not db_magazine:
+        raise HTTPException(status_code=404, detail="Magazine not found")
+    return db_magazine
+
+
+@router.patch("/magazines/{magazine_id}", response_model=schemas.Magazine)
+async def patch_magazine(
+    magazine_id: int,
+    magazine: schemas.MagazinePatch,
+    db: AsyncSession = Depends(get_db),
+):
+    db_magazine = await crud.patch_magazine(db, magazine_id, magazine)
+    if not db_magazine:
+        raise HTTPException(status_code=404, detail="Magazine not found")
+    return db_magazine
+
+
+@router.delete("/magazines/{magazine_id}", response_model=schemas.Magazine)
+async def delete_magazine(magazine_id: int, db: AsyncSession = Depends(get_db)):
+    db_magazine = await crud.delete_magazine(db, magazine_id)
+    if not db_magazine:
+        raise HTTPException(status_code=404, detail="Magazine not found")
+    return db_magazine
+
+
+@router.post("/plans/", response_model=schemas.Plan)
+async def create_plan(plan: schemas.PlanCreate, db: AsyncSession = Depends(get_db)):
+    return await crud.create_plan(db=db, plan=plan)
+
+
+@router.post("/plans/bulk", response_model=schemas.BulkResult)
+async def bulk_create_plans(request: Request, db: AsyncSession = Depends(get_db)):
+    try:
+        return await bulk_insert(request, db, schemas.PlanCreate, models.Plan)
+    finally:
+        # Price and version whatever was committed, even if the load failed
+        await db.rollback()
+        await crud.backfill_plan_prices(db)
+        await crud.bump_table_version(db, "plans")
+        crud.plan_cache.clear()
+
+
+@router.get("/plans/", response_model=list[schemas.Plan])
+async def read_plans(
+    skip: int = Query(0, ge=0, le=MAX_SKIP),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    count: CountMode | None = None,
+    db: AsyncSession = Depends(get_read_db),
+    catalog: dict = Depends(catalog_validators("plans")),
+):
+    plans = await crud.get_plans(db, skip=skip, limit=limit, after=decode_cursor(after))
+    response = page_response(plans, limit, catalog)
+    if count:
+        total = await crud.count_rows(db, models.Plan, count)
+        set_total_count(response, total)
+    return response
+
+
+@router.get("/plans/{plan_id}", response_model=schemas.Plan)
+async def get_plan_by_id(
+    plan_id: int,
+    request: Request,
+    response: Response,
+    # The primary: the row cache must never be filled from a lagging replica
+    db: AsyncSession = Depends(get_db),
+    catalog: dict = Depends(catalog_validators("plans", row=True)),
+):
+    db_plan = await crud.get_plan_cached(db, plan_id)
+    return catalog_row(request, response, db_plan, catalog, "Plan not found")
+
+
+@router.put("/plans/{plan_id}", response_model=schemas.Plan)
+async def update_plan(
+    plan_id: int,
+    plan: schemas.PlanCreate,
+    db: AsyncSession = Depends(get_db),
+):
+    db_plan = await crud.update_plan(db, plan_id, plan)
+    if not db_plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return db_plan
+
+
+@router.patch("/plans/{plan_id}", response_model=schemas.Plan)
+async def patch_plan(
+    plan_id: int,
+    plan: schemas.PlanPatch,
+    db: AsyncSession = Depends(get_db),
+):
+    db_plan = await crud.patch_plan(db, plan_id, plan)
+    if not db_plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return db_plan
+
+
+@router.delete("/plans/{plan_id}", response_model=schemas.Plan)
+async def delete_plan(plan_id: int, db: AsyncSession = Depends(get_db)):
+    db_plan = await crud.delete_plan(db, plan_id)
+    if not db_plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return db_plan
+
+
+@router.post("/subscriptions/", response_model=schemas.Subscription)
+async def create_subscription(
+    subscription: schemas.SubscriptionCreate, db: AsyncSession = Depends(get_db)
+):
+    return await crud.create_subscription(db=db, subscription=subscription)
+
+
+@router.post("/subscriptions/bulk", response_model=schemas.BulkResult)
+async def bulk_create_subscriptions(
+    request: Request, db: AsyncSession = Depends(get_db)
+):
+    async def insert_chunk(chunk):
+        return await crud.bulk_create_subscriptions(db, chunk)
+
+    return await bulk.load(request, schemas.SubscriptionCreate, insert_chunk)
+
+
+@router.put("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
+async def update_subscription(
+    subscription_id: int,
+    subscription: schemas.SubscriptionUpdate,
+    db: AsyncSession = Depends(get_db),
+):
+    db_subscription = await crud.update_subscription(db, subscription_id, subscription)
+    if not db_subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    return db_subscription
+
+
+@router.patch("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
+async def patch_subscription(
+    subscription_id: int,
+    subscription: schemas.SubscriptionPatch,
+    db: AsyncSession = Depends(get_db),
+):
+    db_subscription = await crud.patch_subscription(db, subscription_id, subscription)
+    if not db_subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    return db_subscription
+
+
+@router.get("/subscriptions/", response_model=list[schemas.Subscription])
+async def read_subscriptions(
+    skip: int = Query(0, ge=0, le=MAX_SKIP),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    count: CountMode | None = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    subscriptions = await crud.get_subscriptions(
+        db, skip=skip, limit=limit, after=decode_cursor(after)
+    )
+    response = page_response(subscriptions, limit)
+    if count:
+        total = await crud.count_rows(db, models.Subscription, count)
+        set_total_count(response, total)
+    return response
+
+
+@router.get("/subscriptions/export")
+async def export_subscriptions(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    user_id: int | None = None,
+    plan_id: int | None = None,
+    is_active: bool | None = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    partitions = crud.iter_subscriptions(
+        db, user_id=user_id, plan_id=plan_id, is_active=is_active
+    )
+    return StreamingResponse(
+        export.format_partitions_async(format, export.SUBSCRIPTION_COLUMNS, partitions),
+        media_type=export.MEDIA_TYPES[format],
+    )
+
+
+@router.get("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
+async def get_subscription_by_id(
+    subscription_id: int, db: AsyncSession = Depends(get_read_db)
+):
+    db_subscription = await crud.get_subscription(db, subscription_id)
+    if not db_subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    return db_subscription
+
+
+@router.get("/users/me", response_model=schemas.User)
+async def read_users_me(
+    token: str = Depends(oauth2_scheme),
+    current_user: schemas.User = Depends(get_current_user),
+):
+    token_expiry(token)
+    return current_user
+
+
+@router.get("/users/me/subscriptions", response_model=list[schemas.UserSubscription])
+# The user, one joined page query, plus the total when ?count is given
+@QueryBudget(3)
+async def read_my_subscriptions(
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    count: CountMode | None = None,
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    subscriptions = await crud.get_user_subscriptions(
+        db, current_user.id, limit=limit, after=decode_cursor(after)
+    )
+    set_next_cursor(response, subscriptions, limit)
+    if count:
+        criteria = crud.user_subscription_criteria(current_user.id)
+        total = await crud.count_rows(db, models.Subscription, count, *criteria)
+        set_total_count(response, total)
+    return subscriptions
+
+
+@router.delete("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
+async def delete_subscription(subscription_id: int, db: AsyncSession = Depends(get_db)):
+    db_subscription = await crud.delete_subscription(db, subscription_id)
+    if not db_subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    return db_subscription
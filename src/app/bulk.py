@@ -0,0 +1,75 @@
+import json
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from .config import settings
+
+
+async def iter_rows(request: Request):
+    """Yield ``(index, row)`` from a JSON array body or an NDJSON stream.
+
+    NDJSON is read line by line as it arrives, so only one chunk of rows is
+    held in memory.  Lines that are not valid JSON are yielded as errors.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        index = 0
+        buffer = b""
+        async for data in request.stream():
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, _parse_line(line)
+                    index += 1
+        if buffer.strip():
+            yield index, _parse_line(buffer)
+        return
+    try:
+        rows = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body is not valid JSON")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array")
+    for index, row in enumerate(rows):
+        yield index, row
+
+
+def _parse_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as exc:
+        return ValueError(f"Invalid JSON: {exc}")
+
+
+async def load(request: Request, schema, insert_chunk):
+    """Validate rows against ``schema`` and insert them chunk by chunk.
+
+    ``insert_chunk`` is awaited with a list of ``(index, values)`` pairs and
+    returns ``(inserted, errors)``.  Invalid rows are reported and skipped.
+    """
+    inserted = 0
+    errors = []
+    chunk = []
+
+    async def flush():
+        nonlocal inserted
+        chunk_inserted, chunk_errors = await insert_chunk(chunk)
+        inserted += chunk_inserted
+        errors.extend(chunk_errors)
+        chunk.clear()
+
+    async for index, row in iter_rows(request):
+        if isinstance(row, ValueError):
+            errors.append({"index": index, "error": str(row)})
+            continue
+        try:
+            item = schema.model_validate(row)
+        except ValidationError as exc:
+            errors.append({"index": index, "error": str(exc)})
+            continue
+        chunk.append((index, item.model_dump()))
+        if len(chunk) >= settings.bulk_chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+    return {"inserted": inserted, "errors": errors}
@@ -0,0 +1,68 @@
+import json
+from typing import Literal
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects import postgresql
+from .cache import TTLCache
+from .config import settings
+
+CountMode = Literal["exact", "estimated"]
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+# Exact totals per (table, filter), reused for a few seconds
+count_cache = TTLCache(settings.count_cache_size, settings.count_cache_ttl)
+
+RELTUPLES = text(
+    "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)"
+)
+
+
+def cache_key(model, criteria):
+    # Criteria hold only literals (ids, booleans), so their SQL is the filter
+    rendered = (
+        str(c.compile(compile_kwargs={"literal_binds": True})) for c in criteria
+    )
+    return (model.__tablename__, *rendered)
+
+
+def exact_statement(model, criteria):
+    return select(func.count()).select_from(model).where(*criteria)
+
+
+def estimate_statement(dialect: str, model, criteria):
+    """Statement whose scalar result estimates the row count, or None if the
+    backend has no cheap estimate for this query.
+
+    PostgreSQL reads ``pg_class.reltuples`` for a whole table and the
+    planner's row estimate for a filtered one.  SQLite has no statistics by
+    default; the largest id is a primary-key lookup and an upper bound.
+    """
+    if dialect == "postgresql":
+        if not criteria:
+            return RELTUPLES.bindparams(name=model.__tablename__)
+        sql = (
+            select(model.id)
+            .where(*criteria)
+            .compile(
+                dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+            )
+        )
+        return text(f"EXPLAIN (FORMAT JSON) {sql}")
+    if dialect == "sqlite" and not criteria:
+        return select(func.max(model.id))
+    return None
+
+
+def parse_estimate(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        # asyncpg hands back EXPLAIN's json as text
+        value = json.loads(value)
+    if isinstance(value, list):
+        value = value[0]["Plan"]["Plan Rows"]
+    # reltuples is -1 until the table is first vacuumed or analyzed
+    return int(value) if value >= 0 else None
+
+
+def set_total_count(response, total: int):
+    response.headers[TOTAL_COUNT_HEADER] = str(total)
@@ -1,31 +1,271 @@
-from sqlalchemy.orm import Session
+from datetime import UTC, datetime
+from fastapi import HTTPException
+from sqlalchemy import (
+    Date,
+    Integer,
+    Numeric,
+    cast,
+    column,
+    delete,
+    func,
+    insert,
+    select,
+    update,
+    values,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
 from . import models, schemas
 from .models import User
-from passlib.context import CryptContext
+from .cache import TTLCache
+from .counts import (
+    cache_key,
+    count_cache,
+    estimate_statement,
+    exact_statement,
+    parse_estimate,
+)
+from .config import settings
+from .export import SUBSCRIPTION_COLUMNS
+from .search import has_terms, search_statement
+from .passwords import hash_password, verify_password
+from .serialization import schema_columns
+
+# Catalog rows change a few times a day; cache the serialized snapshots
+magazine_cache = TTLCache(settings.catalog_cache_size, settings.catalog_cache_ttl)
+plan_cache = TTLCache(settings.catalog_cache_size, settings.catalog_cache_ttl)
+# (version, updated_at) per table for ETags; writes in this worker drop the
+# entry, other workers' writes show up within the TTL
+table_versions = TTLCache(64, settings.catalog_version_ttl)
+
+EPOCH = datetime(1970, 1, 1)
+DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _returning(db: Session, stmt, model, commit: bool = True):
+    # One roundtrip: the INSERT/UPDATE/DELETE hands back the written row
+    row = db.execute(stmt.returning(*model.__table__.columns)).first()
+    if commit:
+        db.commit()
+    return row
+
+
+def _update(db: Session, model, row_id: int, values: dict, commit: bool = True):
+    if not values:
+        return db.execute(
+            select(*model.__table__.columns).where(model.id == row_id)
+        ).first()
+    stmt = update(model).where(model.id == row_id).values(**values)
+    return _returning(db, stmt, model, commit=commit)
+
+
+PLAN_PRICE_COLUMNS = ["plan_id", "magazine_id", "price"]
+
+
+def _plan_price_source():
+    price = func.round(
+        cast(
+            models.Magazine.base_price * (1 - func.coalesce(models.Plan.discount, 0)),
+            Numeric,
+        ),
+        2,
+    )
+    return select(models.Plan.id, models.Plan.magazine_id, price).join(
+        models.Magazine, models.Plan.magazine_id == models.Magazine.id
+    )
+
+
+def plan_price_statements(plan_id: int = None, magazine_id: int = None):
+    """DELETE and INSERT ... SELECT that rebuild the plan_prices rows of one
+    plan or of every plan of one magazine."""
+    source = _plan_price_source()
+    target = delete(models.PlanPrice)
+    if plan_id is not None:
+        source = source.where(models.Plan.id == plan_id)
+        target = target.where(models.PlanPrice.plan_id == plan_id)
+    if magazine_id is not None:
+        source = source.where(models.Plan.magazine_id == magazine_id)
+        target = target.where(models.PlanPrice.magazine_id == magazine_id)
+    return target, insert(models.PlanPrice).from_select(PLAN_PRICE_COLUMNS, source)
+
+
+def unpriced_plans():
+    return models.Plan.id.not_in(select(models.PlanPrice.plan_id))
+
+
+def missing_plan_prices_statement():
+    source = _plan_price_source().where(unpriced_plans())
+    return insert(models.PlanPrice).from_select(PLAN_PRICE_COLUMNS, source)
+
+
+def price_source_lock(dialect: str, plans):
+    """Lock the magazines the ``plans`` criterion's plans are priced from.
+
+    Without it a plan write reads base_price while a magazine update is
+    still uncommitted, and commits a plan_prices row priced from the old
+    base_price after that update has repriced the magazine's other plans.
+    FOR NO KEY UPDATE waits for such an update but not for other plan
+    inserts.  SQLite serializes writers already, so it needs no lock.
+    """
+    if dialect != "postgresql":
+        return None
+    return (
+        select(models.Magazine.id)
+        .where(models.Magazine.id.in_(select(models.Plan.magazine_id).where(plans)))
+        .order_by(models.Magazine.id)
+        .with_for_update(key_share=True)
+    )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def plan_price_lookup(plan_id: int):
+    return (
+        select(models.PlanPrice.price)
+        .where(models.PlanPrice.plan_id == plan_id)
+        .scalar_subquery()
+    )
+
+
+def _lock_price_source(db: Session, plans):
+    lock = price_source_lock(db.get_bind().dialect.name, plans)
+    if lock is not None:
+        db.execute(lock)
+
+
+def refresh_plan_prices(db: Session, plan_id: int = None, magazine_id: int = None):
+    # A magazine write has already locked its row with the UPDATE
+    if plan_id is not None:
+        _lock_price_source(db, models.Plan.id == plan_id)
+    for stmt in plan_price_statements(plan_id, magazine_id):
+        db.execute(stmt)
+
+
+def backfill_plan_prices(db: Session):
+    # Price plans that have none yet, e.g. after a bulk import
+    _lock_price_source(db, unpriced_plans())
+    db.execute(missing_plan_prices_statement())
+    db.commit()
+
+
+def table_version_bump(dialect: str, table: str):
+    now = datetime.now(UTC).replace(tzinfo=None, microsecond=0)
+    values = {"name": table, "version": 1, "updated_at": now}
+    if dialect not in DIALECT_INSERTS:
+        return (
+            update(models.TableVersion)
+            .where(models.TableVersion.name == table)
+            .values(version=models.TableVersion.version + 1, updated_at=now)
+        )
+    return (
+        DIALECT_INSERTS[dialect](models.TableVersion)
+        .values(**values)
+        .on_conflict_do_update(
+            index_elements=["name"],
+            set_={"version": models.TableVersion.version + 1, "updated_at": now},
+        )
+    )
+
+
+def table_version_query(table: str):
+    return select(models.TableVersion.version, models.TableVersion.updated_at).where(
+        models.TableVersion.name == table
+    )
+
+
+def _bump_version(db: Session, table: str):
+    db.execute(table_version_bump(db.get_bind().dialect.name, table))
+
+
+def bump_table_version(db: Session, table: str):
+    # The version bump commits with the write, so an ETag never runs ahead
+    # of the data it describes
+    _bump_version(db, table)
+    db.commit()
+    table_versions.invalidate(table)
+
+
+def get_table_version(db: Session, table: str):
+    if db.info.get("replica"):
+        # A lagging replica's version must not be cached for primary reads,
+        # nor a cached primary version put on a replica's older rows
+        row = db.execute(table_version_query(table)).first()
+        return tuple(row) if row else (0, EPOCH)
+    cached = table_versions.get(table)
+    if cached is None:
+        version = table_versions.version
+        row = db.execute(table_version_query(table)).first()
+        cached = tuple(row) if row else (0, EPOCH)
+        table_versions.set(table, cached, version=version)
+    return cached
+
+
+def _paginate(query, model, skip: int, limit: int, after: int = None):
+    query = query.order_by(model.id)
+    if after is not None:
+        query = query.filter(model.id > after)
+    return query.offset(skip).limit(limit).all()
+
+
+def _paginate_rows(db: Session, model, schema, skip, limit, after=None):
+    # Plain column rows for the list endpoints, serialized without the ORM
+    stmt = select(*schema_columns(model, schema)).order_by(model.id)
+    if after is not None:
+        stmt = stmt.where(model.id > after)
+    return db.execute(stmt.offset(skip).limit(limit)).all()
+
+
+def count_rows(db: Session, model, mode: str, *criteria):
+    if mode == "estimated":
+        stmt = estimate_statement(db.get_bind().dialect.name, model, criteria)
+        estimate = parse_estimate(db.scalar(stmt)) if stmt is not None else None
+        if estimate is not None:
+            return estimate
+    # Exact, or no usable estimate: COUNT(*) at most once per TTL per filter
+    key = cache_key(model, criteria)
+    total = count_cache.get(key)
+    if total is None:
+        version = count_cache.version
+        total = db.scalar(exact_statement(model, criteria))
+        count_cache.set(key, total, version=version)
+    return total
+
+
+def user_subscription_criteria(user_id: int):
+    return (
+        models.Subscription.user_id == user_id,
+        models.Subscription.is_active.is_(True),
+    )
 
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, skip: int = 0, limit: int = 10, after: int = None):
+    return _paginate(db.query(models.User), models.User, skip, limit, after)
 
 
 def create_user(db: Session, user: schemas.UserCreate):
-    db_user = User(username=user.username, email=user.email, password=user.password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    stmt = insert(models.User).values(
+        username=user.username,
+        email=user.email,
+        password=hash_password(user.password),
+        is_active=True,
+    )
+    return _returning(db, stmt, models.User)
 
 
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 
+def get_user_by_auth(db: Session, auth: schemas.AuthContext):
+    if auth.user_id is not None:
+        return get_user(db, auth.user_id)
+    # Tokens issued before the uid claim was added only carry the username
+    return get_user_by_username(db, auth.username)
+
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
@@ -34,6 +274,16 @@ def authenticate_user(db: Session, username: str, password: str):
     user = get_user_by_username(db, username)
     if not user:
         return False
+    # Hand the connection back to the pool while bcrypt runs
+    db.expunge(user)
+    db.rollback()
+    valid, new_hash = verify_password(password, user.password)
+    if not valid:
+        return False
+    if new_hash:
+        user.password = new_hash
+        db.merge(user)
+        db.commit()
     return user
 
 
@@ -41,29 +291,93 @@ def get_magazine(db: Session, magazine_id: int):
     return db.query(models.Magazine).filter(models.Magazine.id == magazine_id).first()
 
 
-def get_magazines(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Magazine).offset(skip).limit(limit).all()
+def get_magazine_cached(db: Session, magazine_id: int):
+    magazine = magazine_cache.get(magazine_id)
+    if magazine is None:
+        version = magazine_cache.version
+        db_magazine = get_magazine(db, magazine_id)
+        if db_magazine is None:
+            return None
+        magazine = schemas.Magazine.model_validate(db_magazine, from_attributes=True)
+        magazine_cache.set(magazine_id, magazine, version=version)
+    return magazine
 
 
-def create_magazine(db: Session, magazine: schemas.MagazineCreate):
-    db_magazine = models.Magazine(
-        title=magazine.title,
-        description=magazine.description,
-        base_price=magazine.base_price,
+def get_magazines(db: Session, skip: int = 0, limit: int = 10, after: int = None):
+    return _paginate_rows(db, models.Magazine, schemas.Magazine, skip, limit, after)
+
+
+def search_magazines(db: Session, q: str, limit: int = 10, after=None):
+    if not has_terms(q):
+        return []
+    stmt = search_statement(db.get_bind().dialect.name, q, limit, after)
+    return db.execute(stmt).all()
+
+
+def get_catalog(db: Session, limit: int = 10, after: int = None):
+    # One query for the page of magazines and one IN query for all their plans
+    # (prices joined in from plan_prices)
+    query = db.query(models.Magazine).options(
+        selectinload(models.Magazine.plans).joinedload(models.Plan.price_entry)
     )
-    db.add(db_magazine)
-    db.commit()
-    db.refresh(db_magazine)
+    return _paginate(query, models.Magazine, 0, limit, after)
+
+
+def create_magazine(db: Session, magazine: schemas.MagazineCreate):
+    stmt = insert(models.Magazine).values(**magazine.model_dump())
+    db_magazine = _returning(db, stmt, models.Magazine, commit=False)
+    bump_table_version(db, "magazines")
+    magazine_cache.invalidate(db_magazine.id)
     return db_magazine
 
 
-def delete_magazine(db: Session, magazine_id: int):
-    db_magazine = (
-        db.query(models.Magazine).filter(models.Magazine.id == magazine_id).first()
+def update_magazine(db: Session, magazine_id: int, magazine: schemas.MagazineCreate):
+    return _write_magazine(db, magazine_id, magazine.model_dump())
+
+
+def patch_magazine(db: Session, magazine_id: int, magazine: schemas.MagazinePatch):
+    return _write_magazine(db, magazine_id, magazine.model_dump(exclude_unset=True))
+
+
+def _write_magazine(db: Session, magazine_id: int, values: dict):
+    db_magazine = _update(db, models.Magazine, magazine_id, values, commit=False)
+    if db_magazine is not None and values:
+        if "base_price" in values:
+            refresh_plan_prices(db, magazine_id=magazine_id)
+        bump_table_version(db, "magazines")
+    magazine_cache.invalidate(magazine_id)
+    return db_magazine
+
+
+def magazine_plans_exist(magazine_id: int):
+    return select(models.Plan.id).where(models.Plan.magazine_id == magazine_id).exists()
+
+
+def plan_subscriptions_exist(plan_id: int):
+    return (
+        select(models.Subscription.id)
+        .where(models.Subscription.plan_id == plan_id)
+        .exists()
     )
-    if db_magazine:
-        db.delete(db_magazine)
-        db.commit()
+
+
+def still_referenced(detail: str):
+    return HTTPException(status_code=409, detail=detail)
+
+
+def delete_magazine(db: Session, magazine_id: int):
+    # Refused while plans point at it (and so at its plan_prices rows); the
+    # guard is part of the DELETE so the usual case stays one statement
+    has_plans = magazine_plans_exist(magazine_id)
+    stmt = delete(models.Magazine).where(models.Magazine.id == magazine_id, ~has_plans)
+    db_magazine = _returning(db, stmt, models.Magazine, commit=False)
+    if db_magazine is None:
+        db.rollback()
+        if db.scalar(select(has_plans)):
+            raise still_referenced("Magazine still has plans")
+        return None
+    bump_table_version(db, "magazines")
+    magazine_cache.invalidate(magazine_id)
     return db_magazine
 
 
@@ -71,36 +385,61 @@ def get_plan(db: Session, plan_id: int):
     return db.query(models.Plan).filter(models.Plan.id == plan_id).first()
 
 
-def get_plans(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Plan).offset(skip).limit(limit).all()
+def get_plan_cached(db: Session, plan_id: int):
+    plan = plan_cache.get(plan_id)
+    if plan is None:
+        version = plan_cache.version
+        db_plan = get_plan(db, plan_id)
+        if db_plan is None:
+            return None
+        plan = schemas.Plan.model_validate(db_plan, from_attributes=True)
+        plan_cache.set(plan_id, plan, version=version)
+    return plan
+
+
+def get_plans(db: Session, skip: int = 0, limit: int = 10, after: int = None):
+    return _paginate_rows(db, models.Plan, schemas.Plan, skip, limit, after)
 
 
 def create_plan(db: Session, plan: schemas.PlanCreate):
-    db_plan = models.Plan(
-        name=plan.name, price=plan.price, magazine_id=plan.magazine_id
-    )
-    db.add(db_plan)
-    db.commit()
-    db.refresh(db_plan)
+    stmt = insert(models.Plan).values(**plan.model_dump())
+    db_plan = _returning(db, stmt, models.Plan, commit=False)
+    refresh_plan_prices(db, plan_id=db_plan.id)
+    bump_table_version(db, "plans")
+    plan_cache.invalidate(db_plan.id)
     return db_plan
 
 
 def update_plan(db: Session, plan_id: int, plan: schemas.PlanCreate):
-    db_plan = db.query(models.Plan).filter(models.Plan.id == plan_id).first()
-    if db_plan:
-        db_plan.name = plan.name
-        db_plan.price = plan.price
-        db_plan.magazine_id = plan.magazine_id
-        db.commit()
-        db.refresh(db_plan)
+    return _write_plan(db, plan_id, plan.model_dump())
+
+
+def patch_plan(db: Session, plan_id: int, plan: schemas.PlanPatch):
+    return _write_plan(db, plan_id, plan.model_dump(exclude_unset=True))
+
+
+def _write_plan(db: Session, plan_id: int, values: dict):
+    db_plan = _update(db, models.Plan, plan_id, values, commit=False)
+    if db_plan is not None and values:
+        refresh_plan_prices(db, plan_id=plan_id)
+        bump_table_version(db, "plans")
+    plan_cache.invalidate(plan_id)
     return db_plan
 
 
 def delete_plan(db: Session, plan_id: int):
-    db_plan = db.query(models.Plan).filter(models.Plan.id == plan_id).first()
-    if db_plan:
-        db.delete(db_plan)
-        db.commit()
+    # Refused while any subscription, active or not, points at it
+    has_subscriptions = plan_subscriptions_exist(plan_id)
+    db.execute(plan_price_statements(plan_id=plan_id)[0])
+    stmt = delete(models.Plan).where(models.Plan.id == plan_id, ~has_subscriptions)
+    db_plan = _returning(db, stmt, models.Plan, commit=False)
+    if db_plan is None:
+        db.rollback()
+        if db.scalar(select(has_subscriptions)):
+            raise still_referenced("Plan still has subscriptions")
+        return None
+    bump_table_version(db, "plans")
+    plan_cache.invalidate(plan_id)
     return db_plan
 
 
@@ -112,51 +451,270 @@ def get_subscription(db: Session, subscription_id: int):
     )
 
 
-def get_subscriptions(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Subscription).offset(skip).limit(limit).all()
+def get_subscriptions(db: Session, skip: int = 0, limit: int = 10, after: int = None):
+    return _paginate_rows(
+        db, models.Subscription, schemas.Subscription, skip, limit, after
+    )
 
 
-def create_subscription(db: Session, subscription: schemas.SubscriptionCreate):
-    db_subscription = models.Subscription(
-        user_id=subscription.user_id,
-        plan_id=subscription.plan_id,
-        price=subscription.price,
-        next_renewal_date=subscription.next_renewal_date,
-        is_active=True,
+def user_subscriptions_query(user_id: int, limit: int, after: int = None):
+    # Served by ix_subscriptions_user_active; plan and magazine come back in
+    # the same statement through many-to-one joins
+    stmt = (
+        select(models.Subscription)
+        .options(joinedload(models.Subscription.plan).joinedload(models.Plan.magazine))
+        .where(*user_subscription_criteria(user_id))
+        .order_by(models.Subscription.id)
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(models.Subscription.id > after)
+    return stmt
+
+
+def get_user_subscriptions(db: Session, user_id: int, limit: int = 10, after=None):
+    return db.scalars(user_subscriptions_query(user_id, limit, after)).all()
+
+
+def subscription_export_query(user_id=None, plan_id=None, is_active=None):
+    columns = [getattr(models.Subscription, name) for name in SUBSCRIPTION_COLUMNS]
+    stmt = select(*columns).order_by(models.Subscription.id)
+    if user_id is not None:
+        stmt = stmt.where(models.Subscription.user_id == user_id)
+    if plan_id is not None:
+        stmt = stmt.where(models.Subscription.plan_id == plan_id)
+    if is_active is not None:
+        stmt = stmt.where(models.Subscription.is_active == is_active)
+    return stmt
+
+
+def iter_subscriptions(
+    db: Session, user_id=None, plan_id=None, is_active=None, batch_size: int = 1000
+):
+    # Plain rows from a server-side cursor, batch_size at a time
+    stmt = subscription_export_query(user_id, plan_id, is_active)
+    result = db.execute(
+        stmt.execution_options(stream_results=True, yield_per=batch_size)
+    )
+    yield from result.partitions()
+
+
+def get_due_subscriptions(db: Session, today, limit: int = 1000):
+    return db.execute(
+        select(
+            models.Subscription.id,
+            models.Subscription.next_renewal_date,
+            models.Plan.renewal_period,
+        )
+        .join(models.Plan, models.Subscription.plan_id == models.Plan.id)
+        .where(
+            models.Subscription.is_active.is_(True),
+            models.Subscription.next_renewal_date <= today,
+        )
+        .order_by(models.Subscription.next_renewal_date, models.Subscription.id)
+        .limit(limit)
+    ).all()
+
+
+def renewal_statement(renewals: list):
+    # One UPDATE ... FROM (VALUES ...) for the whole chunk, the VALUES in a
+    # CTE so SQLite can name its columns. The dates come from Python, since
+    # month arithmetic differs per dialect; the price is the plan's
+    # plan_prices row, the same one create_subscription quotes
+    dates = (
+        values(
+            column("id", Integer), column("next_renewal_date", Date), name="renewals"
+        )
+        .data([(row["id"], row["next_renewal_date"]) for row in renewals])
+        .cte("renewals")
+    )
+    price = plan_price_lookup(models.Subscription.plan_id)
+    return (
+        update(models.Subscription)
+        .where(models.Subscription.id == dates.c.id)
+        .values(
+            next_renewal_date=dates.c.next_renewal_date,
+            # A plan without a price (yet) keeps the current one
+            price=func.coalesce(price, models.Subscription.price),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def renew_subscriptions(db: Session, renewals: list):
+    if renewals:
+        db.execute(renewal_statement(renewals))
+    db.commit()
+
+
+def active_subscription_insert(dialect: str, values: dict):
+    # A duplicate active subscription inserts nothing, so RETURNING comes
+    # back empty instead of raising; no read beforehand, no lock to wait on
+    if dialect not in DIALECT_INSERTS:
+        # Other databases reject the duplicate with an IntegrityError
+        return insert(models.Subscription).values(**values)
+    return (
+        DIALECT_INSERTS[dialect](models.Subscription)
+        .values(**values)
+        .on_conflict_do_nothing(
+            index_elements=["user_id", "plan_id"],
+            index_where=models.Subscription.is_active.is_(True),
+        )
+    )
+
+
+def subscription_values(subscription: schemas.SubscriptionCreate):
+    values = {**subscription.model_dump(), "is_active": True}
+    if values["price"] is None:
+        # Read inside the INSERT, so quoting the price costs no extra roundtrip
+        values["price"] = plan_price_lookup(subscription.plan_id)
+    return values
+
+
+def unpriced_plan_ids(rows: list):
+    return {values["plan_id"] for _, values in rows if values["price"] is None}
+
+
+def plan_prices_query(plan_ids):
+    return select(models.PlanPrice.plan_id, models.PlanPrice.price).where(
+        models.PlanPrice.plan_id.in_(plan_ids)
+    )
+
+
+def unpriced_plan_message(plan_id: int):
+    return f"Plan {plan_id} does not exist or has no price"
+
+
+def price_subscription_rows(rows: list, prices: dict):
+    """Give bulk rows without a price their plan's current price.
+
+    Rows whose plan has no price are reported as errors, not inserted.
+    """
+    priced = []
+    errors = []
+    for index, values in rows:
+        if values["price"] is None:
+            price = prices.get(values["plan_id"])
+            if price is None:
+                errors.append(
+                    {"index": index, "error": unpriced_plan_message(values["plan_id"])}
+                )
+                continue
+            values = {**values, "price": price}
+        priced.append((index, values))
+    return priced, errors
+
+
+def merge_bulk_errors(*error_lists):
+    return sorted(
+        (e for errors in error_lists for e in errors), key=lambda e: e["index"]
     )
-    db.add(db_subscription)
+
+
+def subscription_conflict():
+    return HTTPException(
+        status_code=409, detail="User already has an active subscription to this plan"
+    )
+
+
+# SQLSTATE on PostgreSQL, the extended result code on SQLite
+UNIQUE_VIOLATIONS = {"23505", "SQLITE_CONSTRAINT_UNIQUE"}
+FOREIGN_KEY_VIOLATIONS = {"23503", "SQLITE_CONSTRAINT_FOREIGNKEY"}
+
+
+def subscription_integrity_error(exc: IntegrityError):
+    """The HTTP error for a rejected subscription write: 409 for a second
+    active subscription to the plan, 422 for a user or plan that doesn't
+    exist.  Anything else is re-raised."""
+    orig = exc.orig
+    code = getattr(orig, "pgcode", None) or getattr(orig, "sqlite_errorname", None)
+    if code in FOREIGN_KEY_VIOLATIONS:
+        return HTTPException(status_code=422, detail="User or plan does not exist")
+    if code in UNIQUE_VIOLATIONS:
+        return subscription_conflict()
+    raise exc
+
+
+def unpriced_plan(plan_id: int):
+    return HTTPException(status_code=422, detail=unpriced_plan_message(plan_id))
+
+
+def create_subscription(db: Session, subscription: schemas.SubscriptionCreate):
+    values = subscription_values(subscription)
+    stmt = active_subscription_insert(db.get_bind().dialect.name, values)
+    try:
+        db_subscription = _returning(db, stmt, models.Subscription, commit=False)
+    except IntegrityError as exc:
+        db.rollback()
+        raise subscription_integrity_error(exc)
+    if db_subscription is None:
+        raise subscription_conflict()
+    if db_subscription.price is None:
+        # The plan has no plan_prices row to quote from; keep nothing
+        db.rollback()
+        raise unpriced_plan(subscription.plan_id)
     db.commit()
-    db.refresh(db_subscription)
     return db_subscription
 
 
+def _update_subscription(db: Session, subscription_id: int, values: dict):
+    try:
+        return _update(db, models.Subscription, subscription_id, values)
+    except IntegrityError as exc:
+        # Reactivating or moving onto a plan the user is already active on,
+        # or onto a user or plan that doesn't exist
+        db.rollback()
+        raise subscription_integrity_error(exc)
+
+
 def update_subscription(
     db: Session, subscription_id: int, subscription: schemas.SubscriptionUpdate
 ):
-    db_subscription = (
-        db.query(models.Subscription)
-        .filter(models.Subscription.id == subscription_id)
-        .first()
-    )
-    if db_subscription:
-        db_subscription.user_id = subscription.user_id
-        db_subscription.plan_id = subscription.plan_id
-        db_subscription.price = subscription.price
-        db_subscription.next_renewal_date = subscription.next_renewal_date
-        db_subscription.is_active = subscription.is_active
-        db.commit()
-        db.refresh(db_subscription)
-    return db_subscription
+    return _update_subscription(db, subscription_id, subscription.model_dump())
+
+
+def patch_subscription(
+    db: Session, subscription_id: int, subscription: schemas.SubscriptionPatch
+):
+    values = subscription.model_dump(exclude_unset=True)
+    return _update_subscription(db, subscription_id, values)
 
 
 def delete_subscription(db: Session, subscription_id: int):
-    db_subscription = (
-        db.query(models.Subscription)
-        .filter(models.Subscription.id == subscription_id)
-        .first()
-    )
-    if db_subscription:
-        db_subscription.is_active = False
+    # Subscriptions are never deleted, only deactivated
+    return _update(db, models.Subscription, subscription_id, {"is_active": False})
+
+
+def bulk_create_subscriptions(db: Session, rows: list):
+    """``bulk_create`` for subscriptions, pricing rows that leave out the
+    price with one plan_prices read per chunk."""
+    plan_ids = unpriced_plan_ids(rows)
+    prices = dict(db.execute(plan_prices_query(plan_ids)).all()) if plan_ids else {}
+    rows, price_errors = price_subscription_rows(rows, prices)
+    inserted, errors = bulk_create(db, models.Subscription, rows)
+    return inserted, merge_bulk_errors(price_errors, errors)
+
+
+def bulk_create(db: Session, model, rows: list):
+    """Insert ``(index, values)`` pairs as one multi-row INSERT transaction.
+
+    If the chunk is rejected, retry it row by row in savepoints so only the
+    offending rows are reported.  Returns ``(inserted, errors)``.
+    """
+    try:
+        db.execute(insert(model), [values for _, values in rows])
         db.commit()
-        db.refresh(db_subscription)
-    return db_subscription
+        return len(rows), []
+    except DBAPIError:
+        db.rollback()
+    inserted = 0
+    errors = []
+    for index, values in rows:
+        try:
+            with db.begin_nested():
+                db.execute(insert(model), [values])
+            inserted += 1
+        except DBAPIError as exc:
+            errors.append({"index": index, "error": str(exc.orig)})
+    db.commit()
+    return inserted, errors
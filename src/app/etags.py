@@ -0,0 +1,74 @@
+"""Conditional GETs for the catalog.
+
+Every write to ``magazines`` or ``plans`` bumps that table's row in
+``table_versions``, so one small lookup yields validators for any page of
+the table.  Requests that already hold the current version get a bodiless
+304 without touching the table or the serializer.
+"""
+
+from datetime import UTC
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import HTTPException
+
+
+def validators(table: str, version: int, updated_at):
+    return {
+        "ETag": f'W/"{table}-{version}"',
+        "Last-Modified": format_datetime(updated_at.replace(tzinfo=UTC), usegmt=True),
+    }
+
+
+def _opaque(tag: str):
+    # Weak comparison: W/"x" and "x" match
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def matches_any(request):
+    return request.headers.get("if-none-match", "").strip() == "*"
+
+
+def not_modified(request, headers: dict, match_any: bool = True):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        if matches_any(request):
+            # "*" holds only if the resource exists, which the table version
+            # can't tell for one row; by-id routes check it after the lookup
+            return match_any
+        current = _opaque(headers["ETag"])
+        return any(_opaque(tag) == current for tag in if_none_match.split(","))
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=UTC)
+    return parsedate_to_datetime(headers["Last-Modified"]) <= since
+
+
+def catalog_headers(request, table: str, version: int, updated_at, row: bool):
+    """The table's validators, or a 304 if the client already holds them.
+
+    Shared by the sync and async ``catalog_validators`` dependencies.
+    """
+    headers = validators(table, version, updated_at)
+    if not_modified(request, headers, match_any=not row):
+        raise HTTPException(status_code=304, headers=headers)
+    return headers
+
+
+def catalog_row(request, response, item, headers: dict, detail: str):
+    """Return a by-id route's ``item`` with the table's validators.
+
+    404 if it doesn't exist, else 304 for "If-None-Match: *".
+    """
+    if not item:
+        raise HTTPException(status_code=404, detail=detail)
+    if matches_any(request):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return item
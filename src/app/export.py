@@ -0,0 +1,49 @@
+import csv
+import io
+import json
+
+SUBSCRIPTION_COLUMNS = (
+    "id",
+    "user_id",
+    "plan_id",
+    "price",
+    "next_renewal_date",
+    "is_active",
+)
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def ndjson_chunk(columns, rows):
+    return "".join(
+        json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows
+    )
+
+
+def csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def csv_header(columns):
+    return csv_chunk([columns])
+
+
+def format_partitions(fmt, columns, partitions):
+    if fmt == "csv":
+        yield csv_header(columns)
+        for rows in partitions:
+            yield csv_chunk(rows)
+    else:
+        for rows in partitions:
+            yield ndjson_chunk(columns, rows)
+
+
+async def format_partitions_async(fmt, columns, partitions):
+    if fmt == "csv":
+        yield csv_header(columns)
+        async for rows in partitions:
+            yield csv_chunk(rows)
+    else:
+        async for rows in partitions:
+            yield ndjson_chunk(columns, rows)
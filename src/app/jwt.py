@@ -1,6 +1,11 @@
+import hashlib
+import time
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi import HTTPException, status
+from . import schemas
+from .cache import TTLCache
+from .config import settings
 
 # Secret key to encode the JWT
 SECRET_KEY = "d182fca46969ecb52609f0afe699294bb664430eb754ef311228e972dc457651"
@@ -8,6 +13,9 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_SECONDS = 1  # Set to 1 second for testing
 REFRESH_TOKEN_EXPIRE_DAYS = 30  # Set to 30 days for refresh token
 
+# Verified claims keyed by token digest, each kept until the token's exp
+token_cache = TTLCache(maxsize=settings.token_cache_size)
+
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -31,14 +39,24 @@ def create_refresh_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
+def decode_token(token: str):
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        exp = payload.get("exp")
+        if exp is not None:
+            token_cache.set(key, payload, ttl=exp - time.time())
+    return payload
+
+
 def token_expiry(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         exp = payload.get("exp")
         if exp is None:
             raise HTTPException(status_code=401, detail="Token has no expiry time")
-        expiry_time = datetime.utcfromtimestamp(exp)
-        if expiry_time < datetime.utcnow():
+        if exp < time.time():
             raise HTTPException(status_code=401, detail="Token has expired")
         return True
     except JWTError:
@@ -47,13 +65,31 @@ def token_expiry(token: str):
 
 def verify_access_token(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         exp = payload.get("exp")
         if exp is None:
             raise HTTPException(status_code=401, detail="Token has no expiry time")
-        expiry_time = datetime.utcfromtimestamp(exp)
-        if expiry_time < datetime.utcnow():
+        if exp < time.time():
             raise HTTPException(status_code=401, detail="Token has expired")
         return payload
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def user_claims(user):
+    return {"sub": user.username, "uid": user.id, "active": user.is_active is not False}
+
+
+def verify_auth_context(token: str):
+    payload = verify_access_token(token)
+    username = payload.get("sub")
+    if not username:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    auth = schemas.AuthContext(
+        username=username,
+        user_id=payload.get("uid"),
+        is_active=payload.get("active", True),
+    )
+    if not auth.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return auth
@@ -1,60 +1,146 @@
-from fastapi import FastAPI, Depends, HTTPException
+import logging
+from contextlib import asynccontextmanager
+from anyio import to_thread
+from fastapi import (
+    APIRouter,
+    FastAPI,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
-from . import models, schemas, crud
-from .db import SessionLocal, engine
+from . import bulk, export, models, schemas, crud
+from . import db as app_db
+from .config import settings
+from .metrics import CONTENT_TYPE, MetricsMiddleware, render
+from .pool import pool_status
+from .querylog import QueryBudget, QueryBudgetRoute, QueryDebugMiddleware
+from .replicas import PrimaryPinMiddleware, wants_primary
+from .counts import CountMode, set_total_count
+from .etags import catalog_headers, catalog_row
+from .serialization import page_response, rows_response
+from .pagination import (
+    MAX_LIMIT,
+    MAX_SKIP,
+    decode_cursor,
+    decode_rank_cursor,
+    set_next_cursor,
+    set_next_rank_cursor,
+)
 from .jwt import (
     create_access_token,
     create_refresh_token,
-    verify_access_token,
     token_expiry,
+    user_claims,
+    verify_auth_context,
 )
 
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync routes and run_in_threadpool share this limiter; keep it at least
+    # as large as the pool so threads are not the tighter bottleneck
+    to_thread.current_default_thread_limiter().total_tokens = (
+        settings.anyio_thread_limit
+    )
+    # The schema is Alembic's job (alembic upgrade head), not every worker's
+    try:
+        await app_db.warm_pools()
+    except Exception:
+        # Serve anyway; requests connect on demand once the database is back
+        logger.warning("Could not warm the connection pools", exc_info=True)
+    yield
+    await app_db.dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
+if settings.read_replica_urls:
+    app.add_middleware(PrimaryPinMiddleware)
+if settings.query_debug:
+    app.add_middleware(QueryDebugMiddleware)
+# Outermost, so its timing covers the other middleware too
+app.add_middleware(MetricsMiddleware)
+router = APIRouter(route_class=QueryBudgetRoute)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 # Dependency
 def get_db():
-    db = SessionLocal()
+    db = app_db.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_read_db(request: Request, primary: Session = Depends(get_db)):
+    # Sessions connect lazily, so an unused primary session costs nothing
+    if not app_db.replicas or wants_primary(request):
+        yield primary
+        return
+    db = app_db.SessionLocal(bind=app_db.replicas.next(), info={"replica": True})
     try:
         yield db
     finally:
         db.close()
 
 
+def get_auth_context(token: str = Depends(oauth2_scheme)):
+    return verify_auth_context(token)
+
+
 def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
-):
-    payload = verify_access_token(token)
-    print(f"Token: {token}----")
-    print(f"Payload: {payload}=====")
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    username = payload.get("sub")
-    if not username:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    user = crud.get_user_by_username(db, username)
+    auth: schemas.AuthContext = Depends(get_auth_context),
+    db: Session = Depends(get_db),
+):
+    user = crud.get_user_by_auth(db, auth)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 
-@app.post("/users/register", response_model=schemas.User)
+def catalog_validators(table: str, row: bool = False):
+    # Answers 304 before the route body runs, so no rows are read or encoded.
+    # A by-id route (row=True) reads the version on the primary, like its
+    # row cache, and answers "If-None-Match: *" itself after the lookup
+    def dependency(
+        request: Request, db: Session = Depends(get_db if row else get_read_db)
+    ):
+        version = crud.get_table_version(db, table)
+        return catalog_headers(request, table, *version, row=row)
+
+    return dependency
+
+
+async def bulk_insert(request: Request, db: Session, schema, model):
+    # Parse the body on the event loop and run each chunk's INSERT in the pool
+    async def insert_chunk(chunk):
+        return await run_in_threadpool(crud.bulk_create, db, model, chunk)
+
+    return await bulk.load(request, schema, insert_chunk)
+
+
+@router.post("/users/register", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     return crud.create_user(db=db, user=user)
 
 
-@app.post("/users/login", response_model=schemas.Token)
+@router.post("/users/login", response_model=schemas.Token)
 def login_user(user: schemas.UserLogin, db: Session = Depends(get_db)):
     db_user = crud.authenticate_user(db, user.username, user.password)
     if not db_user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
-    access_token = create_access_token(data={"sub": db_user.username})
-    new_refresh_token = create_refresh_token(data={"sub": db_user.username})
+    claims = user_claims(db_user)
+    access_token = create_access_token(data=claims)
+    new_refresh_token = create_refresh_token(data=claims)
     return {
         "access_token": access_token,
         "refresh_token": new_refresh_token,
@@ -62,7 +148,7 @@ def login_user(user: schemas.UserLogin, db: Session = Depends(get_db)):
     }
 
 
-@app.post("/users/reset-password")
+@router.post("/users/reset-password")
 def reset_password(email: str, db: Session = Depends(get_db)):
     user = crud.get_user_by_email(db, email)
     if not user:
@@ -71,7 +157,7 @@ def reset_password(email: str, db: Session = Depends(get_db)):
     return {"msg": "Password reset link sent"}
 
 
-@app.delete("/users/deactivate/{username}")
+@router.delete("/users/deactivate/{username}")
 def deactivate_user(username: str, db: Session = Depends(get_db)):
     user = crud.get_user_by_username(db, username)
     if not user:
@@ -81,29 +167,51 @@ def deactivate_user(username: str, db: Session = Depends(get_db)):
     return {"msg": "User deactivated"}
 
 
-@app.get("/users/", response_model=list[schemas.User])
-def read_users(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    return crud.get_users(db, skip=skip, limit=limit)
+@router.get("/users/", response_model=list[schemas.User])
+def read_users(
+    response: Response,
+    skip: int = Query(0, ge=0, le=MAX_SKIP),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    count: CountMode | None = None,
+    db: Session = Depends(get_read_db),
+):
+    users = crud.get_users(db, skip=skip, limit=limit, after=decode_cursor(after))
+    set_next_cursor(response, users, limit)
+    if count:
+        total = crud.count_rows(db, models.User, count)
+        set_total_count(response, total)
+    return users
 
 
-@app.post("/magazines/", response_model=schemas.Magazine)
+@router.post("/magazines/", response_model=schemas.Magazine)
 def create_magazine(magazine: schemas.MagazineCreate, db: Session = Depends(get_db)):
     return crud.create_magazine(db=db, magazine=magazine)
 
 
-@app.post("/users/token/refresh", response_model=schemas.Token)
+@router.post("/magazines/bulk", response_model=schemas.BulkResult)
+async def bulk_create_magazines(request: Request, db: Session = Depends(get_db)):
+    try:
+        return await bulk_insert(request, db, schemas.MagazineCreate, models.Magazine)
+    finally:
+        # Chunks commit as they go, so a failed or cut-off load still has to
+        # move the ETag past the rows it already wrote
+        await run_in_threadpool(db.rollback)
+        await run_in_threadpool(crud.bump_table_version, db, "magazines")
+        crud.magazine_cache.clear()
+
+
+@router.post("/users/token/refresh", response_model=schemas.Token)
 def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
-    payload = verify_access_token(refresh_token)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    username = payload.get("sub")
-    if not username:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    db_user = crud.get_user_by_username(db, username)
+    auth = verify_auth_context(refresh_token)
+    db_user = crud.get_user_by_auth(db, auth)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
-    access_token = create_access_token(data={"sub": db_user.username})
-    refresh_token = create_refresh_token(data={"sub": db_user.username})
+    if db_user.is_active is False:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    claims = user_claims(db_user)
+    access_token = create_access_token(data=claims)
+    refresh_token = create_refresh_token(data=claims)
     return {
         "access_token": access_token,
         "refresh_token": refresh_token,
@@ -111,122 +219,329 @@ def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
     }
 
 
-@app.get("/magazines/", response_model=list[schemas.Magazine])
-def read_magazines(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    return crud.get_magazines(db, skip=skip, limit=limit)
+@router.get("/magazines/", response_model=list[schemas.Magazine])
+def read_magazines(
+    skip: int = Query(0, ge=0, le=MAX_SKIP),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    count: CountMode | None = None,
+    db: Session = Depends(get_read_db),
+    catalog: dict = Depends(catalog_validators("magazines")),
+):
+    magazines = crud.get_magazines(
+        db, skip=skip, limit=limit, after=decode_cursor(after)
+    )
+    response = page_response(magazines, limit, catalog)
+    if count:
+        total = crud.count_rows(db, models.Magazine, count)
+        set_total_count(response, total)
+    return response
+
+
+@router.get("/catalog/", response_model=list[schemas.CatalogMagazine])
+# Magazines, then every page's plans with their prices in one more query
+@QueryBudget(2)
+def read_catalog(
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    db: Session = Depends(get_read_db),
+):
+    magazines = crud.get_catalog(db, limit=limit, after=decode_cursor(after))
+    set_next_cursor(response, magazines, limit)
+    return magazines
+
+
+@router.get("/magazines/search", response_model=list[schemas.MagazineSearchResult])
+def search_magazines(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    db: Session = Depends(get_read_db),
+):
+    magazines = crud.search_magazines(
+        db, q, limit=limit, after=decode_rank_cursor(after)
+    )
+    response = rows_response(magazines)
+    set_next_rank_cursor(response, magazines, limit)
+    return response
+
+
+@router.get("/magazines/{magazine_id}", response_model=schemas.Magazine)
+def get_magazine_by_id(
+    magazine_id: int,
+    request: Request,
+    response: Response,
+    # The primary: the row cache must never be filled from a lagging replica
+    db: Session = Depends(get_db),
+    catalog: dict = Depends(catalog_validators("magazines", row=True)),
+):
+    db_magazine = crud.get_magazine_cached(db, magazine_id)
+    return catalog_row(request, response, db_magazine, catalog, "Magazine not found")
 
 
-@app.get("/magazines/{magazine_id}", response_model=schemas.Magazine)
-def get_magazine_by_id(magazine_id: int, db: Session = Depends(get_db)):
-    db_magazine = crud.get_magazine(db, magazine_id)
+@router.put("/magazines/{magazine_id}", response_model=schemas.Magazine)
+def update_magazine(
+    magazine_id: int,
+    magazine: schemas.MagazineCreate,
+    db: Session = Depends(get_db),
+):
+    db_magazine = crud.update_magazine(db, magazine_id, magazine)
     if not db_magazine:
         raise HTTPException(status_code=404, detail="Magazine not found")
     return db_magazine
 
 
-@app.put("/magazines/{magazine_id}", response_model=schemas.Magazine)
-def update_magazine(
-    magazine_id: int, magazine: schemas.MagazineCreate, db: Session = Depends(get_db)
+@router.patch("/magazines/{magazine_id}", response_model=schemas.Magazine)
+def patch_magazine(
+    magazine_id: int,
+    magazine: schemas.MagazinePatch,
+    db: Session = Depends(get_db),
 ):
-    db_magazine = crud.get_magazine(db, magazine_id)
+    db_magazine = crud.patch_magazine(db, magazine_id, magazine)
     if not db_magazine:
         raise HTTPException(status_code=404, detail="Magazine not found")
-    db_magazine.title = magazine.title
-    db_magazine.description = magazine.description
-    db_magazine.base_price = magazine.base_price
-    db.commit()
-    db.refresh(db_magazine)
     return db_magazine
 
 
-@app.delete("/magazines/{magazine_id}", response_model=schemas.Magazine)
+@router.delete("/magazines/{magazine_id}", response_model=schemas.Magazine)
 def delete_magazine(magazine_id: int, db: Session = Depends(get_db)):
-    db_magazine = crud.get_magazine(db, magazine_id)
+    db_magazine = crud.delete_magazine(db, magazine_id)
     if not db_magazine:
         raise HTTPException(status_code=404, detail="Magazine not found")
-    crud.delete_magazine(db, magazine_id)
     return db_magazine
 
 
-@app.post("/plans/", response_model=schemas.Plan)
+@router.post("/plans/", response_model=schemas.Plan)
 def create_plan(plan: schemas.PlanCreate, db: Session = Depends(get_db)):
     return crud.create_plan(db=db, plan=plan)
 
 
-@app.get("/plans/", response_model=list[schemas.Plan])
-def read_plans(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    return crud.get_plans(db, skip=skip, limit=limit)
+@router.post("/plans/bulk", response_model=schemas.BulkResult)
+async def bulk_create_plans(request: Request, db: Session = Depends(get_db)):
+    try:
+        return await bulk_insert(request, db, schemas.PlanCreate, models.Plan)
+    finally:
+        # Price and version whatever was committed, even if the load failed
+        await run_in_threadpool(db.rollback)
+        await run_in_threadpool(crud.backfill_plan_prices, db)
+        await run_in_threadpool(crud.bump_table_version, db, "plans")
+        crud.plan_cache.clear()
+
+
+@router.get("/plans/", response_model=list[schemas.Plan])
+def read_plans(
+    skip: int = Query(0, ge=0, le=MAX_SKIP),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    count: CountMode | None = None,
+    db: Session = Depends(get_read_db),
+    catalog: dict = Depends(catalog_validators("plans")),
+):
+    plans = crud.get_plans(db, skip=skip, limit=limit, after=decode_cursor(after))
+    response = page_response(plans, limit, catalog)
+    if count:
+        total = crud.count_rows(db, models.Plan, count)
+        set_total_count(response, total)
+    return response
+
+
+@router.get("/plans/{plan_id}", response_model=schemas.Plan)
+def get_plan_by_id(
+    plan_id: int,
+    request: Request,
+    response: Response,
+    # The primary: the row cache must never be filled from a lagging replica
+    db: Session = Depends(get_db),
+    catalog: dict = Depends(catalog_validators("plans", row=True)),
+):
+    db_plan = crud.get_plan_cached(db, plan_id)
+    return catalog_row(request, response, db_plan, catalog, "Plan not found")
 
 
-@app.get("/plans/{plan_id}", response_model=schemas.Plan)
-def get_plan_by_id(plan_id: int, db: Session = Depends(get_db)):
-    db_plan = crud.get_plan(db, plan_id)
+@router.put("/plans/{plan_id}", response_model=schemas.Plan)
+def update_plan(
+    plan_id: int,
+    plan: schemas.PlanCreate,
+    db: Session = Depends(get_db),
+):
+    db_plan = crud.update_plan(db, plan_id, plan)
     if not db_plan:
         raise HTTPException(status_code=404, detail="Plan not found")
     return db_plan
 
 
-@app.put("/plans/{plan_id}", response_model=schemas.Plan)
-def update_plan(plan_id: int, plan: schemas.PlanCreate, db: Session = Depends(get_db)):
-    db_plan = crud.get_plan(db, plan_id)
+@router.patch("/plans/{plan_id}", response_model=schemas.Plan)
+def patch_plan(
+    plan_id: int,
+    plan: schemas.PlanPatch,
+    db: Session = Depends(get_db),
+):
+    db_plan = crud.patch_plan(db, plan_id, plan)
     if not db_plan:
         raise HTTPException(status_code=404, detail="Plan not found")
-    return crud.update_plan(db=db, plan_id=plan_id, plan=plan)
+    return db_plan
 
 
-@app.delete("/plans/{plan_id}", response_model=schemas.Plan)
+@router.delete("/plans/{plan_id}", response_model=schemas.Plan)
 def delete_plan(plan_id: int, db: Session = Depends(get_db)):
-    db_plan = crud.get_plan(db, plan_id)
+    db_plan = crud.delete_plan(db, plan_id)
     if not db_plan:
         raise HTTPException(status_code=404, detail="Plan not found")
-    crud.delete_plan(db, plan_id)
     return db_plan
 
 
-@app.post("/subscriptions/", response_model=schemas.Subscription)
+@router.post("/subscriptions/", response_model=schemas.Subscription)
 def create_subscription(
     subscription: schemas.SubscriptionCreate, db: Session = Depends(get_db)
 ):
     return crud.create_subscription(db=db, subscription=subscription)
 
 
-@app.put("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
+@router.post("/subscriptions/bulk", response_model=schemas.BulkResult)
+async def bulk_create_subscriptions(request: Request, db: Session = Depends(get_db)):
+    # Rows without a price are priced per chunk, before their INSERT
+    async def insert_chunk(chunk):
+        return await run_in_threadpool(crud.bulk_create_subscriptions, db, chunk)
+
+    return await bulk.load(request, schemas.SubscriptionCreate, insert_chunk)
+
+
+@router.put("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
 def update_subscription(
     subscription_id: int,
     subscription: schemas.SubscriptionUpdate,
     db: Session = Depends(get_db),
 ):
-    db_subscription = crud.get_subscription(db, subscription_id)
+    db_subscription = crud.update_subscription(db, subscription_id, subscription)
     if not db_subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
-    return crud.update_subscription(
-        db=db, subscription_id=subscription_id, subscription=subscription
-    )
+    return db_subscription
+
+
+@router.patch("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
+def patch_subscription(
+    subscription_id: int,
+    subscription: schemas.SubscriptionPatch,
+    db: Session = Depends(get_db),
+):
+    db_subscription = crud.patch_subscription(db, subscription_id, subscription)
+    if not db_subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    return db_subscription
 
 
-@app.get("/subscriptions/", response_model=list[schemas.Subscription])
-def read_subscriptions(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    return crud.get_subscriptions(db, skip=skip, limit=limit)
+@router.get("/subscriptions/", response_model=list[schemas.Subscription])
+def read_subscriptions(
+    skip: int = Query(0, ge=0, le=MAX_SKIP),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    count: CountMode | None = None,
+    db: Session = Depends(get_read_db),
+):
+    subscriptions = crud.get_subscriptions(
+        db, skip=skip, limit=limit, after=decode_cursor(after)
+    )
+    response = page_response(subscriptions, limit)
+    if count:
+        total = crud.count_rows(db, models.Subscription, count)
+        set_total_count(response, total)
+    return response
+
+
+@router.get("/subscriptions/export")
+def export_subscriptions(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    user_id: int | None = None,
+    plan_id: int | None = None,
+    is_active: bool | None = None,
+    db: Session = Depends(get_read_db),
+):
+    partitions = crud.iter_subscriptions(
+        db, user_id=user_id, plan_id=plan_id, is_active=is_active
+    )
+    return StreamingResponse(
+        export.format_partitions(format, export.SUBSCRIPTION_COLUMNS, partitions),
+        media_type=export.MEDIA_TYPES[format],
+    )
 
 
-@app.get("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
-def get_subscription_by_id(subscription_id: int, db: Session = Depends(get_db)):
+@router.get("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
+def get_subscription_by_id(subscription_id: int, db: Session = Depends(get_read_db)):
     db_subscription = crud.get_subscription(db, subscription_id)
     if not db_subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
     return db_subscription
 
 
-@app.get("/users/me", response_model=schemas.User)
-def read_users_me(current_user: schemas.User = Depends(get_current_user)):
-    token = current_user.token
+@router.get("/users/me", response_model=schemas.User)
+def read_users_me(
+    token: str = Depends(oauth2_scheme),
+    current_user: schemas.User = Depends(get_current_user),
+):
     token_expiry(token)
     return current_user
 
 
-@app.delete("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
+@router.get("/users/me/subscriptions", response_model=list[schemas.UserSubscription])
+# The user, one joined page query, plus the total when ?count is given
+@QueryBudget(3)
+def read_my_subscriptions(
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_LIMIT),
+    after: str | None = None,
+    count: CountMode | None = None,
+    current_user: schemas.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    subscriptions = crud.get_user_subscriptions(
+        db, current_user.id, limit=limit, after=decode_cursor(after)
+    )
+    set_next_cursor(response, subscriptions, limit)
+    if count:
+        criteria = crud.user_subscription_criteria(current_user.id)
+        total = crud.count_rows(db, models.Subscription, count, *criteria)
+        set_total_count(response, total)
+    return subscriptions
+
+
+@router.delete("/subscriptions/{subscription_id}", response_model=schemas.Subscription)
 def delete_subscription(subscription_id: int, db: Session = Depends(get_db)):
-    db_subscription = crud.get_subscription(db, subscription_id)
+    db_subscription = crud.delete_subscription(db, subscription_id)
     if not db_subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
-    return crud.delete_subscription(db, subscription_id)
+    return db_subscription
+
+
+@app.get("/internal/pool")
+async def read_pool_status():
+    limiter = to_thread.current_default_thread_limiter()
+    status = {
+        "sync": pool_status(app_db.engine),
+        "threads": {
+            "limit": limiter.total_tokens,
+            "busy": limiter.borrowed_tokens,
+        },
+    }
+    if app_db.async_engine is not None:
+        status["async"] = pool_status(app_db.async_engine)
+    if app_db.replicas or app_db.async_replicas:
+        status["replicas"] = [
+            pool_status(replica)
+            for replica in app_db.replicas.engines + app_db.async_replicas.engines
+        ]
+    return status
+
+
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    return Response(render(), media_type=CONTENT_TYPE)
+
+
+# Mount the routes last so every handler above is registered on the router
+if settings.async_db:
+    from .async_routes import router as async_router
+
+    app.include_router(async_router)
+else:
+    app.include_router(router)
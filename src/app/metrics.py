@@ -0,0 +1,220 @@
+"""Request and SQL metrics in the Prometheus text format.
+
+``MetricsMiddleware`` times every HTTP request under its route template, and
+cursor hooks on each engine charge statements and SQL time to the request
+that ran them.  ``render()`` builds the ``/metrics`` body.  Metrics live in
+process memory, so scrape each worker.
+"""
+
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+UNMATCHED_ROUTE = "<unmatched>"
+
+registry = []
+
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        # labels -> per-bucket counts (last one is +Inf), then the sum
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        bounds = [repr(float(bound)) for bound in self.buckets] + ["+Inf"]
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(bounds, values):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            rendered = _labels(self.labelnames, labels)
+            yield f"{self.name}_sum{rendered} {values[-1]}"
+            yield f"{self.name}_count{rendered} {cumulative}"
+
+
+requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served."
+)
+requests_total = Counter(
+    "http_requests_total",
+    "HTTP requests by route and status.",
+    ("method", "route", "status"),
+)
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency.",
+    LATENCY_BUCKETS,
+    ("method", "route"),
+)
+request_statements = Histogram(
+    "http_request_db_statements",
+    "SQL statements executed per HTTP request.",
+    STATEMENT_BUCKETS,
+    ("method", "route"),
+)
+request_sql_duration = Histogram(
+    "http_request_db_seconds",
+    "Time spent in SQL per HTTP request.",
+    LATENCY_BUCKETS,
+    ("method", "route"),
+)
+statement_duration = Histogram(
+    "db_statement_duration_seconds", "SQL statement latency.", LATENCY_BUCKETS
+)
+
+# [statements, seconds] of the request being served; the list is shared by
+# reference with the thread-pool copies of the context sync routes run in
+_request_sql = ContextVar("request_sql", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    statement_duration.observe(elapsed)
+    sql = _request_sql.get()
+    if sql is not None:
+        sql[0] += 1
+        sql[1] += elapsed
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute doesn't fire for a failed statement
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def instrument_engine(engine):
+    """Time every statement run through ``engine`` (a sync ``Engine``; pass
+    ``AsyncEngine.sync_engine`` for async ones)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    """Record latency, status and SQL usage of each HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        sql = [0, 0.0]
+        token = _request_sql.set(sql)
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight.dec()
+            _request_sql.reset(token)
+            # The router stores the matched route in the scope; label by its
+            # template so ids in the path don't explode the series count
+            route = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+            labels = (scope["method"], route)
+            requests_total.inc((*labels, str(status)))
+            request_duration.observe(elapsed, labels)
+            request_statements.observe(sql[0], labels)
+            request_sql_duration.observe(sql[1], labels)
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
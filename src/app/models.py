@@ -1,4 +1,14 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, Date, Boolean
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    ForeignKey,
+    Float,
+    Date,
+    Boolean,
+    DateTime,
+    Index,
+)
 from sqlalchemy.orm import relationship
 from .db import Base
 
@@ -9,6 +19,7 @@ class User(Base):
     username = Column(String, index=True)
     email = Column(String, unique=True, index=True)
     password = Column(String)
+    is_active = Column(Boolean, default=True)
     subscriptions = relationship("Subscription", back_populates="user")
 
 
@@ -26,9 +37,30 @@ class Plan(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     price = Column(Integer)
+    discount = Column(Float, default=0.0)
+    # Months between renewals
+    renewal_period = Column(Integer, default=1)
     magazine_id = Column(Integer, ForeignKey("magazines.id"))
     magazine = relationship("Magazine", back_populates="plans")
     subscriptions = relationship("Subscription", back_populates="plan")
+    price_entry = relationship("PlanPrice", uselist=False, viewonly=True)
+
+    @property
+    def discounted_price(self):
+        return self.price_entry.price if self.price_entry else None
+
+
+class PlanPrice(Base):
+    """Precomputed subscription price for each magazine/plan pair.
+
+    Rebuilt by the crud write path in the same transaction as any change to
+    a plan or its magazine's base_price, so reads are a primary-key lookup.
+    """
+
+    __tablename__ = "plan_prices"
+    plan_id = Column(Integer, ForeignKey("plans.id"), primary_key=True)
+    magazine_id = Column(Integer, ForeignKey("magazines.id"), index=True)
+    price = Column(Float, nullable=False)
 
 
 class Subscription(Base):
@@ -41,3 +73,45 @@ class Subscription(Base):
     next_renewal_date = Column(Date)
     is_active = Column(Boolean, default=True)
     plan = relationship("Plan", back_populates="subscriptions")
+
+    __table_args__ = (
+        # Due active subscriptions in (date, id) order for the renewal job
+        Index(
+            "ix_subscriptions_renewal_due",
+            "next_renewal_date",
+            "id",
+            postgresql_where=is_active.is_(True),
+            sqlite_where=is_active.is_(True),
+        ),
+        # At most one active subscription per user and plan (and so per
+        # magazine); create_subscription inserts ON CONFLICT against it
+        Index(
+            "uq_subscriptions_active_user_plan",
+            "user_id",
+            "plan_id",
+            unique=True,
+            postgresql_where=is_active.is_(True),
+            sqlite_where=is_active.is_(True),
+        ),
+        # A user's active subscriptions in id order for /users/me/subscriptions
+        Index(
+            "ix_subscriptions_user_active",
+            "user_id",
+            "id",
+            postgresql_where=is_active.is_(True),
+            sqlite_where=is_active.is_(True),
+        ),
+    )
+
+
+class TableVersion(Base):
+    """Per-table change counter behind the catalog ETags.
+
+    Bumped in the same transaction as every write to the table.
+    """
+
+    __tablename__ = "table_versions"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+    # Naive UTC, truncated to whole seconds like HTTP dates
+    updated_at = Column(DateTime, nullable=False)
@@ -0,0 +1,60 @@
+import base64
+import binascii
+from fastapi import HTTPException, Response
+
+# Offset paging costs O(skip) in the database, so keep it shallow and steer
+# deep paging towards ?after=<cursor>
+MAX_SKIP = 1000
+MAX_LIMIT = 100
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Ids are 64-bit signed integers; anything larger overflows the driver
+MAX_CURSOR_ID = 2**63 - 1
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def cursor_id(value: str):
+    # 0 is before the first row, which some clients use to start a walk
+    last_id = int(value)
+    if not 0 <= last_id <= MAX_CURSOR_ID:
+        raise ValueError(f"cursor id out of range: {last_id}")
+    return last_id
+
+
+def decode_cursor(cursor: str | None):
+    if cursor is None:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return cursor_id(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def set_next_cursor(response: Response, items, limit: int):
+    if items and len(items) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(items[-1].id)
+
+
+def encode_rank_cursor(rank: float, last_id: int):
+    return encode_cursor(f"{rank!r}:{last_id}")
+
+
+def decode_rank_cursor(cursor: str | None):
+    # Ranked results page on (rank, id) rather than id alone
+    if cursor is None:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, last_id = base64.urlsafe_b64decode(padded.encode()).decode().split(":")
+        return float(rank), cursor_id(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def set_next_rank_cursor(response: Response, items, limit: int):
+    if items and len(items) == limit:
+        last = items[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_rank_cursor(last.rank, last.id)
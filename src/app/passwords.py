@@ -0,0 +1,46 @@
+import asyncio
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from .config import settings
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds
+)
+
+# bcrypt releases the GIL, so a small thread pool bounds how many cores
+# hashing can take without blocking the event loop or AnyIO's thread pool
+hash_executor = ThreadPoolExecutor(
+    max_workers=settings.password_hash_workers, thread_name_prefix="bcrypt"
+)
+
+
+def _verify_and_update(password: str, password_hash: str):
+    if pwd_context.identify(password_hash) is None:
+        # Rows written before hashing was wired in hold the plaintext
+        if hmac.compare_digest(password.encode(), password_hash.encode()):
+            return True, pwd_context.hash(password)
+        return False, None
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+def hash_password(password: str):
+    return hash_executor.submit(pwd_context.hash, password).result()
+
+
+def verify_password(password: str, password_hash: str):
+    """Return ``(valid, new_hash)``; new_hash is set when the stored hash
+    should be replaced because the configured work factor changed."""
+    return hash_executor.submit(_verify_and_update, password, password_hash).result()
+
+
+async def hash_password_async(password: str):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hash_executor, pwd_context.hash, password)
+
+
+async def verify_password_async(password: str, password_hash: str):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        hash_executor, _verify_and_update, password, password_hash
+    )
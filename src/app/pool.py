@@ -0,0 +1,110 @@
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class WaitStats:
+    """Running totals of how long checkouts waited for a connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+
+    def record(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": (
+                    self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0
+                ),
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+# Seconds the current checkout spent opening new connections; set per
+# context so concurrent checkouts, threads or tasks, keep separate totals
+_connect_time: ContextVar[list[float] | None] = ContextVar(
+    "pool_connect_time", default=None
+)
+
+
+class _TimedPoolMixin:
+    # _do_get is where QueuePool blocks when every connection is checked out
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = WaitStats()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+    def _do_get(self):
+        if _connect_time.get() is not None:
+            # QueuePool retries by calling _do_get again; time the outer call
+            return super()._do_get()
+        connecting = [0.0]
+        token = _connect_time.set(connecting)
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except TimeoutError:
+            self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        finally:
+            _connect_time.reset(token)
+        # Opening an overflow connection is connect latency, not queue wait
+        self.wait_stats.record(time.perf_counter() - start - connecting[0])
+        return conn
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            connecting = _connect_time.get()
+            if connecting is not None:
+                connecting[0] += time.perf_counter() - start
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_status(engine):
+    pool = engine.pool
+    status = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        checked_out = pool.checkedout()
+        status.update(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_out=checked_out,
+            idle=pool.checkedin(),
+            # Negative until the pool has opened pool_size connections
+            overflow=max(pool.overflow(), 0),
+            timeout=pool.timeout(),
+        )
+    stats = getattr(pool, "wait_stats", None)
+    if stats is not None:
+        status["wait"] = stats.snapshot()
+    return status
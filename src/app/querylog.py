@@ -0,0 +1,193 @@
+"""Per-request SQL logs, N+1 detection and query budgets.
+
+Statements are grouped by shape: the SQL with literals and bound values
+replaced by ``?``, so the same lazy load issued once per parent row shows up
+as one shape with a high count.
+
+``QueryBudget(n)`` works as a context manager or as a decorator on a sync or
+async function (a route, a crud helper).  On a route of a router built with
+``route_class=QueryBudgetRoute`` it covers the whole request: dependencies,
+the endpoint and the ``response_model`` serialization, where lazy loads run.
+Exceeding the budget raises
+``QueryBudgetExceeded`` when ``QUERY_DEBUG`` is on, as in the tests, and only
+logs a warning otherwise.  ``QueryDebugMiddleware`` logs each request's
+repeated shapes and reports its statement count in ``X-Query-Count``.
+"""
+
+import functools
+import inspect
+import logging
+import re
+from collections import Counter
+from contextvars import ContextVar
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_HEADER = b"x-query-count"
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+# Placeholders of the DBAPI paramstyles: ?, %s, %(name)s, $1, :name
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<!:):\w+")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+# Logs of every QueryLog open in this context, innermost last
+_active = ContextVar("query_logs", default=())
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize(statement: str):
+    shape = _STRING.sub("?", statement)
+    shape = _PARAMETER.sub("?", shape)
+    shape = _NUMBER.sub("?", shape)
+    # IN lists expand to one placeholder per value; count them as one shape
+    shape = _VALUE_LIST.sub("(?)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+class QueryLog:
+    """Statements run while this log was open, grouped by shape."""
+
+    def __init__(self):
+        self.statements = 0
+        self.shapes = Counter()
+
+    def add(self, statement: str):
+        self.statements += 1
+        self.shapes[normalize(statement)] += 1
+
+    def repeated(self, threshold: int = None):
+        """``(shape, count)`` of the shapes run at least ``threshold`` times."""
+        if threshold is None:
+            threshold = settings.query_repeat_threshold
+        return [
+            (shape, count)
+            for shape, count in self.shapes.most_common()
+            if count >= threshold
+        ]
+
+    def report(self):
+        return "\n".join(
+            f"{count:>5} x {shape}" for shape, count in self.shapes.most_common()
+        )
+
+
+def _record(conn, cursor, statement, parameters, context, many):
+    for log in _active.get():
+        log.add(statement)
+
+
+def watch_engine(engine):
+    """Feed statements run through ``engine`` to the open QueryLogs (a sync
+    ``Engine``; pass ``AsyncEngine.sync_engine`` for async ones)."""
+    event.listen(engine, "before_cursor_execute", _record)
+
+
+def _open(log: QueryLog):
+    return _active.set(_active.get() + (log,))
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudget:
+    """Allow at most ``max_queries`` statements inside the block or call."""
+
+    def __init__(self, max_queries: int, strict: bool = None):
+        self.max_queries = max_queries
+        self.strict = settings.query_debug if strict is None else strict
+
+    def __enter__(self):
+        self.log = QueryLog()
+        self._token = _open(self.log)
+        return self.log
+
+    def __exit__(self, exc_type, exc, tb):
+        _active.reset(self._token)
+        if exc_type is None and self.log.statements > self.max_queries:
+            message = (
+                f"{self.log.statements} statements, budget {self.max_queries}:\n"
+                f"{self.log.report()}"
+            )
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            logger.warning("Query budget exceeded: %s", message)
+
+    def __call__(self, func):
+        # A fresh budget per call, so concurrent calls don't share a log
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with QueryBudget(self.max_queries, self.strict):
+                    return await func(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with QueryBudget(self.max_queries, self.strict):
+                    return func(*args, **kwargs)
+
+        # Read by QueryBudgetRoute to budget the whole request
+        wrapper.query_budget = self
+        return wrapper
+
+
+class QueryBudgetRoute(APIRoute):
+    """Applies an endpoint's ``@QueryBudget`` to the whole request handler."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        budget = getattr(self.endpoint, "query_budget", None)
+        if budget is None:
+            return handler
+
+        async def budgeted_handler(request):
+            # The handler returns the rendered response, so serialization
+            # happens inside the budget
+            with QueryBudget(budget.max_queries, budget.strict):
+                return await handler(request)
+
+        return budgeted_handler
+
+
+class QueryDebugMiddleware:
+    """Log every request's repeated statement shapes (likely N+1 queries)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        log = QueryLog()
+
+        async def send_with_count(message):
+            if message["type"] == "http.response.start":
+                # Streamed bodies may still run statements after this point
+                headers = list(message.get("headers", []))
+                headers.append((QUERY_COUNT_HEADER, str(log.statements).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = _open(log)
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            _active.reset(token)
+            repeated = log.repeated()
+            if repeated:
+                logger.warning(
+                    "%s %s ran %d statements; repeated shapes:\n%s",
+                    scope["method"],
+                    scope["path"],
+                    log.statements,
+                    "\n".join(f"{count:>5} x {shape}" for shape, count in repeated),
+                )
@@ -0,0 +1,73 @@
+"""Batch renewal of due subscriptions.
+
+Run from ``src/`` with ``python -m app.renewals [--date YYYY-MM-DD]``, e.g.
+from cron.  It renews every user's subscriptions, so it has no API route.
+"""
+
+import argparse
+import calendar
+import time
+from datetime import date
+from sqlalchemy.orm import Session
+from . import crud
+from .config import settings
+
+
+def add_months(day: date, months: int):
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def renewal_values(row, today: date):
+    period = max(row.renewal_period or 1, 1)
+    # Step from the original date so month-end renewals do not drift, and
+    # skip any periods a missed run left behind so the row is no longer due
+    months = period
+    while add_months(row.next_renewal_date, months) <= today:
+        months += period
+    next_date = add_months(row.next_renewal_date, months)
+    # The price is set from the plan by the UPDATE itself
+    return {"id": row.id, "next_renewal_date": next_date}
+
+
+def run_renewals(db: Session, today: date = None, chunk_size: int = None):
+    today = today or date.today()
+    chunk_size = chunk_size or settings.renewal_chunk_size
+    renewed = 0
+    start = time.perf_counter()
+    while True:
+        # Renewed rows move past today and drop out of the due set, so the
+        # next chunk is always the head of the index again
+        rows = crud.get_due_subscriptions(db, today, limit=chunk_size)
+        if not rows:
+            break
+        crud.renew_subscriptions(db, [renewal_values(row, today) for row in rows])
+        renewed += len(rows)
+    elapsed = time.perf_counter() - start
+    return {
+        "renewed": renewed,
+        "elapsed_seconds": elapsed,
+        "rows_per_second": renewed / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Renew due subscriptions")
+    parser.add_argument("--date", type=date.fromisoformat, default=None)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    args = parser.parse_args()
+
+    from .db import SessionLocal
+
+    with SessionLocal() as db:
+        result = run_renewals(db, today=args.date, chunk_size=args.chunk_size)
+    print(
+        f"renewed {result['renewed']} subscriptions in "
+        f"{result['elapsed_seconds']:.2f}s ({result['rows_per_second']:.0f} rows/sec)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import itertools
+import threading
+from .config import settings
+
+PRIMARY_HEADER = "x-read-primary"
+PRIMARY_COOKIE = "read_primary"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class ReplicaSet:
+    """Round-robin over read-replica engines; empty means read the primary."""
+
+    def __init__(self, engines):
+        self.engines = list(engines)
+        self._cycle = itertools.cycle(self.engines)
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.engines)
+
+    def next(self):
+        with self._lock:
+            return next(self._cycle)
+
+
+def wants_primary(request):
+    # Explicit header, or the cookie set after this client's last write
+    hint = request.headers.get(PRIMARY_HEADER, "").lower()
+    if hint in ("1", "true", "yes"):
+        return True
+    return request.cookies.get(PRIMARY_COOKIE) == "1"
+
+
+class PrimaryPinMiddleware:
+    """Pin a client to the primary for a while after a successful write so
+    it reads its own writes despite replication lag."""
+
+    def __init__(self, app, pin_seconds: int = None):
+        self.app = app
+        self.pin_seconds = (
+            settings.replica_pin_seconds if pin_seconds is None else pin_seconds
+        )
+        self.cookie = (
+            f"{PRIMARY_COOKIE}=1; Max-Age={self.pin_seconds}; Path=/; HttpOnly"
+        ).encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = list(message.get("headers", []))
+                headers.append((b"set-cookie", self.cookie))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
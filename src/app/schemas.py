@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 from datetime import date
 
 
@@ -13,6 +13,12 @@ class Token(BaseModel):
     token_type: str
 
 
+class AuthContext(BaseModel):
+    username: str
+    user_id: int | None = None
+    is_active: bool = True
+
+
 class UserCreate(UserBase):
     password: str
 
@@ -38,6 +44,24 @@ class MagazineCreate(MagazineBase):
     base_price: float
 
 
+class PatchModel(BaseModel):
+    """Partial update: a field may be left out, but not sent as null."""
+
+    @field_validator("*")
+    @classmethod
+    def not_null(cls, value):
+        # Defaults aren't validated, so this only sees fields that were sent
+        if value is None:
+            raise ValueError("may be omitted but not null")
+        return value
+
+
+class MagazinePatch(PatchModel):
+    title: str | None = None
+    description: str | None = None
+    base_price: float | None = None
+
+
 class Magazine(MagazineBase):
     id: int
 
@@ -48,12 +72,22 @@ class Magazine(MagazineBase):
 class PlanBase(BaseModel):
     name: str
     price: int
+    discount: float = Field(default=0.0, ge=0, lt=1)
+    renewal_period: int = Field(default=1, ge=1)
 
 
 class PlanCreate(PlanBase):
     magazine_id: int
 
 
+class PlanPatch(PatchModel):
+    name: str | None = None
+    price: int | None = None
+    discount: float | None = Field(default=None, ge=0, lt=1)
+    renewal_period: int | None = Field(default=None, ge=1)
+    magazine_id: int | None = None
+
+
 class Plan(PlanBase):
     id: int
     magazine_id: int
@@ -62,6 +96,20 @@ class Plan(PlanBase):
         orm_mode = True
 
 
+class MagazineSearchResult(Magazine):
+    rank: float
+
+
+class CatalogPlan(Plan):
+    # None until the plan has a plan_prices row, e.g. a plan without a magazine
+    discounted_price: float | None = None
+
+
+class CatalogMagazine(Magazine):
+    base_price: float
+    plans: list[CatalogPlan]
+
+
 class SubscriptionBase(BaseModel):
     user_id: int
     plan_id: int
@@ -70,16 +118,43 @@ class SubscriptionBase(BaseModel):
 
 
 class SubscriptionCreate(SubscriptionBase):
-    pass
+    # Defaults to the plan's current price from plan_prices
+    price: float | None = None
 
 
 class SubscriptionUpdate(SubscriptionBase):
     is_active: bool
 
 
+class SubscriptionPatch(PatchModel):
+    user_id: int | None = None
+    plan_id: int | None = None
+    price: float | None = None
+    next_renewal_date: date | None = None
+    is_active: bool | None = None
+
+
 class Subscription(SubscriptionBase):
     id: int
     is_active: bool
 
     class Config:
         orm_mode = True
+
+
+class SubscriptionPlan(Plan):
+    magazine: Magazine
+
+
+class UserSubscription(Subscription):
+    plan: SubscriptionPlan
+
+
+class BulkError(BaseModel):
+    index: int
+    error: str
+
+
+class BulkResult(BaseModel):
+    inserted: int
+    errors: list[BulkError]
@@ -0,0 +1,121 @@
+"""Full-text search over magazine titles and descriptions.
+
+PostgreSQL keeps a generated, weighted ``tsvector`` column with a GIN index;
+SQLite keeps an external-content FTS5 table in sync with triggers.  Both are
+created alongside the ``magazines`` table.
+"""
+
+import re
+from sqlalchemy import DDL, column, event, func, literal_column, or_, select, table
+from .config import settings
+from .models import Magazine
+
+POSTGRES_DDL = [
+    "ALTER TABLE magazines ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX ix_magazines_search_vector ON magazines USING GIN (search_vector)",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE magazines_fts USING fts5("
+    "title, description, content='magazines', content_rowid='id', "
+    "tokenize='porter unicode61')",
+    "CREATE TRIGGER magazines_fts_insert AFTER INSERT ON magazines BEGIN "
+    "INSERT INTO magazines_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER magazines_fts_delete AFTER DELETE ON magazines BEGIN "
+    "INSERT INTO magazines_fts(magazines_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER magazines_fts_update AFTER UPDATE ON magazines BEGIN "
+    "INSERT INTO magazines_fts(magazines_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO magazines_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+]
+
+for statement in POSTGRES_DDL:
+    event.listen(
+        Magazine.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="postgresql"),
+    )
+for statement in SQLITE_DDL:
+    event.listen(
+        Magazine.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+event.listen(
+    Magazine.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS magazines_fts").execute_if(dialect="sqlite"),
+)
+
+# Title matches outrank description matches in both backends
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+
+def has_terms(q: str):
+    return re.search(r"\w", q) is not None
+
+
+def fts5_query(q: str):
+    # Quote every word so user input can't use (or break) FTS5 query syntax
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", q))
+
+
+def _postgres_matches(q: str):
+    search_vector = literal_column("magazines.search_vector")
+    query = func.websearch_to_tsquery("english", q)
+    # ts_rank_cd takes weights in {D, C, B, A} order, each at most 1
+    weights = literal_column(
+        f"'{{0, 0, {DESCRIPTION_WEIGHT / TITLE_WEIGHT}, 1}}'::float4[]"
+    )
+    rank = func.ts_rank_cd(weights, search_vector, query)
+    return Magazine.id, rank, search_vector.op("@@")(query)
+
+
+magazines_fts = table("magazines_fts", column("rowid"))
+
+
+def _sqlite_matches(q: str):
+    fts = literal_column("magazines_fts")
+    # bm25 is lower-is-better; negate it so both backends sort rank descending
+    rank = -func.bm25(fts, TITLE_WEIGHT, DESCRIPTION_WEIGHT)
+    return magazines_fts.c.rowid, rank, fts.op("MATCH")(fts5_query(q))
+
+
+def search_statement(dialect: str, q: str, limit: int, after=None):
+    """Ranked ``(id, title, description, rank)`` rows, best match first.
+
+    ``after`` is the ``(rank, id)`` of the last row of the previous page.
+    """
+    matches = _postgres_matches if dialect == "postgresql" else _sqlite_matches
+    match_id, rank, condition = matches(q)
+    # Every candidate is scored before the LIMIT applies (on PostgreSQL that
+    # reads its heap row), so a term found in most of the catalog ranks only
+    # its first search_candidates matches by id. Fetching those ids stops
+    # early on either index, and the ranks use whole-index statistics, so
+    # cursors stay valid
+    first = (
+        select(match_id.label("id"))
+        .where(condition)
+        .order_by(match_id)
+        .limit(settings.search_candidates)
+        .subquery()
+    )
+    condition = condition & (match_id <= select(func.max(first.c.id)).scalar_subquery())
+    # Rank and cut the page of ids, then fetch only those magazines
+    ranked = rank.label("rank")
+    page = select(match_id.label("id"), ranked).where(condition)
+    if after is not None:
+        last_rank, last_id = after
+        page = page.where(
+            or_(rank < last_rank, (rank == last_rank) & (match_id > last_id))
+        )
+    page = page.order_by(ranked.desc(), match_id).limit(limit).subquery()
+    return (
+        select(Magazine.id, Magazine.title, Magazine.description, page.c.rank)
+        .join(page, page.c.id == Magazine.id)
+        .order_by(page.c.rank.desc(), page.c.id)
+    )
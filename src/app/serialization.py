@@ -0,0 +1,32 @@
+import orjson
+from fastapi import Response
+from .pagination import set_next_cursor
+
+
+class RawJSONResponse(Response):
+    # The body is already encoded; Response just sends the bytes
+    media_type = "application/json"
+
+
+def schema_columns(model, schema):
+    # Select exactly the response model's fields so rows can be dumped as-is
+    return [model.__table__.c[name] for name in schema.model_fields]
+
+
+def rows_response(rows):
+    """Encode column rows straight to JSON, skipping ORM objects and the
+    response_model validation pass."""
+    if not rows:
+        return RawJSONResponse(b"[]")
+    # Row._asdict() rebuilds the key tuple per row; zip against it once
+    keys = rows[0]._fields
+    return RawJSONResponse(orjson.dumps([dict(zip(keys, row)) for row in rows]))
+
+
+def page_response(rows, limit: int, headers: dict | None = None):
+    """A list route's page: the encoded rows, any validators and the cursor."""
+    response = rows_response(rows)
+    if headers:
+        response.headers.update(headers)
+    set_next_cursor(response, rows, limit)
+    return response
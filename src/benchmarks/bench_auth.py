@@ -0,0 +1,52 @@
+"""Per-request auth overhead with and without the verified-token cache.
+
+An authenticated ``/users/me`` request verifies the bearer token in
+``get_current_user`` and again in ``token_expiry``.  This times that pair
+with a cold cache (a full HMAC verification each time, as before the cache
+existed) and with a warm cache.  Run from ``src/``::
+
+    python -m benchmarks.bench_auth
+"""
+
+import argparse
+import timeit
+from datetime import timedelta
+
+from app import jwt as app_jwt
+
+
+def auth_request(token):
+    app_jwt.verify_access_token(token)
+    app_jwt.token_expiry(token)
+
+
+def uncached_auth_request(token):
+    app_jwt.token_cache.clear()
+    app_jwt.verify_access_token(token)
+    app_jwt.token_cache.clear()
+    app_jwt.token_expiry(token)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = app_jwt.create_access_token(
+        data={"sub": "bench"}, expires_delta=timedelta(hours=1)
+    )
+    clear_cost = timeit.timeit(app_jwt.token_cache.clear, number=args.number) * 2
+    cold = timeit.timeit(lambda: uncached_auth_request(token), number=args.number)
+    auth_request(token)
+    warm = timeit.timeit(lambda: auth_request(token), number=args.number)
+
+    cold_us = (cold - clear_cost) / args.number * 1e6
+    warm_us = warm / args.number * 1e6
+    print(f"{'mode':<12}{'us/request':>12}")
+    print(f"{'uncached':<12}{cold_us:>12.1f}")
+    print(f"{'cached':<12}{warm_us:>12.1f}")
+    print(f"speedup: {cold_us / warm_us:.1f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,118 @@
+"""Compare requests/sec and p99 latency of the sync and async request paths.
+
+Run from ``src/`` against the configured database, e.g.::
+
+    DATABASE_URL=sqlite:///./bench.db python -m benchmarks.bench_db_mode
+
+Both paths use the default pool size.  Raising ``--concurrency`` past the
+pool and AnyIO thread limits shows the sync path queueing (and eventually
+timing out on the pool) while the async path keeps serving.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import async_routes, main, models
+from app.db import SessionLocal, engine, get_async_db, to_async_url
+from app.config import settings
+from .utils import Timer, print_table, summarize
+
+
+def seed_magazines(count):
+    models.Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        existing = db.query(models.Magazine.id).count()
+        db.add_all(
+            models.Magazine(
+                title=f"Bench Magazine {i}",
+                description=f"Benchmark magazine {i}",
+                base_price=10.0 + i % 50,
+            )
+            for i in range(existing, count)
+        )
+        db.commit()
+        return [row.id for row in db.query(models.Magazine.id).limit(count)]
+
+
+def build_sync_app():
+    app = FastAPI()
+    app.include_router(main.router)
+    return app
+
+
+def build_async_app(pool_size):
+    engine = create_async_engine(
+        settings.async_database_url or to_async_url(settings.database_url),
+        pool_size=pool_size,
+    )
+    session_factory = async_sessionmaker(
+        bind=engine, autoflush=False, expire_on_commit=False
+    )
+
+    async def get_db():
+        async with session_factory() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(async_routes.router)
+    app.dependency_overrides[get_async_db] = get_db
+    return app
+
+
+async def drive(app, magazine_ids, requests, concurrency):
+    latencies = []
+    errors = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+
+        async def one(i):
+            if i % 2:
+                url = f"/magazines/{random.choice(magazine_ids)}"
+            else:
+                url = "/magazines/?limit=10"
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+        with Timer() as timer:
+            await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, errors, timer.elapsed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--magazines", type=int, default=500)
+    parser.add_argument("--pool-size", type=int, default=5)
+    args = parser.parse_args()
+
+    magazine_ids = seed_magazines(args.magazines)
+    rows = []
+    for name, app in (
+        ("sync (threadpool)", build_sync_app()),
+        ("async (AsyncEngine)", build_async_app(args.pool_size)),
+    ):
+        latencies, errors, elapsed = asyncio.run(
+            drive(app, magazine_ids, args.requests, args.concurrency)
+        )
+        if errors:
+            print(f"{name}: {len(errors)} non-200 responses")
+        rows.append(summarize(name, latencies, elapsed))
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,90 @@
+"""Login throughput and latency under concurrency.
+
+Drives ``POST /users/login`` on the configured app (sync or async routes,
+per ``ASYNC_DB``) at increasing concurrency.  bcrypt runs on the bounded
+``PASSWORD_HASH_WORKERS`` pool at ``BCRYPT_ROUNDS``.  Run from ``src/``::
+
+    DATABASE_URL=sqlite:///./bench.db python -m benchmarks.bench_login
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from app import models
+from app.config import settings
+from app.db import engine
+from app.main import app
+from .utils import Timer, print_table, summarize
+
+
+async def register(client, username, password):
+    response = await client.post(
+        "/users/register",
+        json={"username": username, "email": f"{username}@bench", "password": password},
+    )
+    response.raise_for_status()
+
+
+async def drive(requests, concurrency, username, password):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/users/login", json={"username": username, "password": password}
+                )
+                latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+        with Timer() as timer:
+            await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, errors, timer.elapsed
+
+
+async def run(args, username, password):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        await register(client, username, password)
+    rows = []
+    for concurrency in args.concurrency:
+        latencies, errors, elapsed = await drive(
+            args.requests, concurrency, username, password
+        )
+        if errors:
+            print(f"concurrency {concurrency}: {errors} failed logins")
+        rows.append(summarize(f"concurrency {concurrency}", latencies, elapsed))
+    return rows
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    print(
+        f"bcrypt rounds={settings.bcrypt_rounds} "
+        f"workers={settings.password_hash_workers} async_db={settings.async_db}"
+    )
+    models.Base.metadata.create_all(bind=engine)
+    username = f"bench-{uuid.uuid4().hex[:8]}"
+    print_table(asyncio.run(run(args, username, "bench-password")))
+
+
+if __name__ == "__main__":
+    main_cli()
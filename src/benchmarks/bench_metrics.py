@@ -0,0 +1,85 @@
+"""Per-request overhead of ``MetricsMiddleware`` and the SQL cursor hooks.
+
+Calls a trivial ASGI app directly with and without the middleware, and runs
+``SELECT 1`` on an in-memory SQLite engine with and without the hooks; the
+difference per call is the cost of the instrumentation.  Each figure is the
+best of ``--repeat`` runs, to keep scheduler noise out of it.  Run from ``src/``::
+
+    python -m benchmarks.bench_metrics --requests 100000
+"""
+
+import argparse
+import asyncio
+
+from sqlalchemy import create_engine, text
+from starlette.routing import Route
+
+from app.metrics import MetricsMiddleware, instrument_engine
+from .utils import Timer
+
+ROUTE = Route("/magazines/{magazine_id}", endpoint=None)
+START = {"type": "http.response.start", "status": 200, "headers": []}
+BODY = {"type": "http.response.body", "body": b"{}"}
+
+
+async def endpoint(scope, receive, send):
+    scope["route"] = ROUTE
+    await send(START)
+    await send(BODY)
+
+
+async def receive():
+    return {"type": "http.request", "body": b""}
+
+
+async def send(message):
+    pass
+
+
+async def call_app(app, requests):
+    with Timer() as timer:
+        for _ in range(requests):
+            scope = {"type": "http", "method": "GET", "path": "/magazines/1"}
+            await app(scope, receive, send)
+    return timer.elapsed / requests
+
+
+def run_statements(engine, statements):
+    with engine.connect() as conn, Timer() as timer:
+        for _ in range(statements):
+            conn.execute(text("SELECT 1"))
+    return timer.elapsed / statements
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--statements", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    def best(func, *func_args):
+        return min(func(*func_args) for _ in range(args.repeat))
+
+    bare = best(lambda: asyncio.run(call_app(endpoint, args.requests)))
+    middleware = MetricsMiddleware(endpoint)
+    timed = best(lambda: asyncio.run(call_app(middleware, args.requests)))
+
+    engine = create_engine("sqlite://")
+    plain = best(run_statements, engine, args.statements)
+    instrument_engine(engine)
+    hooked = best(run_statements, engine, args.statements)
+
+    print(f"{'path':<22}{'bare us':>10}{'measured us':>14}{'overhead us':>14}")
+    for name, before, after in (
+        ("request middleware", bare, timed),
+        ("SQL cursor hooks", plain, hooked),
+    ):
+        print(
+            f"{name:<22}{before * 1e6:>10.2f}{after * 1e6:>14.2f}"
+            f"{(after - before) * 1e6:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
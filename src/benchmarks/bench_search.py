@@ -0,0 +1,93 @@
+"""Latency of ``GET /magazines/search`` queries over a large catalog.
+
+Seeds ``--magazines`` rows (100k by default) into the database given by
+``--url`` and times ``crud.search_magazines`` plus response encoding for the
+first page and for a cursor page, for selective terms and very common ones.
+SQLite uses the FTS5 table, PostgreSQL the GIN-indexed ``tsvector``.  Run
+from ``src/``::
+
+    python -m benchmarks.bench_search --magazines 100000
+"""
+
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import Session
+
+from app import crud, models
+from app.serialization import rows_response
+from .utils import print_table, summarize
+
+SYLLABLES = "ka lo mi ne ru sa ti vo ze ba do fi gu ha je ku".split()
+# 4,096 pseudo-words drawn with Zipf weights, like words in real titles
+WORDS = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(WORDS))]
+QUERIES = {
+    # A few hundred matches each: the typical catalog search
+    "selective": [WORDS[i] for i in (40, 75, 120, 200, 333)]
+    + [f"{WORDS[60]} {WORDS[90]}"],
+    # Tens of thousands of matches: only SEARCH_CANDIDATES of them are ranked
+    "common": [WORDS[i] for i in (0, 1, 2)],
+}
+
+
+def seed(engine, count):
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        existing = db.scalar(select(func.count(models.Magazine.id)))
+    rng = random.Random(42)
+    for start in range(existing, count, 10000):
+        rows = [
+            {
+                "title": " ".join(rng.choices(WORDS, WEIGHTS, k=3)).title(),
+                "description": " ".join(rng.choices(WORDS, WEIGHTS, k=15)),
+                "base_price": 5.0 + i % 20,
+            }
+            for i in range(start, min(start + 10000, count))
+        ]
+        with engine.begin() as conn:
+            conn.execute(insert(models.Magazine), rows)
+
+
+def search_page(db, q, limit, after=None):
+    rows = crud.search_magazines(db, q, limit=limit, after=after)
+    rows_response(rows)
+    return rows
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="sqlite:///./bench_search.db")
+    parser.add_argument("--magazines", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    started = time.perf_counter()
+    seed(engine, args.magazines)
+    print(f"seeded {args.magazines} magazines in {time.perf_counter() - started:.1f}s")
+
+    results = []
+    with Session(engine) as db:
+        for kind, queries in QUERIES.items():
+            # Cursor of each query's first page, to time the second page alone
+            cursors = {}
+            for q in queries:
+                last = search_page(db, q, args.limit)[-1]
+                cursors[q] = (last.rank, last.id)
+            for name, cursor in (("page 1", {}), ("page 2", cursors)):
+                latencies = []
+                for i in range(args.requests):
+                    q = queries[i % len(queries)]
+                    start = time.perf_counter()
+                    search_page(db, q, args.limit, cursor.get(q))
+                    latencies.append(time.perf_counter() - start)
+                results.append(summarize(f"{kind} {name}", latencies, sum(latencies)))
+    print_table(results)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,129 @@
+"""Serialization cost of a 1,000-row ``GET /subscriptions/`` page.
+
+Compares the old path (ORM objects validated into ``schemas.Subscription``
+and encoded with the stdlib ``json``), FastAPI's current ``response_model``
+path (validate, then ``dump_json``) and the fast path the list endpoints now
+use (column rows encoded directly with orjson).  Fetch and serialize times
+are reported separately, with the peak memory allocated while serializing.
+Uses a private in-memory SQLite database.  Run from ``src/``::
+
+    python -m benchmarks.bench_serialization --rows 1000
+"""
+
+import argparse
+import json
+import timeit
+import tracemalloc
+from datetime import date
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app import models, schemas
+from app.serialization import rows_response, schema_columns
+
+subscription_list = TypeAdapter(list[schemas.Subscription])
+
+
+def seed(engine, rows):
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(models.Subscription),
+            [
+                {
+                    "user_id": i % 100 + 1,
+                    "plan_id": i % 10 + 1,
+                    "price": 10.0 + i % 7,
+                    "next_renewal_date": date(2025, i % 12 + 1, i % 28 + 1),
+                    "is_active": True,
+                }
+                for i in range(rows)
+            ],
+        )
+
+
+def fetch_orm(db, rows):
+    return db.scalars(
+        select(models.Subscription).order_by(models.Subscription.id).limit(rows)
+    ).all()
+
+
+def fetch_rows(db, rows):
+    columns = schema_columns(models.Subscription, schemas.Subscription)
+    stmt = select(*columns).order_by(models.Subscription.id).limit(rows)
+    return db.execute(stmt).all()
+
+
+def serialize_stdlib(objects):
+    validated = subscription_list.validate_python(objects, from_attributes=True)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+def serialize_response_model(objects):
+    validated = subscription_list.validate_python(objects, from_attributes=True)
+    return subscription_list.dump_json(validated)
+
+
+def serialize_fast(rows):
+    return rows_response(rows).body
+
+
+def peak_kib(func, arg):
+    tracemalloc.start()
+    try:
+        func(arg)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    seed(engine, args.rows)
+
+    cases = [
+        ("orm + json", fetch_orm, serialize_stdlib),
+        ("orm + dump_json", fetch_orm, serialize_response_model),
+        ("rows + orjson", fetch_rows, serialize_fast),
+    ]
+    results = []
+    with Session(engine) as db:
+        for name, fetch, serialize in cases:
+            data = fetch(db, args.rows)
+            assert json.loads(serialize(data)) == json.loads(serialize_stdlib(data))
+            fetch_s = timeit.timeit(
+                lambda: (fetch(db, args.rows), db.expunge_all()), number=args.number
+            )
+            serialize_s = timeit.timeit(lambda: serialize(data), number=args.number)
+            results.append(
+                (
+                    name,
+                    fetch_s / args.number * 1000,
+                    serialize_s / args.number * 1000,
+                    peak_kib(serialize, data),
+                )
+            )
+
+    print(f"{'path':<18}{'fetch ms':>10}{'serialize ms':>14}{'peak KiB':>10}")
+    for name, fetch_ms, serialize_ms, peak in results:
+        print(f"{name:<18}{fetch_ms:>10.2f}{serialize_ms:>14.2f}{peak:>10.0f}")
+    baseline = results[0][1] + results[0][2]
+    fast = results[-1][1] + results[-1][2]
+    print(f"speedup (fetch + serialize): {baseline / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,98 @@
+"""Worker startup time, from importing the app to its first response.
+
+Each run is a fresh interpreter that imports ``app.main``, runs the lifespan
+(pool warm-up), serves two requests to ``--path`` through
+``httpx.ASGITransport`` and shuts down (pool drain).  Reports the median of
+``--runs`` for each phase, once per ``--warm`` value of ``DB_POOL_WARM``:
+without warm-up the first request pays for the connection and the dialect's
+first-connect queries.  Run from ``src/``::
+
+    DATABASE_URL=sqlite:///./bench.db python -m benchmarks.bench_startup --runs 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from .utils import Timer
+
+PHASES = ("import", "startup", "first", "second", "shutdown", "process")
+
+
+def child(path: str):
+    start = time.perf_counter()
+    import httpx
+    from app.main import app
+
+    times = {"import": time.perf_counter() - start}
+
+    async def serve():
+        mark = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            times["startup"] = time.perf_counter() - mark
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench"
+            ) as client:
+                for phase in ("first", "second"):
+                    mark = time.perf_counter()
+                    response = await client.get(path)
+                    response.raise_for_status()
+                    times[phase] = time.perf_counter() - mark
+            mark = time.perf_counter()
+        times["shutdown"] = time.perf_counter() - mark
+
+    asyncio.run(serve())
+    print(json.dumps(times))
+
+
+def run_child(path: str, warm: int):
+    env = {**os.environ, "DB_POOL_WARM": str(warm)}
+    command = [sys.executable, "-m", "benchmarks.bench_startup", "--child"]
+    with Timer() as timer:
+        output = subprocess.run(
+            command + ["--path", path], env=env, check=True, capture_output=True
+        ).stdout
+    times = json.loads(output.decode().splitlines()[-1])
+    times["process"] = timer.elapsed
+    return times
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warm", type=int, nargs="+", default=[0, 5])
+    parser.add_argument("--path", default="/catalog/")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.path)
+        return
+
+    # The schema is a deploy step (alembic upgrade head), outside the timing
+    from app import models
+    from app.config import settings
+    from app.db import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    print(f"{engine.dialect.name} async_db={settings.async_db} GET {args.path}")
+
+    header = "".join(f"{phase + ' ms':>13}" for phase in PHASES)
+    print(f"{'warm':<8}{header}")
+    for warm in args.warm:
+        runs = [run_child(args.path, warm) for _ in range(args.runs)]
+        medians = "".join(
+            f"{statistics.median(run[phase] for run in runs) * 1000:>13.2f}"
+            for phase in PHASES
+        )
+        print(f"{warm:<8}{medians}")
+
+
+if __name__ == "__main__":
+    main_cli()
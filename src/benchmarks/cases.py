@@ -0,0 +1,627 @@
+"""Benchmark cases: every route of the app and every public crud function.
+
+Each case is a name, an operation taking one argument, and a ``prepare``
+that builds the argument of every operation before timing starts.  Reads
+pick random rows of the seeded dataset.  Writes only touch throwaway rows
+that ``prepare`` inserts, and ``Context.cleanup`` removes everything above
+the seeded ids afterwards, so repeated runs measure the same data.
+
+Import this module only after ``DATABASE_URL`` points at the benchmark
+database: the app builds its engine on import.
+"""
+
+import itertools
+import random
+import uuid
+from datetime import date, timedelta
+
+import httpx
+from sqlalchemy import insert
+
+from app import crud, models, schemas
+from app.counts import count_cache
+from app.db import SessionLocal, engine
+from app.jwt import create_access_token, create_refresh_token, user_claims
+from app.main import app
+from app.pagination import encode_cursor
+from .datasets import BENCH_PASSWORD, BENCH_USER, FIRST_RENEWAL, WORDS, reset
+
+# Slow by design (bcrypt), so time a handful rather than the default count
+HASHING_OPS = 5
+BULK_ROWS = 100
+
+
+class Case:
+    def __init__(self, name: str, operation, prepare=None, ops: int = None):
+        self.name = name
+        self.operation = operation
+        self.prepare = prepare
+        self.ops = ops
+
+
+class Context:
+    def __init__(self, dataset, seed: int = 0):
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+        self.run = uuid.uuid4().hex[:8]
+        self.serial = itertools.count()
+        self._scratch_magazine = None
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://bench"
+        )
+        with SessionLocal() as db:
+            user = crud.get_user_by_username(db, BENCH_USER)
+            self.claims = user_claims(user)
+        token = create_access_token(self.claims, expires_delta=timedelta(hours=12))
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    # Random seeded rows
+    def user_id(self, _=None):
+        return self.rng.randint(1, self.dataset.users)
+
+    def magazine_id(self, _=None):
+        return self.rng.randint(1, self.dataset.magazines)
+
+    def plan_id(self, _=None):
+        return self.rng.randint(1, self.dataset.plans)
+
+    def subscription_id(self, _=None):
+        return self.rng.randint(1, self.dataset.subscriptions)
+
+    def word(self, _=None):
+        return self.rng.choice(WORDS)
+
+    def hot_id(self, _=None):
+        # Cached lookups repeat a few ids, as popular rows would
+        return self.rng.randint(1, 10)
+
+    def random(self, pick):
+        return lambda ops: [pick() for _ in range(ops)]
+
+    # Throwaway rows for the writes
+    def _insert(self, model, rows):
+        with engine.begin() as conn:
+            return list(conn.scalars(insert(model).returning(model.id), rows))
+
+    def _user_rows(self, ops):
+        names = (f"tmp_{self.run}_{next(self.serial)}" for _ in range(ops))
+        return [
+            {"username": name, "email": f"{name}@example.com", "is_active": True}
+            for name in names
+        ]
+
+    def new_users(self, ops):
+        return self._insert(models.User, self._user_rows(ops))
+
+    def new_usernames(self, ops):
+        rows = self._user_rows(ops)
+        self._insert(models.User, rows)
+        return [row["username"] for row in rows]
+
+    def new_magazines(self, ops):
+        return self._insert(
+            models.Magazine,
+            [
+                {"title": "Scratch", "description": "Scratch", "base_price": 1.0}
+                for _ in range(ops)
+            ],
+        )
+
+    def scratch_magazine(self):
+        if self._scratch_magazine is None:
+            self._scratch_magazine = self.new_magazines(1)[0]
+        return self._scratch_magazine
+
+    def new_plans(self, ops):
+        magazine_id = self.scratch_magazine()
+        plans = self._insert(
+            models.Plan,
+            [
+                {"name": "Scratch", "price": 10, "magazine_id": magazine_id}
+                for _ in range(ops)
+            ],
+        )
+        with SessionLocal() as db:
+            crud.backfill_plan_prices(db)
+        return plans
+
+    def new_subscriptions(self, ops):
+        users = self.new_users(ops)
+        return self._insert(
+            models.Subscription,
+            [
+                {
+                    "user_id": user_id,
+                    "plan_id": 1,
+                    "price": 1.0,
+                    "next_renewal_date": FIRST_RENEWAL,
+                    "is_active": True,
+                }
+                for user_id in users
+            ],
+        )
+
+    def cleanup(self):
+        reset(engine, self.dataset)
+
+
+def _checked(request):
+    async def operation(arg):
+        response = await request(arg)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.status_code}: {response.text[:200]}")
+        return response
+
+    return operation
+
+
+def _in_session(func):
+    def operation(arg):
+        with SessionLocal() as db:
+            return func(db, arg)
+
+    return operation
+
+
+def magazine_body(_=None):
+    return {"title": "Bench", "description": "Benchmark write", "base_price": 9.0}
+
+
+def plan_body(magazine_id):
+    return {"name": "Bench", "price": 20, "discount": 0.1, "magazine_id": magazine_id}
+
+
+def subscription_body(user_id, plan_id=1):
+    return {
+        "user_id": user_id,
+        "plan_id": plan_id,
+        "price": 5.0,
+        "next_renewal_date": FIRST_RENEWAL.isoformat(),
+        "is_active": True,
+    }
+
+
+def route_cases(ctx: Context):
+    client = ctx.client
+    auth = ctx.headers
+    refresh = create_refresh_token(ctx.claims)
+
+    def cursor(pick):
+        return ctx.random(lambda: encode_cursor(pick()))
+
+    def scratch(ops):
+        return [ctx.scratch_magazine()] * ops
+
+    def bulk_magazines(ops):
+        return [[magazine_body() for _ in range(BULK_ROWS)] for _ in range(ops)]
+
+    def bulk_plans(ops):
+        magazine_id = ctx.scratch_magazine()
+        return [[plan_body(magazine_id) for _ in range(BULK_ROWS)] for _ in range(ops)]
+
+    def bulk_subscriptions(ops):
+        return [
+            [subscription_body(user) for user in ctx.new_users(BULK_ROWS)]
+            for _ in range(ops)
+        ]
+
+    cases = [
+        (
+            "POST /users/register",
+            lambda i: client.post(
+                "/users/register",
+                json={
+                    "username": f"reg_{ctx.run}_{i}",
+                    "email": f"reg_{ctx.run}_{i}@example.com",
+                    "password": BENCH_PASSWORD,
+                },
+            ),
+            lambda ops: list(range(ops)),
+            HASHING_OPS,
+        ),
+        (
+            "POST /users/login",
+            lambda _: client.post(
+                "/users/login",
+                json={"username": BENCH_USER, "password": BENCH_PASSWORD},
+            ),
+            None,
+            HASHING_OPS,
+        ),
+        (
+            "POST /users/reset-password",
+            lambda user: client.post(
+                "/users/reset-password", params={"email": f"bench_{user}@example.com"}
+            ),
+            ctx.random(lambda: ctx.user_id() - 1),
+        ),
+        (
+            "DELETE /users/deactivate/{username}",
+            lambda user: client.delete(f"/users/deactivate/{user}"),
+            ctx.new_usernames,
+        ),
+        (
+            "GET /users/",
+            lambda after: client.get("/users/", params={"after": after}),
+            cursor(ctx.user_id),
+        ),
+        (
+            "POST /users/token/refresh",
+            lambda _: client.post(
+                "/users/token/refresh", params={"refresh_token": refresh}
+            ),
+        ),
+        ("GET /users/me", lambda _: client.get("/users/me", headers=auth)),
+        (
+            "GET /users/me/subscriptions",
+            lambda _: client.get("/users/me/subscriptions", headers=auth),
+        ),
+        (
+            "POST /magazines/",
+            lambda body: client.post("/magazines/", json=body),
+            ctx.random(magazine_body),
+        ),
+        (
+            "POST /magazines/bulk",
+            lambda rows: client.post("/magazines/bulk", json=rows),
+            bulk_magazines,
+        ),
+        (
+            "GET /magazines/",
+            lambda after: client.get("/magazines/", params={"after": after}),
+            cursor(ctx.magazine_id),
+        ),
+        (
+            "GET /catalog/",
+            lambda after: client.get("/catalog/", params={"after": after}),
+            cursor(ctx.magazine_id),
+        ),
+        (
+            "GET /magazines/search",
+            lambda q: client.get("/magazines/search", params={"q": q}),
+            ctx.random(ctx.word),
+        ),
+        (
+            "GET /magazines/{magazine_id}",
+            lambda id_: client.get(f"/magazines/{id_}"),
+            ctx.random(ctx.magazine_id),
+        ),
+        (
+            "PUT /magazines/{magazine_id}",
+            lambda id_: client.put(f"/magazines/{id_}", json=magazine_body()),
+            ctx.new_magazines,
+        ),
+        (
+            "PATCH /magazines/{magazine_id}",
+            lambda id_: client.patch(f"/magazines/{id_}", json={"base_price": 2.0}),
+            ctx.new_magazines,
+        ),
+        (
+            "DELETE /magazines/{magazine_id}",
+            lambda id_: client.delete(f"/magazines/{id_}"),
+            ctx.new_magazines,
+        ),
+        (
+            "POST /plans/",
+            lambda magazine_id: client.post("/plans/", json=plan_body(magazine_id)),
+            scratch,
+        ),
+        (
+            "POST /plans/bulk",
+            lambda rows: client.post("/plans/bulk", json=rows),
+            bulk_plans,
+        ),
+        (
+            "GET /plans/",
+            lambda after: client.get("/plans/", params={"after": after}),
+            cursor(ctx.plan_id),
+        ),
+        (
+            "GET /plans/{plan_id}",
+            lambda id_: client.get(f"/plans/{id_}"),
+            ctx.random(ctx.plan_id),
+        ),
+        (
+            "PUT /plans/{plan_id}",
+            lambda id_: client.put(
+                f"/plans/{id_}", json=plan_body(ctx.scratch_magazine())
+            ),
+            ctx.new_plans,
+        ),
+        (
+            "PATCH /plans/{plan_id}",
+            lambda id_: client.patch(f"/plans/{id_}", json={"discount": 0.2}),
+            ctx.new_plans,
+        ),
+        (
+            "DELETE /plans/{plan_id}",
+            lambda id_: client.delete(f"/plans/{id_}"),
+            ctx.new_plans,
+        ),
+        (
+            "POST /subscriptions/",
+            lambda user: client.post("/subscriptions/", json=subscription_body(user)),
+            ctx.new_users,
+        ),
+        (
+            "POST /subscriptions/bulk",
+            lambda rows: client.post("/subscriptions/bulk", json=rows),
+            bulk_subscriptions,
+        ),
+        (
+            "PUT /subscriptions/{subscription_id}",
+            lambda id_: client.put(
+                f"/subscriptions/{id_}",
+                json={**subscription_body(ctx.user_id()), "is_active": False},
+            ),
+            ctx.new_subscriptions,
+        ),
+        (
+            "PATCH /subscriptions/{subscription_id}",
+            lambda id_: client.patch(f"/subscriptions/{id_}", json={"price": 3.0}),
+            ctx.new_subscriptions,
+        ),
+        (
+            "GET /subscriptions/",
+            lambda after: client.get("/subscriptions/", params={"after": after}),
+            cursor(ctx.subscription_id),
+        ),
+        (
+            "GET /subscriptions/export",
+            lambda user: client.get("/subscriptions/export", params={"user_id": user}),
+            ctx.random(ctx.user_id),
+        ),
+        (
+            "GET /subscriptions/{subscription_id}",
+            lambda id_: client.get(f"/subscriptions/{id_}"),
+            ctx.random(ctx.subscription_id),
+        ),
+        (
+            "DELETE /subscriptions/{subscription_id}",
+            lambda id_: client.delete(f"/subscriptions/{id_}"),
+            ctx.new_subscriptions,
+        ),
+        ("GET /internal/pool", lambda _: client.get("/internal/pool")),
+        ("GET /metrics", lambda _: client.get("/metrics")),
+    ]
+    return [
+        Case(f"route {name}", _checked(request), *rest)
+        for name, request, *rest in cases
+    ]
+
+
+def crud_cases(ctx: Context):
+    auth = schemas.AuthContext(
+        username=ctx.claims["sub"], user_id=ctx.claims["uid"], is_active=True
+    )
+    magazine = schemas.MagazineCreate(**magazine_body())
+
+    def plan(magazine_id):
+        return schemas.PlanCreate(**plan_body(magazine_id))
+
+    def subscription(user_id):
+        return schemas.SubscriptionCreate(**subscription_body(user_id))
+
+    def uncached_count(mode):
+        def operation(db, _):
+            count_cache.clear()
+            return crud.count_rows(db, models.Subscription, mode)
+
+        return operation
+
+    def due_renewals(ops):
+        return [
+            [{"id": id_, "next_renewal_date": FIRST_RENEWAL}]
+            for id_ in ctx.new_subscriptions(ops)
+        ]
+
+    cases = [
+        ("get_user", lambda db, id_: crud.get_user(db, id_), ctx.random(ctx.user_id)),
+        (
+            "get_users",
+            lambda db, after: crud.get_users(db, after=after),
+            ctx.random(ctx.user_id),
+        ),
+        (
+            "get_user_by_username",
+            lambda db, user: crud.get_user_by_username(db, f"bench_{user - 1}"),
+            ctx.random(ctx.user_id),
+        ),
+        (
+            "get_user_by_email",
+            lambda db, user: crud.get_user_by_email(
+                db, f"bench_{user - 1}@example.com"
+            ),
+            ctx.random(ctx.user_id),
+        ),
+        ("get_user_by_auth", lambda db, _: crud.get_user_by_auth(db, auth)),
+        (
+            "authenticate_user",
+            lambda db, _: crud.authenticate_user(db, BENCH_USER, BENCH_PASSWORD),
+            None,
+            HASHING_OPS,
+        ),
+        (
+            "create_user",
+            lambda db, i: crud.create_user(
+                db,
+                schemas.UserCreate(
+                    username=f"crud_{ctx.run}_{i}",
+                    email=f"crud_{ctx.run}_{i}@example.com",
+                    password=BENCH_PASSWORD,
+                ),
+            ),
+            lambda ops: list(range(ops)),
+            HASHING_OPS,
+        ),
+        (
+            "get_magazine",
+            lambda db, id_: crud.get_magazine(db, id_),
+            ctx.random(ctx.magazine_id),
+        ),
+        (
+            "get_magazine_cached",
+            lambda db, id_: crud.get_magazine_cached(db, id_),
+            ctx.random(ctx.hot_id),
+        ),
+        (
+            "get_magazines",
+            lambda db, after: crud.get_magazines(db, after=after),
+            ctx.random(ctx.magazine_id),
+        ),
+        (
+            "search_magazines",
+            lambda db, q: crud.search_magazines(db, q),
+            ctx.random(ctx.word),
+        ),
+        (
+            "get_catalog",
+            lambda db, after: crud.get_catalog(db, after=after),
+            ctx.random(ctx.magazine_id),
+        ),
+        ("create_magazine", lambda db, _: crud.create_magazine(db, magazine)),
+        (
+            "update_magazine",
+            lambda db, id_: crud.update_magazine(db, id_, magazine),
+            ctx.new_magazines,
+        ),
+        (
+            "patch_magazine",
+            lambda db, id_: crud.patch_magazine(
+                db, id_, schemas.MagazinePatch(base_price=3.0)
+            ),
+            ctx.new_magazines,
+        ),
+        (
+            "delete_magazine",
+            lambda db, id_: crud.delete_magazine(db, id_),
+            ctx.new_magazines,
+        ),
+        ("get_plan", lambda db, id_: crud.get_plan(db, id_), ctx.random(ctx.plan_id)),
+        (
+            "get_plan_cached",
+            lambda db, id_: crud.get_plan_cached(db, id_),
+            ctx.random(ctx.hot_id),
+        ),
+        (
+            "get_plans",
+            lambda db, after: crud.get_plans(db, after=after),
+            ctx.random(ctx.plan_id),
+        ),
+        (
+            "create_plan",
+            lambda db, _: crud.create_plan(db, plan(ctx.scratch_magazine())),
+        ),
+        (
+            "update_plan",
+            lambda db, id_: crud.update_plan(db, id_, plan(ctx.scratch_magazine())),
+            ctx.new_plans,
+        ),
+        (
+            "patch_plan",
+            lambda db, id_: crud.patch_plan(db, id_, schemas.PlanPatch(discount=0.3)),
+            ctx.new_plans,
+        ),
+        ("delete_plan", lambda db, id_: crud.delete_plan(db, id_), ctx.new_plans),
+        (
+            "refresh_plan_prices",
+            lambda db, id_: (crud.refresh_plan_prices(db, plan_id=id_), db.commit()),
+            ctx.random(ctx.plan_id),
+        ),
+        ("backfill_plan_prices", lambda db, _: crud.backfill_plan_prices(db)),
+        (
+            "get_table_version",
+            lambda db, _: (
+                crud.table_versions.clear(),
+                crud.get_table_version(db, "magazines"),
+            ),
+        ),
+        (
+            "get_subscription",
+            lambda db, id_: crud.get_subscription(db, id_),
+            ctx.random(ctx.subscription_id),
+        ),
+        (
+            "get_subscriptions",
+            lambda db, after: crud.get_subscriptions(db, after=after),
+            ctx.random(ctx.subscription_id),
+        ),
+        (
+            "get_user_subscriptions",
+            lambda db, user: crud.get_user_subscriptions(db, user),
+            ctx.random(ctx.user_id),
+        ),
+        (
+            "iter_subscriptions",
+            lambda db, user: list(crud.iter_subscriptions(db, user_id=user)),
+            ctx.random(ctx.user_id),
+        ),
+        (
+            "get_due_subscriptions",
+            lambda db, _: crud.get_due_subscriptions(db, date.today()),
+        ),
+        (
+            "renew_subscriptions",
+            lambda db, renewals: crud.renew_subscriptions(db, renewals),
+            due_renewals,
+        ),
+        ("count_rows exact", uncached_count("exact")),
+        ("count_rows estimated", uncached_count("estimated")),
+        (
+            "create_subscription",
+            lambda db, user: crud.create_subscription(db, subscription(user)),
+            ctx.new_users,
+        ),
+        (
+            "update_subscription",
+            lambda db, id_: crud.update_subscription(
+                db,
+                id_,
+                schemas.SubscriptionUpdate(
+                    **{**subscription_body(ctx.user_id()), "is_active": False}
+                ),
+            ),
+            ctx.new_subscriptions,
+        ),
+        (
+            "patch_subscription",
+            lambda db, id_: crud.patch_subscription(
+                db, id_, schemas.SubscriptionPatch(price=4.0)
+            ),
+            ctx.new_subscriptions,
+        ),
+        (
+            "delete_subscription",
+            lambda db, id_: crud.delete_subscription(db, id_),
+            ctx.new_subscriptions,
+        ),
+        (
+            "bulk_create_subscriptions",
+            lambda db, rows: crud.bulk_create_subscriptions(db, rows),
+            # No price: every row is quoted from plan_prices
+            lambda ops: [
+                list(
+                    enumerate(
+                        {**subscription(user).model_dump(), "price": None}
+                        for user in ctx.new_users(BULK_ROWS)
+                    )
+                )
+                for _ in range(ops)
+            ],
+        ),
+        (
+            "bulk_create",
+            lambda db, rows: crud.bulk_create(db, models.Magazine, rows),
+            lambda ops: [
+                list(enumerate(magazine_body() for _ in range(BULK_ROWS)))
+                for _ in range(ops)
+            ],
+        ),
+    ]
+    return [
+        Case(f"crud {name}", _in_session(func), *rest) for name, func, *rest in cases
+    ]
+
+
+def all_cases(ctx: Context):
+    return route_cases(ctx) + crud_cases(ctx)
@@ -0,0 +1,151 @@
+"""Seeded datasets for the benchmark suite.
+
+A dataset is named by its subscription count.  Users, magazines and plans
+scale with it: every user holds ``SUBSCRIPTIONS_PER_USER`` active
+subscriptions to different plans, and every renewal date lies in the future
+so the renewal job finds nothing due and leaves the data unchanged.  Rows
+are generated from fixed seeds, so a given size has identical contents on
+every machine and backend.
+"""
+
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+SUBSCRIPTIONS_PER_USER = 10
+PLANS_PER_MAGAZINE = 5
+CHUNK = 10_000
+BENCH_USER = "bench_user"
+BENCH_PASSWORD = "benchpassword"
+FIRST_RENEWAL = date(2100, 1, 1)
+WORDS = (
+    "tech science travel food music art design money health sport garden "
+    "photo film history nature code space ocean city style"
+).split()
+
+
+class Dataset:
+    def __init__(self, subscriptions: int):
+        self.subscriptions = subscriptions
+        self.users = max(subscriptions // SUBSCRIPTIONS_PER_USER, 1)
+        self.magazines = max(subscriptions // 200, 10)
+        self.plans = self.magazines * PLANS_PER_MAGAZINE
+
+    @property
+    def marker(self):
+        # Written last, so a seed that was interrupted is not mistaken for done
+        return f"bench_seeded_{self.subscriptions}"
+
+
+def _chunks(count, make_row):
+    for start in range(0, count, CHUNK):
+        yield [make_row(i) for i in range(start, min(start + CHUNK, count))]
+
+
+def _insert(engine, model, count, make_row):
+    for rows in _chunks(count, make_row):
+        with engine.begin() as conn:
+            conn.execute(insert(model), rows)
+
+
+def seed(engine, dataset: Dataset):
+    """Fill an empty database with ``dataset``; no-op if it is already there."""
+    # Imported here: the app binds its engine to DATABASE_URL on import, and
+    # the suite only sets that once it has picked a database
+    from app import crud, models
+    from app.passwords import hash_password
+
+    # A throwaway database: build the schema from the models, not Alembic
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        seeded = db.scalar(
+            select(models.User.id).where(models.User.username == dataset.marker)
+        )
+        if seeded:
+            return False
+        if db.scalar(select(func.count()).select_from(models.Subscription)):
+            raise SystemExit(
+                "the benchmark database holds other data; point --url at a new one"
+            )
+
+    rng = random.Random(dataset.subscriptions)
+    # Every seeded user shares one hash; only the bench user ever logs in
+    password = hash_password(BENCH_PASSWORD)
+    _insert(
+        engine,
+        models.User,
+        dataset.users,
+        lambda i: {
+            "username": BENCH_USER if i == 0 else f"bench_{i}",
+            "email": f"bench_{i}@example.com",
+            "password": password,
+            "is_active": True,
+        },
+    )
+    _insert(
+        engine,
+        models.Magazine,
+        dataset.magazines,
+        lambda i: {
+            "title": " ".join(rng.choices(WORDS, k=3)).title(),
+            "description": " ".join(rng.choices(WORDS, k=12)),
+            "base_price": 5.0 + i % 20,
+        },
+    )
+    _insert(
+        engine,
+        models.Plan,
+        dataset.plans,
+        lambda i: {
+            "name": f"Plan {i % PLANS_PER_MAGAZINE}",
+            "price": 100,
+            "discount": (i % PLANS_PER_MAGAZINE) * 0.05,
+            "renewal_period": (1, 3, 6, 12, 12)[i % PLANS_PER_MAGAZINE],
+            "magazine_id": i // PLANS_PER_MAGAZINE + 1,
+        },
+    )
+    with Session(engine) as db:
+        crud.backfill_plan_prices(db)
+
+    def subscription(i):
+        user, k = divmod(i, SUBSCRIPTIONS_PER_USER)
+        # Consecutive plans from a per-user offset: never the same plan twice
+        plan = (user * 7 + k) % dataset.plans + 1
+        return {
+            "user_id": user + 1,
+            "plan_id": plan,
+            "price": 10.0 + k,
+            "next_renewal_date": FIRST_RENEWAL + timedelta(days=i % 365),
+            "is_active": True,
+        }
+
+    _insert(engine, models.Subscription, dataset.subscriptions, subscription)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(models.User),
+            [{"username": dataset.marker, "email": f"{dataset.marker}@example.com"}],
+        )
+    return True
+
+
+def reset(engine, dataset: Dataset):
+    """Remove every row added above the seeded ids and clear the app caches."""
+    from app import crud, models
+    from app.counts import count_cache
+
+    # The dataset's marker user sits right after the seeded users
+    with engine.begin() as conn:
+        for model, last_id in (
+            (models.Subscription, dataset.subscriptions),
+            (models.PlanPrice, dataset.plans),
+            (models.Plan, dataset.plans),
+            (models.Magazine, dataset.magazines),
+            (models.User, dataset.users + 1),
+        ):
+            column = models.PlanPrice.plan_id if model is models.PlanPrice else model.id
+            conn.execute(delete(model).where(column > last_id))
+    for cache in (crud.magazine_cache, crud.plan_cache, count_cache):
+        cache.clear()
@@ -0,0 +1,433 @@
+"""Concurrent mixed-workload load test of the whole app, in process.
+
+Drives ``app.main.app`` through ``httpx.ASGITransport`` with a weighted mix
+of user journeys, so that the thread pool, the connection pool and bcrypt all
+compete the way they do in production:
+
+- ``browse``: the catalog, a magazine, a plan and a search
+- ``register``: register a new user, then log in
+- ``subscribe``: log in as a seeded user, list their subscriptions, then
+  subscribe to a plan, upgrade to the next plan and cancel
+
+With ``--concurrency`` alone the load is closed-loop: that many virtual users
+start a new journey as soon as the last one ends.  With ``--rate`` journeys
+arrive open-loop at that many per second (Poisson arrivals), at most
+``--concurrency`` in flight; the time an arrival waits for a free slot is
+reported as ``queued``.  Several values sweep the levels in turn, giving the
+saturation curve.  Every level runs on the freshly reset ``--size`` dataset
+with fixed random seeds, so a run is reproducible on the same machine.
+Run from ``src/``::
+
+    python -m benchmarks.load --concurrency 1 4 16 64 --duration 10
+    python -m benchmarks.load --rate 5 10 20 40 --concurrency 64 --save curve.json
+
+Access tokens live for one second; a journey that finds its token expired
+refreshes it and retries, and the 401 counts as an error of that endpoint.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+from .datasets import BENCH_PASSWORD, SIZES, WORDS, Dataset, reset, seed
+from .suite import database_url
+from .utils import Timer, percentile
+
+JOURNEYS = ("browse", "register", "subscribe")
+DEFAULT_MIX = "browse=70,register=10,subscribe=20"
+# Seeded users hold offsets 0-9 from their first plan; journeys use the next two
+FREE_PLAN_OFFSET = 10
+
+
+def parse_mix(text: str):
+    weights = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in JOURNEYS:
+            raise argparse.ArgumentTypeError(f"unknown journey {name!r}")
+        weights[name] = float(weight)
+    return weights
+
+
+class Stats:
+    """Latencies and outcomes of one level, per endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.queued = []
+        self.journeys = 0
+
+    def record(self, name: str, seconds: float, status: int):
+        self.latencies[name].append(seconds)
+        # Status 0: the request raised instead of returning a response
+        if not 200 <= status < 400:
+            self.errors[name] += 1
+
+    def rows(self, elapsed: float):
+        names = sorted(self.latencies)
+        everything = [s for name in names for s in self.latencies[name]]
+        rows = [
+            self._row(name, self.latencies[name], self.errors[name], elapsed)
+            for name in names
+        ]
+        rows.append(self._row("total", everything, sum(self.errors.values()), elapsed))
+        return rows
+
+    @staticmethod
+    def _row(name, latencies, errors, elapsed):
+        return {
+            "name": name,
+            "requests": len(latencies),
+            "rps": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "error_rate": errors / len(latencies) if latencies else 0.0,
+        }
+
+
+class Workload:
+    """The journeys, sharing one client, one stats object and the seeded ids."""
+
+    def __init__(self, client, dataset: Dataset, stats: Stats, run: str):
+        self.client = client
+        self.dataset = dataset
+        self.stats = stats
+        self.run = run
+        self.serial = itertools.count()
+        # A seeded user runs one subscribe journey at a time, so two journeys
+        # never race for the same (user, plan) pair
+        self.free_users = asyncio.Queue()
+        for user_id in range(2, dataset.users + 1):
+            self.free_users.put_nowait(user_id)
+
+    async def request(self, name: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except Exception:
+            self.stats.record(name, time.perf_counter() - start, 0)
+            raise
+        self.stats.record(name, time.perf_counter() - start, response.status_code)
+        return response
+
+    async def login(self, username: str):
+        response = await self.request(
+            "POST /users/login",
+            "POST",
+            "/users/login",
+            json={"username": username, "password": BENCH_PASSWORD},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def authorized_get(self, name: str, url: str, tokens: dict):
+        headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+        response = await self.request(name, "GET", url, headers=headers)
+        if response.status_code == 401:
+            refreshed = await self.request(
+                "POST /users/token/refresh",
+                "POST",
+                "/users/token/refresh",
+                params={"refresh_token": tokens["refresh_token"]},
+            )
+            refreshed.raise_for_status()
+            tokens.update(refreshed.json())
+            headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+            response = await self.request(name, "GET", url, headers=headers)
+        return response
+
+    async def browse(self, rng: random.Random):
+        await self.request("GET /catalog/", "GET", "/catalog/")
+        magazine_id = rng.randint(1, self.dataset.magazines)
+        await self.request("GET /magazines/{id}", "GET", f"/magazines/{magazine_id}")
+        plan_id = rng.randint(1, self.dataset.plans)
+        await self.request("GET /plans/{id}", "GET", f"/plans/{plan_id}")
+        await self.request(
+            "GET /magazines/search",
+            "GET",
+            "/magazines/search",
+            params={"q": rng.choice(WORDS)},
+        )
+
+    async def register(self, rng: random.Random):
+        username = f"load_{self.run}_{next(self.serial)}"
+        response = await self.request(
+            "POST /users/register",
+            "POST",
+            "/users/register",
+            json={
+                "username": username,
+                "email": f"{username}@example.com",
+                "password": BENCH_PASSWORD,
+            },
+        )
+        response.raise_for_status()
+        await self.login(username)
+
+    async def subscribe(self, rng: random.Random):
+        user_id = await self.free_users.get()
+        try:
+            await self._subscribe(user_id)
+        finally:
+            self.free_users.put_nowait(user_id)
+
+    async def _subscribe(self, user_id: int):
+        # Seeded user N has id N + 1 and the username bench_N
+        tokens = await self.login(f"bench_{user_id - 1}")
+        await self.authorized_get(
+            "GET /users/me/subscriptions", "/users/me/subscriptions", tokens
+        )
+        first_plan = ((user_id - 1) * 7 + FREE_PLAN_OFFSET) % self.dataset.plans + 1
+        upgrade_plan = first_plan % self.dataset.plans + 1
+        response = await self.request(
+            "POST /subscriptions/",
+            "POST",
+            "/subscriptions/",
+            json={
+                "user_id": user_id,
+                "plan_id": first_plan,
+                "price": 10.0,
+                "next_renewal_date": "2100-01-01",
+            },
+        )
+        response.raise_for_status()
+        subscription_id = response.json()["id"]
+        await self.request(
+            "PATCH /subscriptions/{id}",
+            "PATCH",
+            f"/subscriptions/{subscription_id}",
+            json={"plan_id": upgrade_plan},
+        )
+        await self.request(
+            "PATCH /subscriptions/{id}",
+            "PATCH",
+            f"/subscriptions/{subscription_id}",
+            json={"is_active": False},
+        )
+
+    async def journey(self, rng: random.Random, mix: dict):
+        name = rng.choices(list(mix), weights=list(mix.values()))[0]
+        self.stats.journeys += 1
+        try:
+            await getattr(self, name)(rng)
+        except Exception:
+            # Already recorded against the failing endpoint; the rest of
+            # this journey depends on its response
+            pass
+
+
+async def closed_loop(workload, mix, concurrency: int, duration: float, seed: int):
+    deadline = time.perf_counter() + duration
+
+    async def virtual_user(index):
+        rng = random.Random(seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            await workload.journey(rng, mix)
+
+    await asyncio.gather(*(virtual_user(i) for i in range(concurrency)))
+
+
+async def open_loop(workload, mix, rate: float, concurrency: int, duration, seed):
+    rng = random.Random(seed)
+    slots = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    arrivals = []
+
+    async def arrival(scheduled, journey_rng):
+        async with slots:
+            workload.stats.queued.append(loop.time() - scheduled)
+            await workload.journey(journey_rng, mix)
+
+    scheduled = start + rng.expovariate(rate)
+    while scheduled < start + duration:
+        await asyncio.sleep(max(0.0, scheduled - loop.time()))
+        journey_rng = random.Random(rng.getrandbits(32))
+        arrivals.append(asyncio.create_task(arrival(scheduled, journey_rng)))
+        scheduled += rng.expovariate(rate)
+    await asyncio.gather(*arrivals)
+
+
+def pool_waits(engine):
+    stats = getattr(engine.pool, "wait_stats", None)
+    if stats is None:
+        return 0, 0.0, 0
+    return stats.checkouts, stats.total_wait, stats.timeouts
+
+
+async def run_level(app, engines, dataset, args, mix, concurrency, rate=None):
+    engine, pool_engine = engines
+    reset(engine, dataset)
+    stats = Stats()
+    before = pool_waits(pool_engine)
+    # App exceptions become 500 responses, as behind a real server
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://load", timeout=None
+    ) as client:
+        workload = Workload(client, dataset, stats, uuid.uuid4().hex[:8])
+        with Timer() as timer:
+            if rate is None:
+                await closed_loop(workload, mix, concurrency, args.duration, args.seed)
+            else:
+                await open_loop(
+                    workload, mix, rate, concurrency, args.duration, args.seed
+                )
+    checkouts, waited, timeouts = (
+        after - before for after, before in zip(pool_waits(pool_engine), before)
+    )
+    return {
+        "concurrency": concurrency,
+        "rate": rate,
+        "elapsed": timer.elapsed,
+        "journeys": stats.journeys,
+        "queued_p99_ms": percentile(stats.queued, 99) * 1000,
+        "pool_wait_ms": waited / checkouts * 1000 if checkouts else 0.0,
+        "pool_timeouts": timeouts,
+        "endpoints": stats.rows(timer.elapsed),
+    }
+
+
+def print_level(level):
+    print(
+        f"\n{'endpoint':<32}{'requests':>10}{'req/s':>10}{'p50 ms':>10}"
+        f"{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}"
+    )
+    for row in level["endpoints"]:
+        print(
+            f"{row['name']:<32}{row['requests']:>10}{row['rps']:>10.1f}"
+            f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+            f"{row['error_rate']:>9.1%}"
+        )
+
+
+def print_curve(levels):
+    print(
+        f"\n{'level':<20}{'journeys/s':>12}{'req/s':>10}{'p50 ms':>10}"
+        f"{'p99 ms':>10}{'errors':>9}{'queued p99':>12}{'pool wait':>11}"
+    )
+    for level in levels:
+        total = level["endpoints"][-1]
+        name = (
+            f"concurrency {level['concurrency']}"
+            if level["rate"] is None
+            else f"rate {level['rate']:g}/s"
+        )
+        print(
+            f"{name:<20}{level['journeys'] / level['elapsed']:>12.1f}"
+            f"{total['rps']:>10.1f}{total['p50_ms']:>10.2f}{total['p99_ms']:>10.2f}"
+            f"{total['error_rate']:>9.1%}{level['queued_p99_ms']:>12.2f}"
+            f"{level['pool_wait_ms']:>11.2f}"
+        )
+
+
+async def run(args, dataset, mix):
+    from app.db import async_engine, engine
+    from app.main import app
+
+    # Async routes check connections out of the async engine's pool
+    engines = (engine, async_engine.sync_engine if async_engine else engine)
+    levels = []
+    # Run the lifespan, which sizes the thread pool like the server does
+    async with app.router.lifespan_context(app):
+        try:
+            if args.rate:
+                for rate in args.rate:
+                    levels.append(
+                        await run_level(
+                            app,
+                            engines,
+                            dataset,
+                            args,
+                            mix,
+                            max(args.concurrency),
+                            rate,
+                        )
+                    )
+                    print_level(levels[-1])
+            else:
+                for concurrency in args.concurrency:
+                    levels.append(
+                        await run_level(app, engines, dataset, args, mix, concurrency)
+                    )
+                    print_level(levels[-1])
+        finally:
+            reset(engine, dataset)
+    return levels
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=SIZES, default="1k")
+    parser.add_argument(
+        "--backend", choices=("auto", "sqlite", "postgresql"), default="auto"
+    )
+    parser.add_argument("--url", help="benchmark database (overrides --backend)")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16, 64],
+        help="virtual users; with --rate, the most journeys in flight",
+    )
+    parser.add_argument(
+        "--rate", type=float, nargs="+", help="journey arrivals per second"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="seconds per level"
+    )
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the curve to this JSON file")
+    args = parser.parse_args()
+
+    url = database_url(args)
+    # The app reads DATABASE_URL when it is first imported
+    os.environ["DATABASE_URL"] = url
+    from app.config import settings
+    from app.db import engine
+
+    dataset = Dataset(SIZES[args.size])
+    with Timer() as timer:
+        seeded = seed(engine, dataset)
+    if seeded:
+        print(f"seeded {dataset.subscriptions} subscriptions in {timer.elapsed:.1f}s")
+    environment = {
+        "backend": engine.dialect.name,
+        "size": args.size,
+        "async_db": settings.async_db,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "thread_limit": settings.anyio_thread_limit,
+        "bcrypt_rounds": settings.bcrypt_rounds,
+        "mix": args.mix,
+        "seed": args.seed,
+        "python": platform.python_version(),
+    }
+    print(
+        f"{environment['backend']} {url.partition('@')[2] or url}, {args.size}, "
+        f"async_db={settings.async_db} pool={settings.db_pool_size}"
+        f"+{settings.db_max_overflow} threads={settings.anyio_thread_limit} "
+        f"bcrypt rounds={settings.bcrypt_rounds}"
+    )
+
+    levels = asyncio.run(run(args, dataset, args.mix))
+    print_curve(levels)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"environment": environment, "levels": levels}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
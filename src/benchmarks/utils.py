@@ -0,0 +1,37 @@
+import time
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(name, latencies, elapsed):
+    return {
+        "name": name,
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def print_table(rows):
+    print(f"{'name':<24}{'requests':>10}{'req/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for row in rows:
+        print(
+            f"{row['name']:<24}{row['requests']:>10}{row['rps']:>12.1f}"
+            f"{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+        )
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -1,20 +1,37 @@
 import pytest
-import random
 import os
+import uuid
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+
+# Define a SQLite URL for testing
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+# Point the app settings at the test database before the app is imported
+os.environ.setdefault("DATABASE_URL", SQLALCHEMY_DATABASE_URL)
+# Keep bcrypt cheap in tests
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Log likely N+1 queries and fail requests that exceed their query budget
+os.environ.setdefault("QUERY_DEBUG", "1")
+
 from app.main import app
+from app import db as app_db
+from app.config import settings
 from app.db import Base
 from app.main import get_db
+from app.metrics import instrument_engine
+from app.querylog import watch_engine
 from .utils import create_user, login_user
 
-# Define a SQLite URL for testing
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-
 # Create the engine and session for the test database
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Stands in for the app engine, so give it the same SQL metrics hooks
+instrument_engine(engine)
+watch_engine(engine)
+# The engine the routes run on; under ASYNC_DB the async router uses its own
+app_engine = app_db.async_engine.sync_engine if settings.async_db else engine
 
 
 # Dependency override for the test database
@@ -41,12 +58,12 @@ def client():
 
 @pytest.fixture(scope="function")
 def unique_email():
-    return f"user{random.randint(1000, 9999)}@example.com"
+    return f"user{uuid.uuid4().hex[:12]}@example.com"
 
 
 @pytest.fixture(scope="function")
 def unique_username():
-    return f"user{random.randint(1000, 9999)}"
+    return f"user{uuid.uuid4().hex[:12]}"
 
 
 @pytest.fixture(scope="function")
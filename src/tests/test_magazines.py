@@ -1,5 +1,18 @@
 import pytest
-from .utils import create_user, login_user, create_plan, create_magazine
+from starlette.requests import ClientDisconnect
+from app import bulk, crud, models
+from app.config import settings
+from app.counts import parse_estimate
+from app.pagination import encode_cursor
+from app.schemas import MagazineCreate
+from .conftest import app_engine, TestingSessionLocal
+from .utils import (
+    create_user,
+    login_user,
+    create_plan,
+    create_magazine,
+    count_queries,
+)
 
 
 def test_create_magazine(client, unique_username, unique_email):
@@ -73,3 +86,325 @@ def test_delete_magazine(client, unique_username, unique_email):
     assert (
         response.status_code == 404
     ), f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_patch_rejects_explicit_null(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+    plan = create_plan(client, headers)
+    magazine_url = f"/magazines/{plan['magazine_id']}"
+    response = client.post(
+        "/subscriptions/",
+        json={
+            "user_id": user_id,
+            "plan_id": plan["id"],
+            "price": 10.0,
+            "next_renewal_date": "2024-12-31",
+        },
+    )
+    assert response.status_code == 200, response.text
+    subscription_url = f"/subscriptions/{response.json()['id']}"
+
+    for url, body in (
+        (magazine_url, {"title": None}),
+        (f"/plans/{plan['id']}", {"discount": None}),
+        (subscription_url, {"price": None}),
+    ):
+        response = client.patch(url, json=body)
+        assert response.status_code == 422, response.text
+    # Nothing was written
+    assert client.get(magazine_url).json()["title"] == "Magazine plan"
+    assert client.get(subscription_url).json()["price"] == 10.0
+
+
+def test_get_magazines_cursor_pagination(client, unique_username, unique_email):
+    username, _ = create_user(client, unique_username, unique_email, "adminpassword")
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    for i in range(3):
+        create_magazine(client, headers, f"cursor {i}")
+
+    seen = []
+    response = client.get("/magazines/?limit=2", headers=headers)
+    while True:
+        assert (
+            response.status_code == 200
+        ), f"Response status code: {response.status_code}, Response body: {response.text}"
+        seen.extend(magazine["id"] for magazine in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        response = client.get(f"/magazines/?limit=2&after={cursor}", headers=headers)
+
+    assert seen == sorted(seen)
+    assert len(seen) == len(set(seen)) >= 3
+
+
+def test_get_magazines_pagination_limits(client):
+    response = client.get("/magazines/?skip=1000000")
+    assert response.status_code == 422
+    response = client.get("/magazines/?after=not-a-cursor")
+    assert response.status_code == 400
+    # Past the 64-bit id range, or negative
+    for last_id in (2**63, 123456789012345678901234567890, -1):
+        response = client.get("/magazines/", params={"after": encode_cursor(last_id)})
+        assert response.status_code == 400
+    response = client.get(
+        "/magazines/search",
+        params={"q": "cursor", "after": encode_cursor(f"1.0:{2**63}")},
+    )
+    assert response.status_code == 400
+
+
+def test_catalog_statement_count(client, unique_username, unique_email):
+    username, _ = create_user(client, unique_username, unique_email, "adminpassword")
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def add_magazine(suffix):
+        magazine = create_magazine(client, headers, suffix, base_price=100)
+        for name, discount in (("Silver", 0.0), ("Gold", 0.05), ("Diamond", 0.25)):
+            response = client.post(
+                "/plans/",
+                json={
+                    "name": name,
+                    "price": 100,
+                    "discount": discount,
+                    "magazine_id": magazine["id"],
+                },
+                headers=headers,
+            )
+            assert response.status_code == 200
+        return magazine
+
+    first = add_magazine("catalog 1")
+    with count_queries(app_engine) as small_page:
+        response = client.get("/catalog/?limit=1", headers=headers)
+    for i in range(2, 6):
+        add_magazine(f"catalog {i}")
+    with count_queries(app_engine) as large_page:
+        response = client.get("/catalog/?limit=100", headers=headers)
+
+    assert (
+        response.status_code == 200
+    ), f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert len(small_page) == len(large_page) == 2
+    catalog = {magazine["id"]: magazine for magazine in response.json()}
+    prices = sorted(plan["discounted_price"] for plan in catalog[first["id"]]["plans"])
+    assert prices == [75.0, 95.0, 100.0]
+
+
+def test_get_magazine_cache_invalidated_on_update(
+    client, unique_username, unique_email
+):
+    username, _ = create_user(client, unique_username, unique_email, "adminpassword")
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    magazine = create_magazine(client, headers, "cached")
+    url = f"/magazines/{magazine['id']}"
+    hits = crud.magazine_cache.hits
+    assert client.get(url, headers=headers).json()["title"] == "Magazine cached"
+    assert client.get(url, headers=headers).json()["title"] == "Magazine cached"
+    assert crud.magazine_cache.hits == hits + 1
+
+    response = client.put(
+        url,
+        json={"title": "Recached", "description": "Updated", "base_price": 5.0},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert client.get(url, headers=headers).json()["title"] == "Recached"
+
+
+def test_bulk_create_magazines_reports_row_errors(client):
+    response = client.post(
+        "/magazines/bulk",
+        json=[
+            {"title": "Bulk 1", "description": "First", "base_price": 5.0},
+            {"title": "Bulk 2", "description": "Missing price"},
+            {"title": "Bulk 3", "description": "Third", "base_price": 7.5},
+        ],
+    )
+    assert (
+        response.status_code == 200
+    ), f"Response status code: {response.status_code}, Response body: {response.text}"
+    result = response.json()
+    assert result["inserted"] == 2
+    assert [error["index"] for error in result["errors"]] == [1]
+
+
+def test_bulk_create_isolates_failing_rows():
+    db = TestingSessionLocal()
+    try:
+        existing = crud.create_magazine(
+            db, MagazineCreate(title="Taken", description="Taken", base_price=1.0)
+        )
+        inserted, errors = crud.bulk_create(
+            db,
+            models.Magazine,
+            [
+                (0, {"id": existing.id, "title": "Duplicate id", "base_price": 1.0}),
+                (1, {"title": "Fresh", "description": "Fresh", "base_price": 2.0}),
+            ],
+        )
+        assert inserted == 1
+        assert [error["index"] for error in errors] == [0]
+    finally:
+        db.close()
+
+
+def test_search_magazines(client, unique_username):
+    word = unique_username  # unique per run, so only this test's rows match
+    for title, description in (
+        (f"{word} Weekly", "News every week"),
+        ("Garden Monthly", f"Plants, soil and {word} gardening"),
+        (f"{word} Review", f"All about {word}"),
+        ("Unrelated", "Nothing to see"),
+    ):
+        response = client.post(
+            "/magazines/",
+            json={"title": title, "description": description, "base_price": 5.0},
+        )
+        assert response.status_code == 200, response.text
+    unrelated = response.json()
+
+    response = client.get("/magazines/search", params={"q": word})
+    assert response.status_code == 200, response.text
+    results = response.json()
+    titles = [magazine["title"] for magazine in results]
+    # Title matches rank above a description-only match
+    assert sorted(titles[:2]) == [f"{word} Review", f"{word} Weekly"]
+    assert titles[2] == "Garden Monthly"
+
+    pages = []
+    after = None
+    while True:
+        params = {"q": word, "limit": 1}
+        if after:
+            params["after"] = after
+        response = client.get("/magazines/search", params=params)
+        pages += [magazine["title"] for magazine in response.json()]
+        after = response.headers.get("X-Next-Cursor")
+        if not after:
+            break
+    assert pages == titles
+
+    # The index follows updates and deletes
+    client.delete(f"/magazines/{results[0]['id']}")
+    client.patch(f"/magazines/{unrelated['id']}", json={"title": f"Not {word}"})
+    response = client.get("/magazines/search", params={"q": word})
+    titles = {magazine["title"] for magazine in response.json()}
+    assert f"Not {word}" in titles
+    assert len(titles) == 3
+
+    response = client.get("/magazines/search", params={"q": '"(*'})
+    assert response.status_code == 200
+    assert response.json() == []
+    response = client.get("/magazines/search", params={"q": ""})
+    assert response.status_code == 422
+
+
+def test_list_total_count(client):
+    with TestingSessionLocal() as db:
+        total = db.query(models.Magazine).count()
+    crud.count_cache.clear()
+
+    response = client.get("/magazines/", params={"count": "exact"})
+    assert response.status_code == 200, response.text
+    assert int(response.headers["X-Total-Count"]) == total
+    assert "X-Total-Count" not in client.get("/magazines/").headers
+
+    # Exact counts are cached briefly rather than re-run on every page
+    create_magazine(client, {}, "counted")
+    response = client.get("/magazines/", params={"count": "exact"})
+    assert int(response.headers["X-Total-Count"]) == total
+    crud.count_cache.clear()
+    response = client.get("/magazines/", params={"count": "exact"})
+    assert int(response.headers["X-Total-Count"]) == total + 1
+
+    response = client.get("/magazines/", params={"count": "estimated"})
+    assert int(response.headers["X-Total-Count"]) >= total + 1
+    assert client.get("/magazines/", params={"count": "all"}).status_code == 422
+
+
+def test_parse_count_estimate():
+    assert parse_estimate(1234.0) == 1234
+    assert parse_estimate(-1) is None
+    assert parse_estimate([{"Plan": {"Plan Rows": 42}}]) == 42
+    assert parse_estimate('[{"Plan": {"Plan Rows": 7}}]') == 7
+
+
+def test_conditional_get_magazines(client):
+    magazine = create_magazine(client, {}, "etag")
+    url = f"/magazines/{magazine['id']}"
+    response = client.get("/magazines/")
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"magazines-')
+    assert client.get(url).headers["ETag"] == etag
+
+    response = client.get("/magazines/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    modified = {"If-Modified-Since": response.headers["Last-Modified"]}
+    assert client.get("/magazines/", headers=modified).status_code == 304
+    stale = {"If-None-Match": 'W/"magazines-0"'}
+    assert client.get("/magazines/", headers=stale).status_code == 200
+    # "*" matches an existing row, never a missing one
+    any_tag = {"If-None-Match": "*"}
+    assert client.get(url, headers=any_tag).status_code == 304
+    assert client.get("/magazines/999999999", headers=any_tag).status_code == 404
+    assert client.get("/plans/999999999", headers=any_tag).status_code == 404
+
+    # Any write to the table changes the validators
+    client.patch(url, json={"title": "Re-tagged"})
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["title"] == "Re-tagged"
+    assert response.headers["ETag"] != etag
+    # Plans are versioned separately
+    assert client.get("/plans/").headers["ETag"].startswith('W/"plans-')
+
+
+def test_search_ranks_bounded_candidates(client, unique_username, monkeypatch):
+    word = unique_username
+    ids = [
+        client.post(
+            "/magazines/",
+            json={"title": title, "description": f"About {word}", "base_price": 5.0},
+        ).json()["id"]
+        for title in ("First", "Second", f"{word} Weekly")
+    ]
+    monkeypatch.setattr(settings, "search_candidates", 2)
+    # The title match would rank first, but only the first two matches are ranked
+    response = client.get("/magazines/search", params={"q": word})
+    assert sorted(magazine["id"] for magazine in response.json()) == ids[:2]
+
+
+def test_not_modified_skips_database(client):
+    etag = client.get("/magazines/").headers["ETag"]
+    with count_queries(app_engine) as queries:
+        response = client.get("/magazines/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert len(queries) == 0
+
+
+def test_cut_off_bulk_load_still_invalidates(client, monkeypatch):
+    async def cut_off(request):
+        yield 0, {"title": "Committed", "description": "First", "base_price": 1.0}
+        raise ClientDisconnect()
+
+    etag = client.get("/magazines/").headers["etag"]
+    monkeypatch.setattr(settings, "bulk_chunk_size", 1)
+    monkeypatch.setattr(bulk, "iter_rows", cut_off)
+    with pytest.raises(ClientDisconnect):
+        client.post("/magazines/bulk", json=[])
+    response = client.get("/magazines/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
@@ -0,0 +1,50 @@
+from app.metrics import Histogram, registry
+from .utils import create_magazine
+
+
+def sample(body, line_prefix):
+    for line in body.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_metrics_endpoint(client):
+    magazine = create_magazine(client, {}, "metrics")
+    client.get(f"/magazines/{magazine['id']}")
+    client.get("/magazines/")
+    client.get("/no-such-route")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    route = 'method="GET",route="/magazines/{magazine_id}"'
+    assert sample(body, f"http_request_duration_seconds_count{{{route}}}") >= 1
+    assert (
+        sample(body, f'http_requests_total{{{route},status="200"}}') >= 1
+    ), "routes are labelled by template, not by the requested path"
+    assert sample(
+        body, 'http_requests_total{method="GET",route="<unmatched>",status="404"}'
+    )
+    # The list read its rows through the instrumented engine
+    listing = 'method="GET",route="/magazines/"'
+    assert sample(body, f"http_request_db_statements_sum{{{listing}}}") >= 1
+    assert sample(body, f"http_request_db_seconds_sum{{{listing}}}") > 0
+    assert sample(body, "db_statement_duration_seconds_count") >= 1
+    # Only the /metrics request itself is being served
+    assert sample(body, "http_requests_in_flight") == 1
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Test.", (0.1, 1.0), ("route",))
+    registry.remove(histogram)
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, ("/x",))
+    assert list(histogram.samples()) == [
+        'test_seconds_bucket{route="/x",le="0.1"} 1',
+        'test_seconds_bucket{route="/x",le="1.0"} 3',
+        'test_seconds_bucket{route="/x",le="+Inf"} 4',
+        'test_seconds_sum{route="/x"} 4.05',
+        'test_seconds_count{route="/x"} 4',
+    ]
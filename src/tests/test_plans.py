@@ -1,5 +1,19 @@
 import pytest
-from .utils import create_user, login_user
+from datetime import date, timedelta
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql
+from app import crud, models, schemas
+from app.jwt import create_access_token
+from app.pagination import encode_cursor
+from .conftest import TestingSessionLocal
+from .utils import (
+    create_user,
+    login_user,
+    create_magazine,
+    create_plan,
+    foreign_key_session,
+)
 
 
 def test_create_plan(client, unique_username, unique_email):
@@ -158,6 +172,37 @@ def test_delete_plan(client, unique_username, unique_email):
     ), f"Response status code: {response.status_code}, Response body: {response.text}"
 
 
+def test_delete_refused_while_referenced(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+    plan = create_plan(client, headers)
+    unused = create_plan(client, headers)
+    with foreign_key_session() as db:
+        crud.create_subscription(
+            db,
+            schemas.SubscriptionCreate(
+                user_id=user_id,
+                plan_id=plan["id"],
+                next_renewal_date=date(2024, 12, 31),
+            ),
+        )
+        for delete, row_id in (
+            (crud.delete_magazine, plan["magazine_id"]),
+            (crud.delete_plan, plan["id"]),
+        ):
+            with pytest.raises(HTTPException) as raised:
+                delete(db, row_id)
+            assert raised.value.status_code == 409
+        assert crud.get_plan(db, plan["id"]) is not None
+
+        assert crud.delete_plan(db, unused["id"]) is not None
+        assert crud.delete_magazine(db, unused["magazine_id"]) is not None
+        assert crud.delete_plan(db, unused["id"]) is None
+
+
 def test_create_plan_with_zero_renewal_period(client, unique_username, unique_email):
     username, _ = create_user(client, unique_username, unique_email, "adminpassword")
     token = login_user(client, username, "adminpassword")
@@ -174,3 +219,120 @@ def test_create_plan_with_zero_renewal_period(client, unique_username, unique_em
     assert (
         response.status_code == 422
     ), f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_price_matrix_maintained_on_write(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+    magazine = create_magazine(client, headers, "price matrix", base_price=100)
+    response = client.post(
+        "/plans/",
+        json={
+            "name": "Gold",
+            "price": 100,
+            "discount": 0.2,
+            "magazine_id": magazine["id"],
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    plan_id = response.json()["id"]
+
+    def catalog_price():
+        after = encode_cursor(magazine["id"] - 1)
+        response = client.get("/catalog/", params={"after": after, "limit": 1})
+        (plan,) = response.json()[0]["plans"]
+        return plan["discounted_price"]
+
+    def subscribe():
+        response = client.post(
+            "/subscriptions/",
+            json={
+                "user_id": user_id,
+                "plan_id": plan_id,
+                "next_renewal_date": "2024-12-31",
+            },
+        )
+        assert response.status_code == 200, response.text
+        client.delete(f"/subscriptions/{response.json()['id']}")
+        return response.json()["price"]
+
+    assert catalog_price() == 80.0
+    assert subscribe() == 80.0
+
+    response = client.patch(f"/magazines/{magazine['id']}", json={"base_price": 50})
+    assert response.status_code == 200, response.text
+    assert catalog_price() == 40.0
+    assert subscribe() == 40.0
+
+    response = client.patch(f"/plans/{plan_id}", json={"discount": 0.5})
+    assert response.status_code == 200, response.text
+    assert catalog_price() == 25.0
+    assert subscribe() == 25.0
+
+
+def test_bulk_plans_are_priced(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = create_access_token(
+        data={"sub": username, "uid": user_id}, expires_delta=timedelta(minutes=5)
+    )
+    headers = {"Authorization": f"Bearer {token}"}
+    magazine = create_magazine(client, headers, "bulk priced", base_price=10)
+    response = client.post(
+        "/plans/bulk",
+        json=[
+            {
+                "name": "Bulk",
+                "price": 10,
+                "discount": 0.1,
+                "magazine_id": magazine["id"],
+            }
+        ],
+        headers=headers,
+    )
+    assert response.json()["inserted"] == 1, response.text
+    plan_id = client.get(
+        "/catalog/", params={"after": encode_cursor(magazine["id"] - 1), "limit": 1}
+    ).json()[0]["plans"][0]["id"]
+
+    response = client.post(
+        "/subscriptions/bulk",
+        json=[
+            {"user_id": user_id, "plan_id": plan_id, "next_renewal_date": "2024-12-31"}
+        ],
+        headers=headers,
+    )
+    assert response.json()["inserted"] == 1, response.text
+    response = client.get("/users/me/subscriptions", headers=headers)
+    assert [s["price"] for s in response.json()] == [9.0]
+
+
+def test_catalog_lists_unpriced_plans(client):
+    magazine = create_magazine(client, {}, "unpriced")
+    # A plan written without its plan_prices row, as a raw import would
+    with TestingSessionLocal() as db:
+        db.execute(
+            insert(models.Plan).values(
+                name="Imported", price=10, magazine_id=magazine["id"]
+            )
+        )
+        db.commit()
+    response = client.get(
+        "/catalog/", params={"after": encode_cursor(magazine["id"] - 1), "limit": 1}
+    )
+    assert response.status_code == 200, response.text
+    (plan,) = response.json()[0]["plans"]
+    assert plan["discounted_price"] is None
+
+
+def test_plan_repricing_locks_the_magazine_on_postgres():
+    lock = crud.price_source_lock("postgresql", models.Plan.id == 1)
+    sql = str(lock.compile(dialect=postgresql.dialect()))
+    assert sql.startswith("SELECT magazines.id")
+    assert sql.endswith("FOR NO KEY UPDATE")
+    assert crud.price_source_lock("sqlite", models.Plan.id == 1) is None
@@ -0,0 +1,66 @@
+import sqlite3
+import time
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError, TimeoutError
+from app.config import settings
+from app.pool import TimedQueuePool, pool_status
+from .conftest import SQLALCHEMY_DATABASE_URL
+
+
+def test_pool_status_tracks_checkouts_and_timeouts():
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        poolclass=TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        status = pool_status(engine)
+        assert status["checked_out"] == 1
+        assert status["idle"] == 0
+        with pytest.raises(TimeoutError):
+            engine.connect()
+
+    status = pool_status(engine)
+    assert status["size"] == 1
+    assert status["checked_out"] == 0
+    assert status["idle"] == 1
+    assert status["wait"]["checkouts"] == 1
+    assert status["wait"]["timeouts"] == 1
+    engine.dispose()
+
+
+def test_read_pool_status(client):
+    response = client.get("/internal/pool")
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["sync"]["class"] == "TimedQueuePool"
+    assert body["sync"]["size"] == settings.db_pool_size
+    assert body["threads"]["limit"] == settings.anyio_thread_limit
+    assert ("async" in body) == settings.async_db
+
+
+def test_pool_wait_excludes_connect_time_and_failures():
+    failing = True
+
+    def creator():
+        time.sleep(0.1)
+        if failing:
+            raise sqlite3.OperationalError("unable to open database file")
+        return sqlite3.connect(":memory:")
+
+    engine = create_engine("sqlite://", creator=creator, poolclass=TimedQueuePool)
+    with pytest.raises(OperationalError):
+        engine.connect()
+    failing = False
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    wait = pool_status(engine)["wait"]
+    assert wait["timeouts"] == 0
+    assert wait["checkouts"] == 1
+    assert wait["max_wait_ms"] < 50
+    engine.dispose()
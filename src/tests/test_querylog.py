@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import pytest
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app import models, schemas
+from app.querylog import QueryBudget, QueryBudgetExceeded, QueryBudgetRoute, normalize
+from .conftest import TestingSessionLocal
+from .utils import create_plan
+
+
+def test_normalize_groups_statement_shapes():
+    assert normalize(
+        "SELECT * FROM plans\n WHERE plans.magazine_id = ?  AND title = 'x'"
+    ) == normalize("SELECT * FROM plans WHERE plans.magazine_id = 7 AND title = 'y'")
+    assert normalize("SELECT * FROM plans WHERE id IN (?, ?, ?) LIMIT 10") == (
+        "SELECT * FROM plans WHERE id IN (?) LIMIT ?"
+    )
+    assert normalize("SELECT %(id_1)s, $2, :name, x::text, anon_1") == (
+        "SELECT ?, ?, ?, x::text, anon_1"
+    )
+
+
+def test_lazy_loads_are_flagged_as_repeated(client):
+    for _ in range(3):
+        create_plan(client, {})
+    with TestingSessionLocal() as db, QueryBudget(100) as log:
+        magazines = db.scalars(
+            select(models.Magazine).order_by(models.Magazine.id.desc()).limit(3)
+        ).all()
+        for magazine in magazines:
+            magazine.plans
+    (shape, count), *_ = log.repeated(3)
+    assert count == 3
+    assert "FROM plans" in shape
+
+
+def test_query_budget_exceeded():
+    with pytest.raises(QueryBudgetExceeded, match="2 statements, budget 1"):
+        with TestingSessionLocal() as db, QueryBudget(1, strict=True):
+            db.scalar(select(models.Magazine.id).limit(1))
+            db.scalar(select(models.Plan.id).limit(1))
+
+    @QueryBudget(0, strict=True)
+    def read_plan():
+        with TestingSessionLocal() as db:
+            return db.scalar(select(models.Plan.id).limit(1))
+
+    with pytest.raises(QueryBudgetExceeded):
+        read_plan()
+
+    @QueryBudget(1, strict=True)
+    async def within_budget():
+        with TestingSessionLocal() as db:
+            return db.scalar(select(models.Plan.id).limit(1))
+
+    asyncio.run(within_budget())
+
+
+def test_route_budget_covers_serialization(client):
+    for _ in range(3):
+        create_plan(client, {})
+
+    def get_session():
+        with TestingSessionLocal() as db:
+            yield db
+
+    router = APIRouter(route_class=QueryBudgetRoute)
+
+    @router.get("/lazy", response_model=list[schemas.CatalogMagazine])
+    @QueryBudget(1, strict=True)
+    def lazy_catalog(db: Session = Depends(get_session)):
+        # One statement here; each magazine's plans load lazily when the
+        # response model reads them, after the endpoint has returned
+        return db.scalars(
+            select(models.Magazine).order_by(models.Magazine.id.desc()).limit(3)
+        ).all()
+
+    app = FastAPI()
+    app.include_router(router)
+    with pytest.raises(QueryBudgetExceeded, match="budget 1"):
+        TestClient(app).get("/lazy")
+
+
+def test_query_budget_warns_when_not_strict(caplog):
+    with caplog.at_level(logging.WARNING, logger="app.querylog"):
+        with TestingSessionLocal() as db, QueryBudget(0, strict=False):
+            db.scalar(select(models.Plan.id).limit(1))
+    assert "budget 0" in caplog.text
+
+
+def test_query_count_header(client):
+    response = client.get("/catalog/?limit=5")
+    assert response.status_code == 200
+    assert 1 <= int(response.headers["X-Query-Count"]) <= 2
@@ -0,0 +1,99 @@
+import os
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from app import db as app_db, models
+from app.config import settings
+from app.db import Base, to_async_url
+from app.pagination import encode_cursor
+from app.replicas import PRIMARY_COOKIE, PrimaryPinMiddleware, ReplicaSet
+
+REPLICA_DATABASE_URL = "sqlite:///./test_replica.db"
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    engine = create_engine(REPLICA_DATABASE_URL)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(models.Magazine).values(
+                id=1000001,
+                title="Replica Only",
+                description="Only present on the replica",
+                base_price=1.0,
+            )
+        )
+    if settings.async_db:
+        async_engine = create_async_engine(to_async_url(REPLICA_DATABASE_URL))
+        monkeypatch.setattr(app_db, "async_replicas", ReplicaSet([async_engine]))
+    else:
+        monkeypatch.setattr(app_db, "replicas", ReplicaSet([engine]))
+    yield
+    engine.dispose()
+    os.remove("test_replica.db")
+
+
+def test_reads_go_to_replica_unless_pinned(client, replica):
+    params = {"after": encode_cursor(1000000)}
+    response = client.get("/magazines/", params=params)
+    assert response.status_code == 200, response.text
+    assert [m["title"] for m in response.json()] == ["Replica Only"]
+
+    response = client.get("/magazines/", params=params, headers={"X-Read-Primary": "1"})
+    assert response.status_code == 200
+    assert response.json() == []
+
+    client.cookies.set(PRIMARY_COOKIE, "1")
+    try:
+        response = client.get("/magazines/", params=params)
+    finally:
+        client.cookies.clear()
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_cached_reads_and_versions_never_come_from_replica(client, replica):
+    magazine = client.post(
+        "/magazines/",
+        json={"title": "Primary", "description": "Primary", "base_price": 1.0},
+    ).json()
+    pinned = {"X-Read-Primary": "1"}
+    primary_etag = client.get("/magazines/", headers=pinned).headers["ETag"]
+
+    # The replica has no table_versions row, so its lists carry version 0
+    assert client.get("/magazines/").headers["ETag"] == 'W/"magazines-0"'
+    # ... which must not leak into the primary's cached version
+    assert client.get("/magazines/", headers=pinned).headers["ETag"] == primary_etag
+    # By-id reads fill the row cache, so they use the primary
+    assert client.get("/magazines/1000001").status_code == 404
+    response = client.get(f"/magazines/{magazine['id']}")
+    assert response.status_code == 200
+    assert response.headers["ETag"] == primary_etag
+
+
+def test_replica_set_round_robin():
+    replicas = ReplicaSet(["a", "b"])
+    assert [replicas.next() for _ in range(3)] == ["a", "b", "a"]
+    assert not ReplicaSet([])
+
+
+def test_writes_pin_client_to_primary():
+    pinned_app = FastAPI()
+    pinned_app.add_middleware(PrimaryPinMiddleware, pin_seconds=5)
+
+    @pinned_app.get("/items")
+    def read_items():
+        return []
+
+    @pinned_app.post("/items")
+    def create_item():
+        return {}
+
+    with TestClient(pinned_app) as c:
+        assert PRIMARY_COOKIE not in c.get("/items").cookies
+        response = c.post("/items")
+        assert response.cookies[PRIMARY_COOKIE] == "1"
+        assert "Max-Age=5" in response.headers["set-cookie"]
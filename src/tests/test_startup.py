@@ -0,0 +1,92 @@
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from alembic import command
+from alembic.config import Config
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, inspect, text
+from app import db as app_db
+from app.config import settings
+from app.main import app
+from app.pool import pool_status
+
+ALEMBIC_INI = Path(__file__).resolve().parents[2] / "alembic.ini"
+MIGRATED_DATABASE_URL = "sqlite:///./test_migrated.db"
+# The schema the app created with create_all before it used Alembic
+BASELINE_REVISION = "3c9e5a1f7b20"
+
+
+@contextmanager
+def migrated_connection():
+    engine = create_engine(MIGRATED_DATABASE_URL)
+    config = Config(str(ALEMBIC_INI))
+    try:
+        with engine.begin() as connection:
+            config.attributes["connection"] = connection
+            yield config, connection
+    finally:
+        engine.dispose()
+        os.remove("test_migrated.db")
+
+
+def test_migrations_match_models():
+    with migrated_connection() as (config, connection):
+        command.upgrade(config, "head")
+        # Raises if the models have anything the migrations don't create
+        command.check(config)
+        assert "magazines_fts" in inspect(connection).get_table_names()
+        command.downgrade(config, "base")
+        assert inspect(connection).get_table_names() == ["alembic_version"]
+
+
+def test_upgrade_from_baseline_fills_new_tables():
+    with migrated_connection() as (config, connection):
+        command.upgrade(config, BASELINE_REVISION)
+        connection.execute(
+            text(
+                "INSERT INTO magazines (id, title, description, base_price) "
+                "VALUES (1, 'Garden Monthly', 'Roses and tulips', 12.5)"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO plans (id, name, price, magazine_id) VALUES (1, 'Yearly', 1, 1)"
+            )
+        )
+        connection.execute(text("INSERT INTO users (id, username) VALUES (1, 'old')"))
+        command.upgrade(config, "head")
+        prices = connection.execute(text("SELECT * FROM plan_prices")).all()
+        assert prices == [(1, 1, 12.5)]
+        plans = connection.execute(text("SELECT discount, renewal_period FROM plans"))
+        assert plans.all() == [(0.0, 1)]
+        assert connection.execute(text("SELECT is_active FROM users")).scalar() == 1
+        matches = connection.execute(
+            text("SELECT rowid FROM magazines_fts WHERE magazines_fts MATCH 'tulip'")
+        )
+        assert matches.all() == [(1,)]
+
+
+def test_import_does_not_connect():
+    # An unreachable server: importing the app must not need it
+    env = {
+        **os.environ,
+        "DATABASE_URL": "postgresql+psycopg2://nobody@127.0.0.1:1/none",
+    }
+    code = (
+        "import sys, app.main, app.db; "
+        "assert not app.db._engines_created; "
+        "assert 'psycopg2' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+
+def test_lifespan_warms_and_drains_the_pool():
+    app_db.create_engines()
+    app_db.engine.dispose()
+    with TestClient(app):
+        status = pool_status(app_db.engine)
+        assert status["idle"] == min(settings.db_pool_warm, settings.db_pool_size)
+        assert status["checked_out"] == 0
+    assert pool_status(app_db.engine)["idle"] == 0
@@ -1,5 +1,22 @@
+import csv
+import json
 import pytest
-from .utils import create_user, login_user, create_plan, create_magazine
+from datetime import date, timedelta
+from fastapi import HTTPException
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from app import crud, models, renewals, schemas
+from app.jwt import create_access_token
+from app.pagination import encode_cursor
+from .conftest import app_engine, engine, TestingSessionLocal
+from .utils import (
+    create_user,
+    login_user,
+    create_plan,
+    create_magazine,
+    count_queries,
+    foreign_key_session,
+)
 
 
 def test_create_subscription(client, unique_username, unique_email):
@@ -39,7 +56,7 @@ def test_get_subscriptions(client, unique_username, unique_email):
     name_suffix = "get_sub"
     magazine = create_magazine(client, headers, name_suffix)
 
-    client.post(
+    created = client.post(
         "/subscriptions/",
         json={
             "user_id": 1,  # Assuming the created user ID is 1
@@ -49,16 +66,23 @@ def test_get_subscriptions(client, unique_username, unique_email):
             "next_renewal_date": "2024-12-31",
         },
         headers=headers,
-    )
+    ).json()
 
     response = client.get("/subscriptions/", headers=headers)
     assert (
         response.status_code == 200
     ), f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.headers["content-type"] == "application/json"
     subscriptions = response.json()
     assert isinstance(subscriptions, list)
     assert len(subscriptions) > 0
 
+    # The fast list path must render rows exactly like the response model
+    after = encode_cursor(created["id"] - 1)
+    response = client.get("/subscriptions/", params={"after": after, "limit": 1})
+    assert response.json() == [created]
+    assert response.headers["X-Next-Cursor"] == encode_cursor(created["id"])
+
 
 def test_update_subscription(client, unique_username, unique_email):
     username, _ = create_user(client, unique_username, unique_email, "adminpassword")
@@ -141,3 +165,355 @@ def test_delete_subscription(client, unique_username, unique_email):
     assert not response.json()[
         "is_active"
     ], f"Subscription is not marked as inactive: {response.json()}"
+
+
+def test_subscription_writes_single_statement(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+    plan = create_plan(client, headers)
+    magazine = create_magazine(client, headers, "single_statement")
+
+    with count_queries(app_engine) as statements:
+        response = client.post(
+            "/subscriptions/",
+            json={
+                "user_id": user_id,
+                "magazine_id": magazine["id"],
+                "plan_id": plan["id"],
+                "price": 10.0,
+                "next_renewal_date": "2024-12-31",
+            },
+        )
+    assert response.status_code == 200, response.text
+    assert len(statements) == 1
+    subscription = response.json()
+
+    with count_queries(app_engine) as statements:
+        response = client.patch(
+            f"/subscriptions/{subscription['id']}", json={"price": 7.5}
+        )
+    assert response.status_code == 200, response.text
+    assert len(statements) == 1
+    assert response.json()["price"] == 7.5
+    assert response.json()["next_renewal_date"] == subscription["next_renewal_date"]
+
+    with count_queries(app_engine) as statements:
+        response = client.delete(f"/subscriptions/{subscription['id']}")
+    assert response.status_code == 200, response.text
+    assert len(statements) == 1
+    assert not response.json()["is_active"]
+
+    response = client.patch("/subscriptions/999999", json={"price": 1.0})
+    assert response.status_code == 404
+
+
+def test_read_my_subscriptions(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    _, other_id = create_user(
+        client, f"other{unique_username}", f"other{unique_email}", "adminpassword"
+    )
+    token = create_access_token(
+        data={"sub": username, "uid": user_id}, expires_delta=timedelta(minutes=5)
+    )
+    headers = {"Authorization": f"Bearer {token}"}
+
+    created = []
+    for owner in (user_id, user_id, user_id, other_id):
+        plan = create_plan(client, headers)
+        response = client.post(
+            "/subscriptions/",
+            json={
+                "user_id": owner,
+                "plan_id": plan["id"],
+                "price": 10.0,
+                "next_renewal_date": "2024-12-31",
+            },
+        )
+        assert response.status_code == 200, response.text
+        created.append(response.json())
+    client.delete(f"/subscriptions/{created[1]['id']}")
+
+    with count_queries(app_engine) as statements:
+        response = client.get("/users/me/subscriptions", headers=headers)
+    assert response.status_code == 200, response.text
+    subscriptions = response.json()
+    assert [s["id"] for s in subscriptions] == [created[0]["id"], created[2]["id"]]
+    assert subscriptions[0]["plan"]["magazine"]["id"] == (
+        subscriptions[0]["plan"]["magazine_id"]
+    )
+    # User lookup plus one joined query, however many rows come back
+    assert len(statements) == 2
+
+    # SQLite has no planner estimate for a filter, so this falls back to exact
+    response = client.get(
+        "/users/me/subscriptions", params={"count": "estimated"}, headers=headers
+    )
+    assert response.headers["X-Total-Count"] == "2"
+
+    response = client.get(
+        "/users/me/subscriptions", params={"limit": 1}, headers=headers
+    )
+    assert [s["id"] for s in response.json()] == [created[0]["id"]]
+    response = client.get(
+        "/users/me/subscriptions",
+        params={"after": response.headers["X-Next-Cursor"]},
+        headers=headers,
+    )
+    assert [s["id"] for s in response.json()] == [created[2]["id"]]
+
+
+def test_one_active_subscription_per_plan(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+    plan = create_plan(client, headers)
+    body = {
+        "user_id": user_id,
+        "plan_id": plan["id"],
+        "price": 10.0,
+        "next_renewal_date": "2024-12-31",
+    }
+
+    first = client.post("/subscriptions/", json=body)
+    assert first.status_code == 200, first.text
+    response = client.post("/subscriptions/", json=body)
+    assert response.status_code == 409, response.text
+
+    # Once the first is cancelled the user may subscribe again, but the old
+    # one cannot be reactivated alongside the new one
+    client.delete(f"/subscriptions/{first.json()['id']}")
+    response = client.post("/subscriptions/", json=body)
+    assert response.status_code == 200, response.text
+    response = client.patch(
+        f"/subscriptions/{first.json()['id']}", json={"is_active": True}
+    )
+    assert response.status_code == 409, response.text
+
+
+def test_subscription_price_comes_from_plan(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+    plan = create_plan(client, headers)
+    with TestingSessionLocal() as db:
+        plan_price = db.get(models.PlanPrice, plan["id"]).price
+    body = {"user_id": user_id, "next_renewal_date": "2024-12-31"}
+
+    response = client.post("/subscriptions/", json={**body, "plan_id": plan["id"]})
+    assert response.status_code == 200, response.text
+    assert response.json()["price"] == plan_price
+
+    # No plan_prices row to quote from: rejected, and nothing is inserted
+    with TestingSessionLocal() as db:
+        before = db.query(models.Subscription).count()
+    response = client.post("/subscriptions/", json={**body, "plan_id": 999999})
+    assert response.status_code == 422, response.text
+    other_plan = create_plan(client, headers)
+    rows = [{**body, "plan_id": 999999}, {**body, "plan_id": other_plan["id"]}]
+    response = client.post("/subscriptions/bulk", json=rows)
+    assert response.status_code == 200, response.text
+    assert response.json()["inserted"] == 1
+    assert [error["index"] for error in response.json()["errors"]] == [0]
+    with TestingSessionLocal() as db:
+        assert db.query(models.Subscription).count() == before + 1
+        assert not db.query(models.Subscription).filter_by(price=None).count()
+        bulk_row = db.query(models.Subscription).filter_by(plan_id=other_plan["id"])
+        assert bulk_row.one().price == db.get(models.PlanPrice, other_plan["id"]).price
+
+
+def test_missing_user_or_plan_is_not_a_conflict(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = login_user(client, username, "adminpassword")
+    plan = create_plan(client, {"Authorization": f"Bearer {token}"})
+    body = {"price": 1.0, "next_renewal_date": date(2024, 12, 31)}
+    with foreign_key_session() as db:
+        for user, plan_id in ((999999, plan["id"]), (user_id, 999999)):
+            subscription = schemas.SubscriptionCreate(
+                **body, user_id=user, plan_id=plan_id
+            )
+            with pytest.raises(HTTPException) as raised:
+                crud.create_subscription(db, subscription)
+            assert raised.value.status_code == 422
+
+        created = crud.create_subscription(
+            db,
+            schemas.SubscriptionCreate(**body, user_id=user_id, plan_id=plan["id"]),
+        )
+        with pytest.raises(HTTPException) as raised:
+            crud.patch_subscription(
+                db, created.id, schemas.SubscriptionPatch(plan_id=999999)
+            )
+        assert raised.value.status_code == 422
+
+
+def test_bulk_create_subscriptions_ndjson(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+    plans = [create_plan(client, headers) for _ in range(2)]
+
+    rows = [
+        f'{{"user_id": {user_id}, "plan_id": {plan["id"]}, '
+        f'"price": 10.0, "next_renewal_date": "2024-12-31"}}'
+        for plan in plans
+    ]
+    body = "\n".join([rows[0], "{not json", rows[1], ""])
+    response = client.post(
+        "/subscriptions/bulk",
+        content=body,
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert (
+        response.status_code == 200
+    ), f"Response status code: {response.status_code}, Response body: {response.text}"
+    result = response.json()
+    assert result["inserted"] == 2
+    assert [error["index"] for error in result["errors"]] == [1]
+
+
+def test_export_subscriptions(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+    ids = []
+    for price in (10.0, 20.0):
+        plan = create_plan(client, headers)
+        response = client.post(
+            "/subscriptions/",
+            json={
+                "user_id": user_id,
+                "plan_id": plan["id"],
+                "price": price,
+                "next_renewal_date": "2024-12-31",
+            },
+            headers=headers,
+        )
+        ids.append(response.json()["id"])
+    client.delete(f"/subscriptions/{ids[1]}", headers=headers)
+
+    response = client.get(
+        f"/subscriptions/export?user_id={user_id}&is_active=true", headers=headers
+    )
+    assert (
+        response.status_code == 200
+    ), f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == ids[:1]
+    assert rows[0]["next_renewal_date"] == "2024-12-31"
+
+    response = client.get(
+        f"/subscriptions/export?format=csv&user_id={user_id}", headers=headers
+    )
+    assert response.status_code == 200
+    rows = list(csv.DictReader(response.text.splitlines()))
+    assert [int(row["id"]) for row in rows] == ids
+
+
+def test_renew_due_subscriptions(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "adminpassword"
+    )
+    token = login_user(client, username, "adminpassword")
+    headers = {"Authorization": f"Bearer {token}"}
+    magazine = create_magazine(client, headers, "renewal", base_price=100)
+    plan, other_plan = (
+        client.post(
+            "/plans/",
+            json={
+                "name": "Gold",
+                "price": 100,
+                "discount": 0.1,
+                "renewal_period": 3,
+                "magazine_id": magazine["id"],
+            },
+            headers=headers,
+        ).json()
+        for _ in range(2)
+    )
+    subscription, _ = (
+        client.post(
+            "/subscriptions/",
+            json={
+                "user_id": user_id,
+                "plan_id": plan_id,
+                "price": 100.0,
+                "next_renewal_date": "2025-01-31",
+            },
+            headers=headers,
+        ).json()
+        for plan_id in (plan["id"], other_plan["id"])
+    )
+
+    updates = []
+
+    def record_update(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith(("UPDATE", "WITH")):
+            updates.append(executemany)
+
+    db = TestingSessionLocal()
+    # Renewals charge the plan_prices row, not their own recomputation
+    db.execute(
+        update(models.PlanPrice)
+        .where(models.PlanPrice.plan_id == plan["id"])
+        .values(price=89.99)
+    )
+    db.commit()
+    event.listen(engine, "before_cursor_execute", record_update)
+    try:
+        result = renewals.run_renewals(db, today=date(2025, 5, 1), chunk_size=2)
+    finally:
+        event.remove(engine, "before_cursor_execute", record_update)
+        db.close()
+    assert result["renewed"] >= 2
+    # One set-based UPDATE per chunk, never a row-by-row executemany
+    assert updates == [False] * -(-result["renewed"] // 2)
+
+    response = client.get(f"/subscriptions/{subscription['id']}", headers=headers)
+    assert response.json()["price"] == 89.99
+    assert response.json()["next_renewal_date"] == "2025-07-31"
+
+    assert set(result) == {"renewed", "elapsed_seconds", "rows_per_second"}
+
+    # A global job, so no API token may start it; it runs from the CLI only
+    response = client.post("/admin/renewals", headers=headers)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize(
+    "attr, code, status",
+    [
+        ("pgcode", "23505", 409),
+        ("sqlite_errorname", "SQLITE_CONSTRAINT_UNIQUE", 409),
+        ("pgcode", "23503", 422),
+        ("sqlite_errorname", "SQLITE_CONSTRAINT_FOREIGNKEY", 422),
+        ("pgcode", "23502", None),
+        (None, None, None),
+    ],
+)
+def test_subscription_integrity_error_mapping(attr, code, status):
+    orig = Exception("constraint failed")
+    if attr:
+        setattr(orig, attr, code)
+    exc = IntegrityError("INSERT INTO subscriptions ...", {}, orig)
+    if status is None:
+        # A NOT NULL, CHECK or unidentified failure is not a duplicate
+        with pytest.raises(IntegrityError):
+            crud.subscription_integrity_error(exc)
+    else:
+        assert crud.subscription_integrity_error(exc).status_code == status
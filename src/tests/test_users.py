@@ -1,11 +1,14 @@
 import pytest
-from .utils import create_user, login_user
+from app import jwt as app_jwt
+from app.models import User
+from app.passwords import pwd_context
+from .conftest import app_engine, TestingSessionLocal
+from .utils import create_user, login_user, count_queries
 from datetime import datetime, timedelta, UTC
 from datetime import timedelta
 from jose import JWTError, jwt
 from typing import Any, Union
 
-
 DATABASE_URL: str
 SECRET_KEY: str = "secret_key"
 ALGORITHM: str = "HS256"
@@ -50,6 +53,36 @@ def test_login_user(client, unique_username, unique_email):
     ), f"Response status code: {response.status_code}, Response body: {response.text}"
 
 
+def test_login_wrong_password(client, unique_username, unique_email):
+    username, _ = create_user(client, unique_username, unique_email, "rightpassword")
+    response = client.post(
+        "/users/login", json={"username": username, "password": "wrongpassword"}
+    )
+    assert (
+        response.status_code == 400
+    ), f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_password_hash_upgraded_on_login(client, unique_username, unique_email):
+    username, user_id = create_user(
+        client, unique_username, unique_email, "upgradepassword"
+    )
+    db = TestingSessionLocal()
+    try:
+        user = db.get(User, user_id)
+        assert user.password != "upgradepassword"
+        # Simulate a row hashed with an older work factor
+        user.password = pwd_context.hash("upgradepassword", rounds=5)
+        db.commit()
+
+        login_user(client, username, "upgradepassword")
+        db.refresh(user)
+        assert pwd_context.verify("upgradepassword", user.password)
+        assert not pwd_context.needs_update(user.password)
+    finally:
+        db.close()
+
+
 def test_reset_password(client, unique_username, unique_email):
     username, user_id = create_user(
         client, unique_username, unique_email, "adminpassword"
@@ -108,6 +141,54 @@ def test_token_refresh(client, unique_username, unique_email):
     assert "refresh_token" in response.json(), "Refresh token not found in response"
 
 
+def test_read_users_me_uses_token_cache(client, unique_username, unique_email):
+    username, user_id = create_user(client, unique_username, unique_email, "mepass")
+    token = app_jwt.create_access_token(
+        data={"sub": username}, expires_delta=timedelta(minutes=5)
+    )
+    headers = {"Authorization": f"Bearer {token}"}
+
+    hits = app_jwt.token_cache.hits
+    response = client.get("/users/me", headers=headers)
+    assert (
+        response.status_code == 200
+    ), f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["id"] == user_id
+    # The second decode in token_expiry is served from the cache
+    assert app_jwt.token_cache.hits == hits + 1
+
+    response = client.get("/users/me", headers=headers)
+    assert response.status_code == 200
+    assert app_jwt.token_cache.hits == hits + 3
+
+
+def test_read_users_me_single_query(client, unique_username, unique_email):
+    username, user_id = create_user(client, unique_username, unique_email, "mepass")
+    token = login_user(client, username, "mepass")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    with count_queries(app_engine) as statements:
+        response = client.get("/users/me", headers=headers)
+    assert (
+        response.status_code == 200
+    ), f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["username"] == username
+    assert len(statements) == 1
+
+
+def test_inactive_user_token_rejected(client, unique_username, unique_email):
+    username, user_id = create_user(client, unique_username, unique_email, "mepass")
+    token = app_jwt.create_access_token(
+        data={"sub": username, "uid": user_id, "active": False},
+        expires_delta=timedelta(minutes=5),
+    )
+
+    response = client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert (
+        response.status_code == 400
+    ), f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
 # def test_token_expiry(client, unique_username, unique_email):
 #     username, user_id = create_user(
 #         client, unique_username, unique_email, "adminpassword"
@@ -1,6 +1,10 @@
 import random
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
 from app.schemas import UserCreate
 from app.schemas import MagazineCreate
+from .conftest import SQLALCHEMY_DATABASE_URL
 
 
 def create_user(client, username, email, password):
@@ -58,3 +62,31 @@ def generate_random_plan_name():
     random_words = ["Silver", "Gold", "Platinum", "Diamond", "Titanium"]
     random_suffix = random.randint(1000, 9999)
     return f"{random.choice(random_words)} Plan {random_suffix}"
+
+
+@contextmanager
+def count_queries(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@contextmanager
+def foreign_key_session():
+    # The test database with foreign keys enforced, as PostgreSQL does
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    event.listen(
+        engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON")
+    )
+    try:
+        with Session(engine) as db:
+            yield db
+    finally:
+        engine.dispose()